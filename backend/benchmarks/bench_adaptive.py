@@ -0,0 +1,68 @@
+"""
+Time the question selection of the adaptive quiz over synthetic question
+banks indexed in memory, without a database: each game answers at random
+and every selection is timed, to show that its latency does not depend on
+the size of the bank.
+
+    python -m benchmarks.bench_adaptive --sizes 10000 100000 1000000
+"""
+import argparse
+import random
+import time
+
+from flaskr.adaptive_quiz import AdaptiveGame, next_question_id
+from flaskr.quiz import QuizIndex
+
+from .common import report, summarize, synthetic_questions
+
+
+def play(index, rng, categories, questions_per_game):
+    """Play one game and return the selection times in milliseconds."""
+    game = AdaptiveGame(rng.choice(categories))
+    samples = []
+    for _ in range(questions_per_game):
+        start = time.perf_counter()
+        question_id = next_question_id(index, game)
+        samples.append((time.perf_counter() - start) * 1000)
+        if question_id is None:
+            break
+        game.serve({'id': question_id, 'answer': 'answer'})
+        game.record_answer('answer' if rng.random() < 0.6 else 'wrong')
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--questions-per-game', type=int, default=50)
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    results = []
+    for size in args.sizes:
+        index = QuizIndex(max_age=float('inf'))
+        start = time.perf_counter()
+        index.load_rows(
+            (question_id, row['category'], row['difficulty'])
+            for question_id, row in enumerate(synthetic_questions(size), 1))
+        build_ms = round((time.perf_counter() - start) * 1000, 1)
+
+        # ALL_CATEGORIES and the categories of synthetic_questions
+        categories = list(range(0, 7))
+        samples = []
+        for _ in range(args.games):
+            samples.extend(play(index, rng, categories,
+                                args.questions_per_game))
+
+        result = {'size': size, 'build_ms': build_ms,
+                  'selections': len(samples)}
+        result.update(summarize(samples))
+        results.append(result)
+    report(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Time flaskr.autocomplete completions over synthetic question banks, built
+in memory without a database.
+
+    python -m benchmarks.bench_autocomplete --sizes 10000 100000 1000000
+
+the questions use a vocabulary of --vocabulary made-up words (0 for the
+80 words of the other benchmarks), so that the index holds as many
+distinct terms as real questions and answers give it.  build_ms is a
+reload of the whole index, as autocomplete() runs every
+AUTOCOMPLETE_MAX_AGE seconds, add_ms indexing the questions one by one.
+"""
+import argparse
+import random
+import time
+
+from flaskr.autocomplete import Autocomplete
+
+from .common import (WORDS, measure, report, summarize, synthetic_questions,
+                     synthetic_vocabulary)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--vocabulary', type=int, default=100000)
+    parser.add_argument('--max-terms', type=int, default=200000)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=1000)
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    words = synthetic_vocabulary(args.vocabulary) if args.vocabulary else WORDS
+    prefixes = [word[:length] for word in rng.sample(words, min(len(words), 100))
+                for length in (1, 2, 4)]
+    results = []
+    for size in args.sizes:
+        rows = [(question_id, row['question'], row['answer'])
+                for question_id, row in enumerate(
+                    synthetic_questions(size, words=words))]
+        index = Autocomplete(max_terms=args.max_terms)
+        start = time.perf_counter()
+        index.load_rows(rows)
+        build_ms = round((time.perf_counter() - start) * 1000, 1)
+
+        added = Autocomplete(max_terms=args.max_terms)
+        start = time.perf_counter()
+        for row in rows:
+            added.add(*row)
+        add_ms = round((time.perf_counter() - start) * 1000, 1)
+
+        result = {'size': size, 'terms': len(index),
+                  'dropped_terms': index.dropped_terms,
+                  'build_ms': build_ms, 'add_ms': add_ms}
+        result.update(summarize(measure(
+            lambda: index.complete(rng.choice(prefixes), args.limit),
+            args.repeat)))
+        results.append(result)
+    report(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
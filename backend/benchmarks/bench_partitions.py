@@ -0,0 +1,84 @@
+"""
+Time the category-routed reads against banks that grow by adding
+categories of a fixed size, so the partition of a category stays the
+same while the whole bank grows: the routed reads should stay flat and
+the reads of the whole table grow with it.
+
+    python -m benchmarks.bench_partitions --partition-size 10000 --sizes 10000 100000 1000000
+
+The merged keyset listing of QUESTION_PARTITIONING=category reads a page
+from every partition, so it grows with the number of categories instead;
+it is compared with the keyset page of the unpartitioned listing.  Run
+`flask partition-questions` on a PostgreSQL --database to time a
+partitioned table.
+"""
+import argparse
+
+from flaskr import create_app
+from flaskr.partitions import partition_query
+from models import Question
+
+from .common import BENCH_DATABASE_PATH, make_app, measure, report, seed
+from .suite import result_row, run
+
+
+def scenarios(partition_size, size):
+    """(name, QUESTION_PARTITIONING, [(method, path, JSON body)])"""
+    middle_page = max(1, partition_size // 10 // 2)
+    return [
+        ('category_deep_page', 'off', [
+            ('GET', '/categories/1/questions?page={}'.format(middle_page), None)]),
+        ('quiz_category', 'off', [('POST', '/quizzes', {
+            'previous_questions': [], 'quiz_category': {'id': 1}})]),
+        ('quiz_batch_category', 'off', [('POST', '/quizzes', {
+            'previous_questions': [], 'quiz_category': {'id': 1},
+            'batch_size': 5})]),
+        ('questions_deep_page', 'off', [
+            ('GET', '/questions?page={}'.format(max(1, size // 10 // 2)), None)]),
+        ('questions_keyset', 'off', [
+            ('GET', '/questions?after={}'.format(size // 2), None)]),
+        ('questions_keyset_merged', 'category', [
+            ('GET', '/questions?after={}'.format(size // 2), None)]),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--partition-size', type=int, default=10000,
+                        help='questions per category')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--database', default=BENCH_DATABASE_PATH)
+    parser.add_argument('--repeat', type=int, default=100)
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        categories = max(1, size // args.partition_size)
+        seed(make_app(args.database), size, categories)
+        app = create_app({'DATABASE_PATH': args.database,
+                          'DB_AUTO_MIGRATE': False,
+                          'ADMISSION_CONTROL': False})
+        # every request reaches the database
+        app.extensions['response_cache'] = None
+        client = app.test_client()
+
+        for name, partitioning, requests in scenarios(args.partition_size, size):
+            app.config['QUESTION_PARTITIONING'] = partitioning
+            result = result_row(size, name, *run(client, requests, args.repeat))
+            result['categories'] = categories
+            results.append(result)
+
+        with app.app_context():
+            for name, selection in (('count_partition', partition_query(1)),
+                                    ('count_table', Question.query)):
+                result = result_row(size, name, measure(
+                    selection.count, args.repeat), 0)
+                result['categories'] = categories
+                results.append(result)
+    report(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Compare recording answers with a commit each, the way Question.insert()
+writes, against the leaderboard's in-memory record and batched flush,
+then time the leaderboard reads over boards of growing player counts.
+
+    python -m benchmarks.bench_scores --answers 20000 --players 10000 100000 1000000
+"""
+import argparse
+import random
+import time
+from datetime import datetime
+
+from flaskr.leaderboard import Board, Leaderboard
+from models import db, Answer
+
+from .common import make_app, measure, report, seed, summarize
+
+
+def commit_each(answers):
+    for row in answers:
+        db.session.add(Answer(**row))
+        db.session.commit()
+
+
+def buffered(answers, flush_size):
+    board = Leaderboard(flush_interval=0)
+    board.load()
+    for number, row in enumerate(answers, 1):
+        board.record(row['session'], row['player'],
+                     [(row['question_id'], row['category'], row['correct'])])
+        if number % flush_size == 0:
+            board.flush()
+    board.flush()
+
+
+def synthetic_answers(count, players, rng):
+    now = datetime.utcnow()
+    return [{
+        'session': 'session {}'.format(number // 10),
+        'player': 'player {}'.format(rng.randrange(players)),
+        # an answer per question and session
+        'question_id': number % 1000 + 1,
+        'category': rng.randint(1, 6),
+        'correct': rng.random() < 0.5,
+        'answered_at': now,
+    } for number in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--answers', type=int, default=20000)
+    parser.add_argument('--flush-size', type=int, default=500)
+    parser.add_argument('--players', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    app = make_app()
+    results = []
+    for name, write in (('commit_each', commit_each),
+                        ('buffered', lambda answers: buffered(
+                            answers, args.flush_size))):
+        seed(app, 1000)
+        answers = synthetic_answers(args.answers, 1000, rng)
+        with app.app_context():
+            start = time.perf_counter()
+            write(answers)
+            elapsed = time.perf_counter() - start
+        results.append({'write': name, 'answers': args.answers,
+                        'answers_per_s': round(args.answers / elapsed, 1)})
+
+    for players in args.players:
+        totals = {'player {}'.format(number): (rng.randint(0, 500), 1)
+                  for number in range(players)}
+        start = time.perf_counter()
+        board = Board(totals)
+        build_ms = round((time.perf_counter() - start) * 1000, 1)
+        names = ['player {}'.format(rng.randrange(players)) for _ in range(1000)]
+        for read, fn in (('top_10', lambda: board.top(10)),
+                         ('rank', lambda: [board.player(name) for name in names]),
+                         ('add', lambda: [board.add(name, 1, 1) for name in names])):
+            samples = measure(fn, repeat=20)
+            if read != 'top_10':
+                # per player
+                samples = [sample / len(names) for sample in samples]
+            result = {'players': players, 'build_ms': build_ms, 'read': read}
+            result.update(summarize(samples))
+            results.append(result)
+    report(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
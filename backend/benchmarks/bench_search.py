@@ -0,0 +1,67 @@
+"""
+Compare the latency of a search page with the former ILIKE path (fetch
+every match, format all of them, slice the page) and with the search
+engines of flaskr.search.
+
+    python -m benchmarks.bench_search --sizes 10000 100000 1000000
+"""
+import argparse
+import time
+
+from flaskr.search import MemorySearchEngine, SqlSearchEngine
+from models import Question
+
+from .common import BENCH_DATABASE_PATH, make_app, measure, report, seed, summarize
+
+
+# frequent word, less frequent words, a short and an absent term
+TERMS = ('capital', 'famous river', 'ol', 'zebra')
+PAGE_SIZE = 10
+
+
+def ilike_page(term):
+    questions = Question.query.filter(
+        Question.question.ilike('%{}%'.format(term))).all()
+    formatted = [question.format() for question in questions]
+    return formatted[:PAGE_SIZE], len(formatted)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000])
+    parser.add_argument('--database', default=BENCH_DATABASE_PATH)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    app = make_app(args.database)
+    results = []
+    for size in args.sizes:
+        seed(app, size)
+        with app.app_context():
+            sql = SqlSearchEngine()
+            sql.install()
+            memory = MemorySearchEngine()
+            start = time.perf_counter()
+            memory.load()
+            build_ms = round((time.perf_counter() - start) * 1000, 1)
+
+            for term in TERMS:
+                paths = (
+                    ('ilike', lambda: ilike_page(term)),
+                    ('sql', lambda: sql.search(term, 0, PAGE_SIZE)),
+                    ('memory', lambda: memory.search(term, 0, PAGE_SIZE)),
+                )
+                for name, fn in paths:
+                    result = {'size': size, 'term': term, 'engine': name,
+                              'hits': fn()[1]}
+                    result.update(summarize(measure(fn, args.repeat)))
+                    if name == 'memory':
+                        result['index_build_ms'] = build_ms
+                    results.append(result)
+    report(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Compare the CPU cost of serializing a page of questions: ORM instances
+formatted one by one and passed to jsonify, against column-only rows
+encoded by flaskr.serialization (orjson when installed, MessagePack when
+installed).
+
+    python -m benchmarks.bench_serialization --page-sizes 10 100 1000
+"""
+import argparse
+import time
+from flask import jsonify
+
+from flaskr import serialization
+from flaskr.serialization import question_rows, format_rows, dumps
+from models import Question
+
+from .common import make_app, report, seed, summarize
+
+
+def cpu_measure(fn, repeat, warmup=2):
+    """Call fn repeat times and return the CPU times in milliseconds."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.process_time()
+        fn()
+        samples.append((time.process_time() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--page-sizes', type=int, nargs='+',
+                        default=[10, 100, 1000])
+    parser.add_argument('--size', type=int, default=10000,
+                        help='questions seeded')
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    app = make_app()
+    seed(app, args.size)
+
+    def orm_jsonify(page_size):
+        questions = Question.query.order_by(Question.id).limit(page_size).all()
+        return jsonify({'success': True, 'questions': [
+            question.format() for question in questions]}).get_data()
+
+    def columns(page_size):
+        rows = question_rows(Question.query).order_by(
+            Question.id).limit(page_size).all()
+        return dumps({'success': True, 'questions': format_rows(rows)})
+
+    def columns_msgpack(page_size):
+        rows = question_rows(Question.query).order_by(
+            Question.id).limit(page_size).all()
+        return serialization.msgpack.packb(
+            {'success': True, 'questions': format_rows(rows)},
+            use_bin_type=True)
+
+    variants = [('orm+jsonify', orm_jsonify), ('columns+' + (
+        'orjson' if serialization.orjson is not None else 'json'), columns)]
+    if serialization.msgpack is not None:
+        variants.append(('columns+msgpack', columns_msgpack))
+
+    results = []
+    with app.test_request_context():
+        for page_size in args.page_sizes:
+            for name, fn in variants:
+                result = {'page_size': page_size, 'path': name,
+                          'bytes': len(fn(page_size))}
+                result.update(summarize(cpu_measure(
+                    lambda: fn(page_size), args.repeat)))
+                results.append(result)
+    report(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
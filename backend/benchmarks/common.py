@@ -0,0 +1,107 @@
+import json
+import os
+import random
+import time
+from flask import Flask
+
+from models import setup_db, db, Question, Category
+
+
+# database the benchmarks seed and query, it is dropped and re-created;
+# absolute, as Flask-SQLAlchemy resolves a relative SQLite path against
+# the root of each app, which differs between make_app and create_app
+BENCH_DATABASE_PATH = os.getenv('BENCH_DATABASE_PATH', 'sqlite:///{}'.format(
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                 'benchmark.db')))
+
+WORDS = (
+    'capital city river mountain ocean country island desert lake king '
+    'queen empire war battle treaty painter novel poem film actor singer '
+    'album team cup league player record planet star element atom cell '
+    'organ bone blood virus medicine invention engine bridge tower palace '
+    'temple language currency flag animal bird insect flower tree famous '
+    'largest smallest oldest first last only which what who where when'
+).split()
+
+
+def make_app(database_path=BENCH_DATABASE_PATH):
+    """A bare app bound to the benchmark database, without the routes."""
+    app = Flask('benchmarks')
+    setup_db(app, database_path)
+    return app
+
+
+def synthetic_vocabulary(size, seed=0):
+    """size distinct made-up words of two to four syllables."""
+    rng = random.Random(seed)
+    syllables = [consonant + vowel for consonant in 'bcdfghklmnprstvz'
+                 for vowel in 'aeiou']
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choices(syllables, k=rng.randint(2, 4))))
+    return sorted(words)
+
+
+def synthetic_questions(size, categories=6, seed=0, words=WORDS):
+    rng = random.Random(seed)
+    for _ in range(size):
+        question = rng.choices(words, k=rng.randint(6, 14))
+        yield {
+            'question': ' '.join(question).capitalize() + '?',
+            'answer': ' '.join(rng.choices(words, k=rng.randint(1, 3))),
+            'category': rng.randint(1, categories),
+            'difficulty': rng.randint(1, 5),
+        }
+
+
+def seed(app, size, categories=6, seed=0, chunk_size=10000):
+    """Replace the questions and categories with a synthetic bank."""
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.execute(Category.__table__.insert(), [
+            {'type': 'Category {}'.format(i + 1)} for i in range(categories)])
+        chunk = []
+        for row in synthetic_questions(size, categories, seed):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                db.session.execute(Question.__table__.insert(), chunk)
+                chunk = []
+        if chunk:
+            db.session.execute(Question.__table__.insert(), chunk)
+        db.session.commit()
+
+
+def measure(fn, repeat=20, warmup=2):
+    """Call fn repeat times and return the wall times in milliseconds."""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def summarize(samples):
+    return {
+        'p50_ms': round(percentile(samples, 50), 3),
+        'p95_ms': round(percentile(samples, 95), 3),
+        'p99_ms': round(percentile(samples, 99), 3),
+    }
+
+
+def report(results, output=None):
+    """Print one line per result and optionally dump them as JSON."""
+    for result in results:
+        print('  '.join('{}={}'.format(key, value)
+                        for key, value in result.items()))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,137 @@
+"""
+Drive running servers with many concurrent keep-alive clients and report
+requests per second and latency percentiles, e.g. the sync WSGI app and
+the async ASGI app against the same local database:
+
+    ADMISSION_CONTROL=false gunicorn -w 8 -b 127.0.0.1:5000 'flaskr:create_app()'
+    uvicorn flaskr.asgi:app --workers 8 --port 5001
+    python -m benchmarks.loadtest --target sync=http://127.0.0.1:5000 \\
+        --target async=http://127.0.0.1:5001 --concurrency 50 500 5000
+
+5000 clients need as many open files: raise `ulimit -n` first.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit
+
+from .common import percentile, report
+
+
+# (method, path, JSON body) requests of a read-heavy trivia session
+SCENARIO = (
+    ('GET', '/categories', None),
+    ('GET', '/questions?page=1', None),
+    ('GET', '/questions?page=2', None),
+    ('GET', '/categories/1/questions', None),
+    ('POST', '/search', {'searchTerm': 'title'}),
+    ('POST', '/quizzes', {'previous_questions': [],
+                          'quiz_category': {'type': 'All', 'id': 0}}),
+)
+
+
+def encode_request(host, method, path, body):
+    data = json.dumps(body).encode() if body is not None else b''
+    head = '{} {} HTTP/1.1\r\nHost: {}\r\nConnection: keep-alive\r\n'.format(
+        method, path, host)
+    if body is not None:
+        head += 'Content-Type: application/json\r\n'
+    head += 'Content-Length: {}\r\n\r\n'.format(len(data))
+    return head.encode() + data
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    version, status = status_line.split()[:2]
+    keep_alive = version == b'HTTP/1.1'
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        name, value = name.strip().lower(), value.strip().lower()
+        if name == 'content-length':
+            length = int(value)
+        elif name == 'connection':
+            keep_alive = value == 'keep-alive'
+    await reader.readexactly(length)
+    return int(status), keep_alive
+
+
+async def client(url, requests, deadline, latencies, errors):
+    parts = urlsplit(url)
+    connection = None
+    while time.perf_counter() < deadline:
+        method, path, body = random.choice(requests)
+        try:
+            if connection is None:
+                connection = await asyncio.open_connection(
+                    parts.hostname, parts.port or 80)
+            reader, writer = connection
+            start = time.perf_counter()
+            writer.write(encode_request(parts.netloc, method, path, body))
+            await writer.drain()
+            status, keep_alive = await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status >= 500 or status == 429:
+                errors.append(status)
+            if not keep_alive:
+                writer.close()
+                connection = None
+        except (OSError, ConnectionError, asyncio.IncompleteReadError,
+                ValueError, IndexError):
+            errors.append('connection')
+            if connection is not None:
+                connection[1].close()
+            connection = None
+            await asyncio.sleep(0.01)
+    if connection is not None:
+        connection[1].close()
+
+
+async def run(url, concurrency, duration, requests=SCENARIO):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        client(url, requests, deadline, latencies, errors)
+        for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    samples = [latency * 1000 for latency in latencies] or [0]
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(samples, 50), 2),
+        'p99_ms': round(percentile(samples, 99), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--target', action='append', required=True,
+                        help='name=http://host:port, repeatable')
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[50, 500, 5000])
+    parser.add_argument('--duration', type=float, default=30,
+                        help='seconds per run')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    results = []
+    for target in args.target:
+        name, _, url = target.partition('=')
+        for concurrency in args.concurrency:
+            result = {'target': name, 'concurrency': concurrency}
+            result.update(asyncio.run(run(url, concurrency, args.duration)))
+            results.append(result)
+    report(results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+"""
+Drive the API's routes against seeded synthetic question banks: the
+listings, searches, autocomplete, the quizzes (batched, in sessions,
+adaptive), answer checks, scores and leaderboards, question creation
+and deletion and the bulk export and import.  Reports throughput and
+p50/p95/p99 latency per route, and the peak RSS of the process once per
+bank size, as a baseline to compare later runs with:
+
+    python -m benchmarks.suite --sizes 1000 100000 1000000 --output baseline.json
+    python -m benchmarks.suite --sizes 1000 100000 1000000 --baseline baseline.json
+
+A run compared with a baseline exits with status 1 when the p50 or p95
+of a route got slower than the baseline by more than --threshold percent.
+Requests go through the Flask test client, in process, so the numbers
+measure the app and the database rather than an HTTP server.  --memory
+traces the Python allocations and adds the peak of each route to its
+row; tracing slows every request, so compare such runs with each other
+only.
+"""
+import argparse
+import json
+import resource
+import sys
+import time
+import tracemalloc
+
+from flaskr import create_app
+
+from .common import (BENCH_DATABASE_PATH, WORDS, make_app, report, seed,
+                     summarize, synthetic_questions)
+
+
+# search terms from frequent to absent
+SEARCH_TERMS = ('capital', 'famous river', 'ol', 'zebra')
+
+# questions played by the long quiz sessions
+QUIZ_LENGTH = 50
+
+# questions posted by each bulk import
+IMPORT_SIZE = 100
+
+# players of the scores and leaderboard scenarios
+PLAYERS = 20
+
+
+def scenarios(size, categories):
+    """(name, [(method, path, JSON body)]) of the routes at a bank size;
+    the requests of a scenario are cycled through."""
+    last_page = max(1, size // 10)
+    middle_id = size // 2
+    category_last_page = max(1, size // categories // 10)
+    played = list(range(1, min(size, 500), 5))
+    answered = list(range(1, size + 1, max(1, size // 5)))[:5]
+    return [
+        ('categories', [('GET', '/categories', None)]),
+        ('questions_first_page', [('GET', '/questions?page=1', None)]),
+        ('questions_deep_page', [
+            ('GET', '/questions?page={}'.format(last_page // 2), None)]),
+        ('questions_keyset', [
+            ('GET', '/questions?after={}'.format(middle_id), None)]),
+        ('category_first_page', [
+            ('GET', '/categories/{}/questions'.format(c), None)
+            for c in range(1, categories + 1)]),
+        ('category_deep_page', [
+            ('GET', '/categories/{}/questions?page={}'.format(
+                c, category_last_page // 2), None)
+            for c in range(1, categories + 1)]),
+    ] + [
+        ('search_' + term.replace(' ', '_'), [
+            ('POST', '/search', {'searchTerm': term})])
+        for term in SEARCH_TERMS
+    ] + [
+        ('autocomplete', [
+            ('GET', '/search/autocomplete?q={}'.format(word[:2]), None)
+            for word in WORDS]),
+        ('quiz', [('POST', '/quizzes', {
+            'previous_questions': [], 'quiz_category': {'id': 0}})]),
+        ('quiz_long_history', [('POST', '/quizzes', {
+            'previous_questions': played, 'quiz_category': {'id': 1}})]),
+        ('quiz_batch', [('POST', '/quizzes', {
+            'previous_questions': [], 'quiz_category': {'id': 0},
+            'batch_size': 5})]),
+        ('quiz_verify', [('POST', '/quizzes/verify', {
+            'answers': [{'id': id, 'answer': 'capital'} for id in answered]})]),
+        # a new scoring session per request, so no answer is skipped
+        ('scores', [('POST', '/scores', {
+            'player': 'player-{}'.format(player),
+            'answers': [{'id': id, 'answer': 'capital'} for id in answered]})
+            for player in range(PLAYERS)]),
+        ('leaderboard', [('GET', '/leaderboard', None),
+                         ('GET', '/leaderboard?category=1', None)]),
+        ('leaderboard_player', [
+            ('GET', '/leaderboard/players/player-{}'.format(player), None)
+            for player in range(PLAYERS)]),
+    ]
+
+
+def run(client, requests, repeat, warmup=2):
+    """Send repeat requests cycling through requests; return the latencies
+    in milliseconds and the number of failed requests."""
+    samples, failures = [], 0
+    for number in range(warmup + repeat):
+        method, path, body = requests[number % len(requests)]
+        start = time.perf_counter()
+        response = client.open(path, method=method, json=body, buffered=True)
+        elapsed = time.perf_counter() - start
+        if number >= warmup:
+            samples.append(elapsed * 1000)
+            failures += response.status_code >= 400
+    return samples, failures
+
+
+def quiz_session(client, repeat):
+    """Play repeat long quiz sessions, timing every next question."""
+    samples, failures = [], 0
+    for _ in range(repeat):
+        response = client.post('/quizzes/sessions',
+                               json={'quiz_category': {'id': 0}})
+        token = response.get_json()['session_id']
+        for _ in range(QUIZ_LENGTH):
+            start = time.perf_counter()
+            response = client.post('/quizzes/sessions/{}/next'.format(token))
+            samples.append((time.perf_counter() - start) * 1000)
+            failures += response.status_code >= 400
+    return samples, failures
+
+
+def adaptive_quiz(client, repeat):
+    """Play repeat adaptive quizzes of up to QUIZ_LENGTH questions,
+    timing every answer."""
+    samples, failures = [], 0
+    for _ in range(repeat):
+        response = client.post('/quizzes/adaptive',
+                               json={'quiz_category': {'id': 0}})
+        token = response.get_json()['session_id']
+        for number in range(QUIZ_LENGTH):
+            start = time.perf_counter()
+            response = client.post(
+                '/quizzes/adaptive/{}/answer'.format(token),
+                json={'answer': 'capital' if number % 3 else 'wrong'})
+            samples.append((time.perf_counter() - start) * 1000)
+            failures += response.status_code >= 400
+            if response.get_json()['question'] is None:
+                break
+    return samples, failures
+
+
+def bulk_import(client, repeat):
+    """POST repeat NDJSON imports of IMPORT_SIZE questions each."""
+    samples, failures = [], 0
+    for number in range(repeat):
+        body = '\n'.join(json.dumps(row) for row in synthetic_questions(
+            IMPORT_SIZE, seed=number + 1))
+        start = time.perf_counter()
+        response = client.post('/questions/bulk?format=ndjson', data=body)
+        samples.append((time.perf_counter() - start) * 1000)
+        failures += response.status_code >= 400
+    return samples, failures
+
+
+def create_and_delete(client, repeat):
+    """Create a question and delete it, timing both writes."""
+    samples, failures = [], 0
+    question = {'question': 'Benchmark question?', 'answer': 'answer',
+                'category': 1, 'difficulty': 1}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.post('/questions', json=question)
+        samples.append((time.perf_counter() - start) * 1000)
+        failures += response.status_code >= 400
+        created = (response.get_json() or {}).get('created')
+        start = time.perf_counter()
+        response = client.delete('/questions/{}'.format(created))
+        samples.append((time.perf_counter() - start) * 1000)
+        failures += response.status_code >= 400
+    return samples, failures
+
+
+def peak_rss_mb():
+    """The peak RSS of the process so far: ru_maxrss never goes down, so
+    it is only reported once per bank size, the sizes in increasing order."""
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def result_row(size, route, samples, failures):
+    result = {'size': size, 'route': route, 'requests': len(samples),
+              'failures': failures,
+              'rps': round(len(samples) / (sum(samples) / 1000), 1)
+              if sum(samples) else 0}
+    result.update(summarize(samples))
+    return result
+
+
+def traced(memory, size, route, benchmark):
+    """The result_row of benchmark(), with the peak of the Python memory
+    allocated while it ran when memory is set (tracemalloc running)."""
+    if memory:
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        else:
+            # Python 3.8: restarting clears the traces and the peak
+            tracemalloc.stop()
+            tracemalloc.start()
+        allocated = tracemalloc.get_traced_memory()[0]
+    result = result_row(size, route, *benchmark())
+    if memory:
+        result['peak_alloc_mb'] = round(
+            (tracemalloc.get_traced_memory()[1] - allocated) / (1024 * 1024), 1)
+    return result
+
+
+def regressions(results, baseline, threshold):
+    """Lines describing the routes slower than baseline by more than
+    threshold percent."""
+    previous = {(row['size'], row['route']): row for row in baseline}
+    found = []
+    for row in results:
+        before = previous.get((row['size'], row['route']))
+        # the peak_rss rows have no latencies
+        if before is None or 'p50_ms' not in row or 'p50_ms' not in before:
+            continue
+        for metric in ('p50_ms', 'p95_ms'):
+            if before[metric] and \
+                    row[metric] > before[metric] * (1 + threshold / 100):
+                found.append('{} at {} questions: {} {} ms, baseline {} ms'.format(
+                    row['route'], row['size'], metric, row[metric],
+                    before[metric]))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--categories', type=int, default=6)
+    parser.add_argument('--database', default=BENCH_DATABASE_PATH)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--routes', nargs='+',
+                        help='only the routes whose name starts with these')
+    parser.add_argument('--no-response-cache', action='store_true',
+                        help='measure the listings without the response cache')
+    parser.add_argument('--memory', action='store_true',
+                        help='trace the peak Python allocations of each route')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=20,
+                        help='percent of slowdown failing the run')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    def selected(name):
+        return not args.routes or name.startswith(tuple(args.routes))
+
+    if args.memory:
+        tracemalloc.start()
+    results = []
+    for size in args.sizes:
+        seed(make_app(args.database), size, args.categories)
+        # the seeded schema is already the latest one
+        # one client sends every request, past any rate limit
+        app = create_app({'DATABASE_PATH': args.database,
+                          'DB_AUTO_MIGRATE': False,
+                          'ADMISSION_CONTROL': False})
+        if args.no_response_cache:
+            app.extensions['response_cache'] = None
+        client = app.test_client()
+
+        benchmarks = [
+            (name, lambda requests=requests: run(client, requests, args.repeat))
+            for name, requests in scenarios(size, args.categories)
+        ] + [
+            ('quiz_session', lambda: quiz_session(
+                client, max(1, args.repeat // QUIZ_LENGTH))),
+            ('quiz_adaptive', lambda: adaptive_quiz(
+                client, max(1, args.repeat // QUIZ_LENGTH))),
+            ('create_delete', lambda: create_and_delete(
+                client, args.repeat // 2)),
+            # the whole bank per request
+            ('bulk_export', lambda: run(
+                client, [('GET', '/questions/export', None)],
+                max(1, args.repeat // 100), warmup=0)),
+            # last, as it grows the bank
+            ('bulk_import', lambda: bulk_import(
+                client, max(1, args.repeat // 20))),
+        ]
+        for name, benchmark in benchmarks:
+            if selected(name):
+                results.append(traced(args.memory, size, name, benchmark))
+        results.append({'size': size, 'route': 'peak_rss',
+                        'peak_rss_mb': peak_rss_mb()})
+    report(results, args.output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.threshold)
+        for line in found:
+            print('REGRESSION', line)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,31 +1,153 @@
 import os
-from flask import Flask, request, abort, jsonify
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, Response, request, abort, jsonify
 from flask_cors import CORS
+from sqlalchemy import func
 import random
 import json
 import sys
 
-from models import setup_db, Question, Category
-
-db = SQLAlchemy()
+from models import setup_db, db, pool_status, read_replica, Question, Category, DB_PATH
+from .adaptive_quiz import (init_adaptive_quiz, adaptive_games, AdaptiveGame,
+                            serve_next, without_answer, normalize_answer,
+                            ADAPTIVE_START_DIFFICULTY)
+from .admission import init_admission, admission_control, retry_after_headers
+from .autocomplete import init_autocomplete, autocomplete
+from .bulk import (init_bulk, import_questions, export_response,
+                   BULK_CHUNK_SIZE, FORMATS)
+from .category_cache import init_category_cache, category_cache
+from .counts import init_question_counts, question_counts
+from .leaderboard import (init_leaderboard, leaderboard, LEADERBOARD_SIZE,
+                          MAX_LEADERBOARD_SIZE)
+from .metrics import init_metrics, metrics, finish_request
+from .migrations import init_migrations
+from .partitions import (init_partitions, partitioning, partition_query,
+                         get_question, merged_rows)
+from .query_audit import init_query_audit, audit_request
+from .quiz import init_quiz, quiz_index
+from .quiz_sessions import init_quiz_sessions, quiz_sessions, new_token
+from .response_cache import init_response_cache, response_cache, cached_response
+from .search import init_search, search_engine
+from .serialization import (question_rows, format_rows, load_questions,
+                            api_response)
+from .tombstones import init_tombstones, question_purger, delete_questions
+from .write_behind import init_write_behind, question_writer
 
 
 QUESTIONS_PER_PAGE = 10
-
-def paginate_questions(request, selection):
+MAX_COMPLETIONS = 20
+MAX_QUIZ_BATCH = 20
+MAX_PLAYER_LENGTH = 64
+
+"""
+paginate_questions(request, selection, total_questions=None)
+    pages through a Question query in SQL instead of slicing a full fetch,
+    reading plain column rows rather than ORM instances.
+
+    ?page=N       LIMIT/OFFSET page (1-based)
+    ?after=<id>   keyset page of the questions with an id greater than <id>
+    ?before=<id>  keyset page of the questions with an id lower than <id>
+
+    returns the formatted questions of the page, the total number of
+    questions matching the selection (one COUNT unless the caller already
+    knows it) and the cursors to pass as ?after= / ?before= to get the
+    next / previous page (None at the ends).
+
+    with partitions, the category ids of a listing of all the questions,
+    the keyset pages are merged from the first rows of each category's
+    partition (see flaskr.partitions.merged_rows).
+"""
+def paginate_questions(request, selection, total_questions=None, partitions=None):
     page = request.args.get("page", 1, type=int)
-    start = (page - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-    questions = [question.format() for question in selection]
-    current_questions = questions[start:end]
-    
-    return current_questions
+    after = request.args.get("after", None, type=int)
+    before = request.args.get("before", None, type=int)
+
+    if total_questions is None:
+        total_questions = selection.with_entities(
+            func.count(Question.id)).order_by(None).scalar()
+
+    selection = question_rows(selection)
+
+    # one extra row tells us whether there is a page after this one
+    if partitions is not None and (after is not None or before is not None):
+        rows = merged_rows(partitions, after=after, before=before,
+                           limit=QUESTIONS_PER_PAGE + 1)
+        if after is not None:
+            has_next, has_prev = len(rows) > QUESTIONS_PER_PAGE, True
+            rows = rows[:QUESTIONS_PER_PAGE]
+        else:
+            has_next, has_prev = True, len(rows) > QUESTIONS_PER_PAGE
+            rows = rows[:QUESTIONS_PER_PAGE][::-1]
+    elif after is not None:
+        rows = selection.filter(Question.id > after).order_by(
+            Question.id.asc()).limit(QUESTIONS_PER_PAGE + 1).all()
+        has_next = len(rows) > QUESTIONS_PER_PAGE
+        has_prev = True
+        rows = rows[:QUESTIONS_PER_PAGE]
+    elif before is not None:
+        rows = selection.filter(Question.id < before).order_by(
+            Question.id.desc()).limit(QUESTIONS_PER_PAGE + 1).all()
+        has_prev = len(rows) > QUESTIONS_PER_PAGE
+        has_next = True
+        rows = rows[:QUESTIONS_PER_PAGE][::-1]
+    elif page < 1:
+        rows, has_next, has_prev = [], False, False
+    else:
+        start = (page - 1) * QUESTIONS_PER_PAGE
+        rows = selection.order_by(Question.id).offset(start).limit(
+            QUESTIONS_PER_PAGE + 1).all()
+        has_next = len(rows) > QUESTIONS_PER_PAGE
+        has_prev = start > 0
+        rows = rows[:QUESTIONS_PER_PAGE]
+
+    questions = format_rows(rows)
+
+    return {
+        'questions': questions,
+        'total_questions': total_questions,
+        'next_cursor': rows[-1].id if rows and has_next else None,
+        'prev_cursor': rows[0].id if rows and has_prev else None
+    }
+
+def is_id(value):
+    """Whether a JSON value is an id: an integer, not a boolean."""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+"""
+search_questions(request, search_term)
+    returns the ?page=N page of the questions containing search_term,
+    ranked by the configured search engine, and the total number of hits.
+"""
+def search_questions(request, search_term):
+    page = request.args.get("page", 1, type=int)
+    if page < 1:
+        return [], 0
+    return search_engine().search(
+        search_term, (page - 1) * QUESTIONS_PER_PAGE, QUESTIONS_PER_PAGE)
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    if test_config is not None:
+        # e.g. {'DATABASE_PATH': ..., 'DB_AUTO_MIGRATE': False}
+        app.config.update(test_config)
+    setup_db(app, app.config.get('DATABASE_PATH', DB_PATH))
+    init_migrations(app)
+    init_metrics(app)
+    init_query_audit(app)
+    init_admission(app)
+    init_category_cache(app)
+    init_quiz(app)
+    init_question_counts(app)
+    init_quiz_sessions(app)
+    init_adaptive_quiz(app)
+    init_leaderboard(app)
+    init_search(app)
+    init_autocomplete(app)
+    init_bulk(app)
+    init_response_cache(app)
+    init_tombstones(app)
+    init_write_behind(app)
+    init_partitions(app)
 
     """
     @TODO: Set up CORS. Allow '*' for origins. Delete the sample route after completing the TODOs
@@ -41,7 +163,8 @@ def create_app(test_config=None):
     def after_request(response):
         response.headers.add('Access-Control-Allow-Headers', 'Content-type, Authorization, true')
         response.headers.add('Access-Control-Allow-Methods', 'GET, POST, PATCH, DELETE, OPTIONS')
-        
+        # query budgets, per-route metrics and X-Profile dumps, when enabled
+        return finish_request(audit_request(response))
 
     """
     @TODO:
@@ -50,23 +173,21 @@ def create_app(test_config=None):
     """
     
     @app.route("/categories", methods=["GET"])
+    @read_replica
     def get_all_categories():
         if request.method == "GET":
-            categories = Category.query.order_by(Category.id).all()
-            category_dict = {}
+            # the body is encoded once per version of the categories
+            body, etag = category_cache().encoded()
 
-            #Create a dictionary of all categories
-            
-            for category in categories:
-                category_dict[category.id] = category.type
-
-            if (len(category_dict) == 0):
+            if (len(category_cache().categories()) == 0):
                 abort(404)
 
-            return jsonify({
-                'categories': category_dict,
-                'success': True
-            })
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                response = Response(body, mimetype='application/json')
+            response.set_etag(etag)
+            return response
             
    
     """
@@ -83,37 +204,37 @@ def create_app(test_config=None):
     """
     
     @app.route('/questions')
+    @read_replica
+    @cached_response
     def get_questions():
         if request.method == "GET":
-            # get all the questions and paginate
-            questions = Question.query.all()
-            all_questions = len(questions)
-            paginated_questions = paginate_questions(request, questions)
+            # paginate the questions in the database, merging the category
+            # partitions when QUESTION_PARTITIONING is on
+            page = paginate_questions(
+                request, Question.query, question_counts().total(),
+                list(category_cache().categories()) if partitioning() else None)
 
             # If no questions are found abort
-            if (len(paginated_questions) == 0):
+            if (len(page['questions']) == 0):
                 abort(404)
 
             try:
-                # Get all categories and put them in a dict
-                categories = Category.query.all()
-                categories_dict = {}
-                for category in categories:
-                    categories_dict[category.id] = category.type
+                # Get all categories as a dict
+                categories_dict = category_cache().categories()
 
                 # return to view in json
-                return jsonify({
+                return api_response({
                     'success': True,
-                    'questions': paginated_questions,
-                    'total_questions': all_questions,
+                    'questions': page['questions'],
+                    'total_questions': page['total_questions'],
+                    'next_cursor': page['next_cursor'],
+                    'prev_cursor': page['prev_cursor'],
                     'categories': categories_dict
                 })
             except:
                 db.session.rollback()
                 print(sys.exc_info())
                 abort(422)
-            finally:
-                db.session.close()
     
 
     """
@@ -128,24 +249,55 @@ def create_app(test_config=None):
     def delete_question(id):
         if request.method == "DELETE":
             try:
-                #get one question by id
-                question = Question.query.filter_by(id=id).one_or_none()
-                all_questions = len(Question.query.all())
-                
-                if question is None:
-                    abort(404)
-
-                question.delete()
-                
-                return jsonify({
-                    'deleted': id,
-                    'success': True,
-                    'total_questions': all_questions
-                })
+                # a single UPDATE setting the tombstone, the row is purged later
+                deleted = delete_questions(ids=[id])
             except:
-                abort(422)            
-            
-    
+                db.session.rollback()
+                abort(422)
+
+            if not deleted:
+                abort(404)
+
+            return jsonify({
+                'deleted': id,
+                'success': True,
+                'total_questions': question_counts().total()
+            })
+
+    """
+    Bulk delete: the questions of an id list, or of a category, are
+    soft-deleted in batches of DELETE_BATCH_SIZE, each its own short
+    transaction; the purger removes their rows in the background.
+    """
+
+    @app.route('/questions/bulk', methods=['DELETE'])
+    def bulk_delete_questions():
+        body = request.get_json(silent=True) or {}
+        ids = body.get('ids')
+        category = body.get('category', request.args.get('category', type=int))
+        if (ids is None) == (category is None):
+            abort(400)
+        if ids is not None and (not isinstance(ids, list) or not ids or
+                                not all(is_id(id) for id in ids)):
+            abort(400)
+        if category is not None:
+            if not is_id(category):
+                abort(400)
+            if category not in category_cache().categories():
+                abort(404)
+
+        try:
+            deleted = delete_questions(ids=ids, category=category)
+        except Exception:
+            db.session.rollback()
+            print(sys.exc_info())
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'deleted': len(deleted),
+            'total_questions': question_counts().total()
+        })
 
     """
     @TODO:
@@ -167,37 +319,92 @@ def create_app(test_config=None):
             difficulty = body.get('difficulty', None)
             category = body.get('category',  None)
             searchTerm = body.get('searchTerm', None)
+            if not searchTerm and None in (question, answer, difficulty, category):
+                abort(400)
             try:
                 if searchTerm:
-                    questions = Question.query.filter(Question.question.ilike(f"%{searchTerm}%")).all()
-                    paginated_questions = paginate_questions(request, questions)
+                    questions, total_questions = search_questions(request, searchTerm)
                     
-                    return jsonify({
+                    return api_response({
                         'success': True,
-                        'questions': paginated_questions,
-                        'total_questions': len(paginated_questions)
+                        'questions': questions,
+                        'total_questions': total_questions
+                    })
+                elif question_writer() is not None:
+                    # committed with the questions of concurrent requests,
+                    # only the created row is returned
+                    q = question_writer().insert(question, answer, category, difficulty)
+
+                    return api_response({
+                        'success': True,
+                        'question_created': q['question'],
+                        'created': q['id'],
+                        'question': q,
+                        'total_questions': question_counts().total()
                     })
                 else:                  
-                    q = Question(question=question, answer=answer, difficulty=difficulty, category=category)
-                    q.insert()
+                    # the formatted row, read before the commit expires it
+                    q = Question(question=question, answer=answer, difficulty=difficulty, category=category).insert()
 
-                    questions = Question.query.order_by(Question.id).all()
-                    paginated_questions = paginate_questions(request, questions)
-                    all_questions = len(Question.query.all())
+                    page = paginate_questions(
+                        request, Question.query, question_counts().total())
 
-                    return jsonify({
+                    return api_response({
                         'success': True,
-                        'question_created': q.question,
-                        'created': q.id,
-                        'questions': paginated_questions,
-                        'total_questions': all_questions
+                        'question_created': q['question'],
+                        'created': q['id'],
+                        'questions': page['questions'],
+                        'total_questions': page['total_questions'],
+                        'next_cursor': page['next_cursor'],
+                        'prev_cursor': page['prev_cursor']
                     })
                 
             except:
+                db.session.rollback()
+                print(sys.exc_info())
                 abort(422)
     
     
 
+    """
+    Bulk import and export: NDJSON (application/x-ndjson) or CSV (text/csv)
+    bodies are streamed, validated and inserted chunk by chunk; the export
+    streams the table from a server-side cursor.
+    """
+
+    @app.route('/questions/bulk', methods=['POST'])
+    def bulk_import_questions():
+        format = request.args.get('format', None)
+        if format is None:
+            format = 'csv' if request.mimetype == 'text/csv' else 'ndjson'
+        chunk_size = request.args.get('chunk_size', BULK_CHUNK_SIZE, type=int)
+        method = request.args.get('method', 'executemany')
+        if format not in FORMATS or chunk_size < 1 or \
+                method not in ('executemany', 'copy'):
+            abort(400)
+
+        try:
+            summary = import_questions(request.stream, format, chunk_size, method)
+        except Exception:
+            print(sys.exc_info())
+            abort(422)
+
+        return jsonify({
+            'success': True,
+            'imported': summary['imported'],
+            'rejected': summary['rejected'],
+            'chunks': summary['chunks'],
+            'errors': summary['errors']
+        })
+
+    @app.route('/questions/export', methods=['GET'])
+    @read_replica
+    def export_all_questions():
+        format = request.args.get('format', 'ndjson')
+        if format not in FORMATS:
+            abort(400)
+        return export_response(format)
+
     """
     @TODO:
     Create a POST endpoint to get questions based on a search term.
@@ -210,24 +417,40 @@ def create_app(test_config=None):
     """
     
     @app.route('/search', methods=['POST'])
+    @read_replica
     def search():
-        body = request.get_json()
+        body = request.get_json(silent=True) or {}
         searchTerm = body.get('searchTerm', None)
-        questions = Question.query.filter(Question.question.ilike(f"%{searchTerm}%")).all()
-        paginated_questions = paginate_questions(request, questions)
+        if searchTerm is None:
+            abort(400)
+        questions, total_questions = search_questions(request, searchTerm)
         
+        return api_response({
+            'success': True,
+            'questions': questions,
+            'total_questions': total_questions
+        })
+
+    """
+    Search-as-you-type: completions of the words and answers of the
+    questions for a prefix, served from memory.
+    """
+
+    @app.route('/search/autocomplete', methods=['GET'])
+    @read_replica
+    def autocomplete_search():
+        prefix = request.args.get('q', None)
+        limit = request.args.get('limit', 10, type=int)
+        if prefix is None or limit < 1:
+            abort(400)
+
+        completions = autocomplete().complete(
+            prefix, min(limit, MAX_COMPLETIONS))
+
         return jsonify({
             'success': True,
-            'questions': paginated_questions,
-            'total_questions': len(paginated_questions)
+            'completions': completions
         })
-        
-        # questions = [question.format() for question in Question.query.all() if
-        #              re.search(search_term, question.question, re.IGNORECASE)]
-        # return jsonify({
-        #     'questions': questions,
-        #     'total_questions': len(questions)
-        # })
 
     """
     @TODO:
@@ -239,20 +462,27 @@ def create_app(test_config=None):
     """
     
     @app.route('/categories/<int:category_id>/questions', methods=['GET'])
+    @read_replica
+    @cached_response
     def get_questions_by_category(category_id):
         if request.method == "GET":
-            category = Category.query.filter_by(id=category_id).one_or_none()
-            if category is None:
+            # the category is looked up in the cached {id: type} dict
+            categories = category_cache().categories()
+            if category_id not in categories:
                 abort(404)
             try:
-                questions = Question.query.filter_by(category=category.id).all()
-                paginated_questions = paginate_questions(request, questions)
+                # only the partition of the category is read
+                questions = partition_query(category_id)
+                page = paginate_questions(
+                    request, questions, question_counts().total(category_id))
 
-                return jsonify({
+                return api_response({
                     'success': True,
-                    'total_questions': len(Question.query.all()),
-                    'current_category': category.type,
-                    'questions': paginated_questions
+                    'total_questions': page['total_questions'],
+                    'current_category': categories[category_id],
+                    'questions': page['questions'],
+                    'next_cursor': page['next_cursor'],
+                    'prev_cursor': page['prev_cursor']
                 })
 
             except:
@@ -272,6 +502,7 @@ def create_app(test_config=None):
     """
     
     @app.route('/quizzes', methods=['POST'])
+    @read_replica
     def play_quiz_game():
         if request.method == "POST":
             data = dict(request.form or request.json or request.data)
@@ -283,16 +514,44 @@ def create_app(test_config=None):
                     'success': False,
                     'error': 'Missing params.'
                 }), 400
-            else:
-                if category['id'] == 0:
-                    selected_question = Question.query.filter(
-                        Question.id.notin_(previous_questions)
-                    ).limit(1).one_or_none()
+            elif data.get('batch_size') is not None:
+                # the next batch_size questions in one round trip, loaded
+                # with a single query
+                batch_size = data['batch_size']
+                if not isinstance(batch_size, int) or \
+                        not 1 <= batch_size <= MAX_QUIZ_BATCH:
+                    abort(400)
+                question_ids = quiz_index().draw_many(
+                    category['id'], previous_questions, batch_size)
+                questions = load_questions(
+                    question_ids, partition_query(category['id']))
+                if data.get('withhold_answers'):
+                    questions = [without_answer(question) for question in questions]
+
+                if questions:
+                    return jsonify({
+                        'success': True,
+                        'question': questions[0],
+                        'questions': questions
+                    })
                 else:
-                    selected_question = Question.query.filter_by(
-                        category=category['id']).filter(
-                        Question.id.notin_(previous_questions)
-                    ).limit(1).one_or_none()
+                    return json.dumps({
+                        'success': False,
+                        'error': 'Question not found.'
+                    }), 404
+            else:
+                # draw from the in-memory index, the database is only hit
+                # to load the drawn question
+                seen = set(previous_questions)
+                selected_question = None
+                while selected_question is None:
+                    question_id = quiz_index().draw(category['id'], seen)
+                    if question_id is None:
+                        break
+                    selected_question = get_question(question_id, category['id'])
+                    if selected_question is None:
+                        # deleted by another worker since the index was built
+                        seen.add(question_id)
 
                 if selected_question:
                     return jsonify({
@@ -305,6 +564,315 @@ def create_app(test_config=None):
                         'error': 'Question not found.'
                     }), 404
 
+    """
+    Checks the answers of a batch fetched with withhold_answers, all of
+    them in one request and one query.
+    """
+
+    @app.route('/quizzes/verify', methods=['POST'])
+    @read_replica
+    def verify_quiz_answers():
+        body = request.get_json(silent=True) or {}
+        answers = body.get('answers')
+        if not isinstance(answers, list) or not answers or \
+                len(answers) > MAX_QUIZ_BATCH or \
+                not all(isinstance(item, dict) and isinstance(item.get('id'), int)
+                        for item in answers):
+            abort(400)
+
+        # questions deleted since the batch was served are still checked
+        expected = dict(db.session.query(Question.id, Question.answer).filter(
+            Question.id.in_([item['id'] for item in answers])).execution_options(
+                include_deleted=True).all())
+
+        return jsonify({
+            'success': True,
+            'results': [{
+                'id': item['id'],
+                'correct': item['id'] in expected and normalize_answer(
+                    item.get('answer', '')) == normalize_answer(expected[item['id']]),
+                'answer': expected.get(item['id'])
+            } for item in answers]
+        })
+
+    """
+    Quiz sessions: the order of a random sample of the category, up to
+    QUIZ_SESSION_QUESTIONS long, and the position in it are
+    kept server side, so a game is started once for a category and each
+    following question is served by the session token alone.
+    """
+
+    @app.route('/quizzes/sessions', methods=['POST'])
+    @read_replica
+    def start_quiz_session():
+        body = request.get_json(silent=True) or {}
+        category = body.get('quiz_category')
+        if not category:
+            abort(400)
+
+        question_ids = quiz_index().sample(
+            category.get('id', 0), app.config['QUIZ_SESSION_QUESTIONS'])
+        token = quiz_sessions().create(question_ids)
+
+        return jsonify({
+            'success': True,
+            'session_id': token,
+            'total_questions': len(question_ids)
+        })
+
+    @app.route('/quizzes/sessions/<token>/next', methods=['POST'])
+    @read_replica
+    def next_quiz_session_question(token):
+        selected_question = None
+        while selected_question is None:
+            try:
+                question_id = quiz_sessions().next_id(token)
+            except KeyError:
+                abort(404)
+            if question_id is None:
+                break
+            # None when the question was deleted after the session started
+            selected_question = Question.query.get(question_id)
+
+        if selected_question:
+            return jsonify({
+                'success': True,
+                'question': selected_question.format()
+            })
+        else:
+            return json.dumps({
+                'success': False,
+                'error': 'Question not found.'
+            }), 404
+
+    """
+    Adaptive quiz: the server checks each answer and serves the next
+    question from a harder bucket after a streak of correct answers, from
+    an easier one after a wrong answer.  Answers are only sent back once
+    the player has answered.
+    """
+
+    @app.route('/quizzes/adaptive', methods=['POST'])
+    @read_replica
+    def start_adaptive_quiz():
+        body = request.get_json(silent=True) or {}
+        category = body.get('quiz_category')
+        difficulty = body.get('difficulty', ADAPTIVE_START_DIFFICULTY)
+        if not category or not isinstance(difficulty, int):
+            abort(400)
+
+        game = AdaptiveGame(category.get('id', 0), difficulty)
+        question = serve_next(quiz_index(), game)
+        if question is None:
+            return json.dumps({
+                'success': False,
+                'error': 'Question not found.'
+            }), 404
+
+        return jsonify({
+            'success': True,
+            'session_id': adaptive_games().create(game),
+            'difficulty': game.difficulty,
+            'streak': game.streak,
+            'question': without_answer(question)
+        })
+
+    @app.route('/quizzes/adaptive/<token>/answer', methods=['POST'])
+    @read_replica
+    def answer_adaptive_quiz(token):
+        body = request.get_json(silent=True) or {}
+        answer = body.get('answer')
+        if answer is None:
+            abort(400)
+        try:
+            game = adaptive_games().get(token)
+        except KeyError:
+            abort(404)
+        if game.question_id is None:
+            # the game is over
+            abort(404)
+
+        expected = game.answer
+        correct = game.record_answer(answer)
+        question = serve_next(quiz_index(), game)
+        adaptive_games().save(token, game)
+
+        return jsonify({
+            'success': True,
+            'correct': correct,
+            'answer': expected,
+            'difficulty': game.difficulty,
+            'streak': game.streak,
+            'question': without_answer(question) if question else None
+        })
+
+    """
+    Scores: the answers of a player are checked server side and recorded
+    under a session id, the first request of a game getting a new one; a
+    question scores once per session.
+    Recording only touches memory, the answers and points being written in
+    batches by the leaderboard's flusher; the leaderboards are read from
+    memory too.
+    """
+
+    @app.route('/scores', methods=['POST'])
+    def record_scores():
+        body = request.get_json(silent=True) or {}
+        player = body.get('player')
+        session_id = body.get('session_id') or new_token()
+        answers = body.get('answers')
+        if not isinstance(player, str) or not player.strip() or \
+                len(player) > MAX_PLAYER_LENGTH or \
+                not isinstance(session_id, str) or \
+                not isinstance(answers, list) or not answers or \
+                len(answers) > MAX_QUIZ_BATCH or \
+                not all(isinstance(item, dict) and isinstance(item.get('id'), int)
+                        for item in answers):
+            abort(400)
+        player = player.strip()
+        if len({item['id'] for item in answers}) < len(answers):
+            # a question scores once per session
+            abort(400)
+
+        expected = {question_id: (answer, category) for question_id, answer, category
+                    in db.session.query(Question.id, Question.answer, Question.category).filter(
+                        Question.id.in_([item['id'] for item in answers])).execution_options(
+                            include_deleted=True).all()}
+        if len(expected) < len(answers):
+            abort(404)
+
+        results = [(item['id'], expected[item['id']][1], normalize_answer(
+            item.get('answer', '')) == normalize_answer(expected[item['id']][0]))
+            for item in answers]
+        board = leaderboard()
+        board.start(app)
+        points, recorded = board.record(session_id, player, results)
+        recorded_ids = {question_id for question_id, _, _ in recorded}
+
+        return jsonify({
+            'success': True,
+            'session_id': session_id,
+            'points': points,
+            'results': [{
+                'id': question_id,
+                'correct': correct,
+                'answer': expected[question_id][0]
+            } for question_id, _, correct in recorded],
+            'skipped': [question_id for question_id, _, _ in results
+                        if question_id not in recorded_ids],
+            'score': board.player(player)
+        })
+
+    @app.route('/leaderboard', methods=['GET'])
+    def get_leaderboard():
+        category = request.args.get('category', 0, type=int)
+        limit = request.args.get('limit', LEADERBOARD_SIZE, type=int)
+        if not 1 <= limit <= MAX_LEADERBOARD_SIZE:
+            abort(400)
+        players, total_players = leaderboard().top(category, limit)
+
+        return jsonify({
+            'success': True,
+            'category': category,
+            'leaderboard': players,
+            'total_players': total_players
+        })
+
+    @app.route('/leaderboard/players/<player>', methods=['GET'])
+    def get_player_score(player):
+        score = leaderboard().player(
+            player, request.args.get('category', 0, type=int))
+        if score is None:
+            abort(404)
+
+        return jsonify({
+            'success': True,
+            'score': score
+        })
+
+    """
+    Connection pool state of this worker, to size DB_POOL_SIZE and
+    DB_MAX_OVERFLOW from the checkout wait times and connections in use.
+    """
+
+    @app.route('/stats/db-pool', methods=['GET'])
+    def get_db_pool_stats():
+        router = app.extensions.get('db_router')
+        return jsonify({
+            'success': True,
+            'pool': pool_status(db.engine),
+            'replicas': router.status() if router is not None else []
+        })
+
+    """
+    Requests admitted, throttled and shed per endpoint, to tune RATE_LIMITS.
+    """
+
+    @app.route('/stats/admission', methods=['GET'])
+    def get_admission_stats():
+        control = admission_control()
+        return jsonify({
+            'success': True,
+            'admission': control.stats() if control is not None else None
+        })
+
+    """
+    The leaderboard's boards, buffered answers and flushes.
+    """
+
+    @app.route('/stats/leaderboard', methods=['GET'])
+    def get_leaderboard_stats():
+        return jsonify({
+            'success': True,
+            'leaderboard': leaderboard().stats()
+        })
+
+    """
+    The soft-deleted questions purged so far, and the last purge.
+    """
+
+    @app.route('/stats/question-purge', methods=['GET'])
+    def get_question_purge_stats():
+        return jsonify({
+            'success': True,
+            'purge': question_purger().stats()
+        })
+
+    """
+    The groups of questions written by the write-behind inserts.
+    """
+
+    @app.route('/stats/question-writes', methods=['GET'])
+    def get_question_write_stats():
+        writer = question_writer()
+        return jsonify({
+            'success': True,
+            'writes': writer.stats() if writer is not None else None
+        })
+
+    """
+    Hits and misses of the response cache, to size RESPONSE_CACHE_MAX_BYTES.
+    """
+
+    @app.route('/stats/response-cache', methods=['GET'])
+    def get_response_cache_stats():
+        cache = response_cache()
+        return jsonify({
+            'success': True,
+            'cache': cache.stats() if cache is not None else None
+        })
+
+    """
+    Prometheus metrics of this worker, when METRICS_ENABLED is set.
+    """
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        if not app.config.get('METRICS_ENABLED'):
+            abort(404)
+        return Response(metrics().render(pool_status(db.engine)),
+                        mimetype='text/plain; version=0.0.4')
+
     """
     @TODO:
     Create error handlers for all expected errors
@@ -343,6 +911,22 @@ def create_app(test_config=None):
             "message": "unprocessable"
         }), 422
 
+    @app.errorhandler(429)
+    def too_many_requests(error):
+        return jsonify({
+            "success": False,
+            "error": 429,
+            "message": "too many requests"
+        }), 429, retry_after_headers()
+
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        return jsonify({
+            "success": False,
+            "error": 503,
+            "message": "service unavailable"
+        }), 503, retry_after_headers()
+
     @app.errorhandler(500)
     def internal_server_error(error):
         return jsonify({
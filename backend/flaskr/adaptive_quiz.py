@@ -0,0 +1,199 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+
+from models import Question
+from .kvstore import connect_store
+from .quiz import ALL_CATEGORIES
+from .quiz_sessions import (QUIZ_SESSION_MAX, QUIZ_SESSION_STORE,
+                            QUIZ_SESSION_TTL, new_token)
+
+
+MIN_DIFFICULTY = 1
+MAX_DIFFICULTY = 5
+
+# difficulty of the first question of an adaptive game
+ADAPTIVE_START_DIFFICULTY = int(os.getenv('ADAPTIVE_START_DIFFICULTY', 2))
+
+# correct answers in a row that move the player one difficulty up; a
+# wrong answer moves them one down
+ADAPTIVE_STREAK_UP = int(os.getenv('ADAPTIVE_STREAK_UP', 2))
+
+
+def normalize_answer(answer):
+    return ' '.join(str(answer).casefold().split())
+
+
+def clamp(difficulty):
+    return max(MIN_DIFFICULTY, min(MAX_DIFFICULTY, difficulty))
+
+
+"""
+AdaptiveGame
+    the server-side state of an adaptive quiz: the category, the current
+    difficulty and streak, the question waiting for an answer (with its
+    answer, which the client never sees before answering) and the ids
+    already served.
+"""
+class AdaptiveGame:
+
+    def __init__(self, category=ALL_CATEGORIES,
+                 difficulty=ADAPTIVE_START_DIFFICULTY, streak=0,
+                 question_id=None, answer=None, seen=()):
+        self.category = category
+        self.difficulty = clamp(difficulty)
+        self.streak = streak
+        self.question_id = question_id
+        self.answer = answer
+        self.seen = set(seen)
+
+    def record_answer(self, answer):
+        """Check answer against the current question and adapt the
+        difficulty; returns whether it was correct."""
+        correct = normalize_answer(answer) == normalize_answer(self.answer)
+        if correct:
+            self.streak += 1
+            if self.streak % ADAPTIVE_STREAK_UP == 0:
+                self.difficulty = clamp(self.difficulty + 1)
+        else:
+            self.streak = 0
+            self.difficulty = clamp(self.difficulty - 1)
+        self.question_id = None
+        self.answer = None
+        return correct
+
+    def serve(self, question):
+        self.question_id = question['id']
+        self.answer = question['answer']
+        self.seen.add(question['id'])
+
+    def dumps(self):
+        return json.dumps({
+            'category': self.category, 'difficulty': self.difficulty,
+            'streak': self.streak, 'question_id': self.question_id,
+            'answer': self.answer, 'seen': sorted(self.seen)})
+
+    @classmethod
+    def loads(cls, data):
+        return cls(**json.loads(data))
+
+
+def difficulty_order(difficulty):
+    """The target difficulty first, then the others from nearest to
+    farthest, easier before harder at the same distance."""
+    return sorted(range(MIN_DIFFICULTY, MAX_DIFFICULTY + 1),
+                  key=lambda other: (abs(other - difficulty), other))
+
+
+"""
+next_question_id(index, game)
+    draws an unseen question of the game's category from the bucket of
+    its difficulty, falling back to the nearest difficulty whose bucket
+    is not exhausted.  Each attempt is an O(1) QuizIndex.draw, so the
+    cost does not grow with the size of the bank.
+"""
+def next_question_id(index, game):
+    for difficulty in difficulty_order(game.difficulty):
+        question_id = index.draw(game.category, game.seen, difficulty)
+        if question_id is not None:
+            return question_id
+    return None
+
+
+def serve_next(index, game):
+    """Load and serve the next question of game, None when exhausted."""
+    while True:
+        question_id = next_question_id(index, game)
+        if question_id is None:
+            return None
+        question = Question.query.get(question_id)
+        if question is None:
+            # deleted by another worker since the index was built
+            game.seen.add(question_id)
+            continue
+        question = question.format()
+        game.serve(question)
+        return question
+
+
+def without_answer(question):
+    return {key: value for key, value in question.items() if key != 'answer'}
+
+
+"""
+MemoryAdaptiveGameStore / KeyValueAdaptiveGameStore
+    adaptive games by token, in this process or as JSON in the key-value
+    store of the quiz sessions (QUIZ_SESSION_STORE), with the same ttl.
+"""
+class MemoryAdaptiveGameStore:
+
+    def __init__(self, ttl=QUIZ_SESSION_TTL, max_games=QUIZ_SESSION_MAX):
+        self.ttl = ttl
+        self.max_games = max_games
+        self._lock = threading.Lock()
+        self._games = OrderedDict()
+
+    def _evict(self, now):
+        while self._games:
+            token, (expires, _) = next(iter(self._games.items()))
+            if expires > now and len(self._games) <= self.max_games:
+                break
+            self._games.popitem(last=False)
+
+    def create(self, game):
+        token = new_token()
+        self.save(token, game)
+        return token
+
+    def get(self, token):
+        """Raises KeyError for unknown or expired tokens."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            return AdaptiveGame.loads(self._games[token][1])
+
+    def save(self, token, game):
+        now = time.monotonic()
+        with self._lock:
+            self._games[token] = (now + self.ttl, game.dumps())
+            self._games.move_to_end(token)
+            self._evict(now)
+
+
+class KeyValueAdaptiveGameStore:
+
+    def __init__(self, client, ttl=QUIZ_SESSION_TTL):
+        self.client = client
+        self.ttl = ttl
+
+    def create(self, game):
+        token = new_token()
+        self.save(token, game)
+        return token
+
+    def get(self, token):
+        data = self.client.get('quiz:{}:adaptive'.format(token))
+        if data is None:
+            raise KeyError(token)
+        return AdaptiveGame.loads(data)
+
+    def save(self, token, game):
+        self.client.set('quiz:{}:adaptive'.format(token), game.dumps(),
+                        ex=self.ttl)
+
+
+def create_game_store(url=QUIZ_SESSION_STORE):
+    if url == 'memory':
+        return MemoryAdaptiveGameStore()
+    return KeyValueAdaptiveGameStore(connect_store(url))
+
+
+def adaptive_games():
+    return current_app.extensions['adaptive_games']
+
+
+def init_adaptive_quiz(app, store=None):
+    app.extensions['adaptive_games'] = store or create_game_store()
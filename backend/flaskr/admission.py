@@ -0,0 +1,252 @@
+import math
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from flask import current_app, g, request, abort
+
+from .kvstore import connect_store
+
+
+# turn the rate limits and concurrency caps off (benchmarks, load tests)
+ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', 'true').lower() in ('1', 'true', 'yes')
+
+# where the token buckets live: 'memory' in each worker, or a key-value
+# store shared by the workers (see kvstore.connect_store)
+RATE_LIMIT_STORE = os.getenv('RATE_LIMIT_STORE', 'memory')
+
+# header holding the client address behind a proxy, e.g. X-Forwarded-For;
+# the address of the connection is used otherwise, which behind a proxy
+# (the frontend's dev server included) is the proxy's: every user then
+# shares one bucket.  Only set it when the proxy overwrites the header,
+# as clients can send any value
+RATE_LIMIT_CLIENT_HEADER = os.getenv('RATE_LIMIT_CLIENT_HEADER')
+
+# milliseconds a request waits for a slot of a capped route before 503
+ADMISSION_QUEUE_TIMEOUT_MS = float(os.getenv('ADMISSION_QUEUE_TIMEOUT_MS', 100))
+
+# endpoint: (requests per second, burst) allowed per client; None holds
+# the limit of the endpoints not listed
+RATE_LIMITS = {
+    None: (50, 100),
+    'search': (5, 20),
+    'create_question': (10, 30),
+    'autocomplete_search': (20, 40),
+    'play_quiz_game': (10, 30),
+    'bulk_import_questions': (1, 2),
+    'export_all_questions': (1, 2),
+    'bulk_delete_questions': (1, 5),
+}
+
+# endpoint: requests served at once per worker, the expensive routes only
+CONCURRENCY_LIMITS = {
+    'search': 8,
+    'create_question': 8,
+    'play_quiz_game': 16,
+    'bulk_import_questions': 2,
+    'export_all_questions': 2,
+    'bulk_delete_questions': 2,
+}
+
+# buckets kept in memory, the least recently used are dropped past it
+MAX_BUCKETS = 100000
+
+
+def client_address(forwarded, remote_addr):
+    """The client of a request: the first address of the client header
+    when the proxy set one, the address of the connection otherwise."""
+    if forwarded:
+        # the first address is the client, the others proxies
+        return forwarded.split(',')[0].strip()
+    return remote_addr
+
+
+"""
+TokenBuckets
+    a bucket per (client, endpoint) holding up to burst tokens and
+    refilled at rate tokens per second; a request takes one token or is
+    refused, with the seconds until the next token.  Kept in the memory
+    of the worker, ordered by last use: past max_buckets the least
+    recently used bucket is dropped, in O(1), and its client starts again
+    from a full bucket.
+"""
+class TokenBuckets:
+
+    def __init__(self, max_buckets=MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key, rate, burst):
+        """(True, 0) when a token was taken, (False, retry_after) otherwise."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                tokens -= 1
+                allowed, retry_after = True, 0
+            else:
+                allowed, retry_after = False, (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return allowed, retry_after
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+"""
+SharedTokenBuckets
+    the buckets of every worker in a key-value store.  The store offers
+    INCR and EXPIRE but no atomic read-modify-write, so a bucket is
+    approximated by a counter per window of burst / rate seconds: burst
+    requests are admitted per window, the same long-run rate as the
+    bucket, refilled at once instead of continuously.
+"""
+class SharedTokenBuckets:
+
+    def __init__(self, store, prefix='trivia:rate:'):
+        self.store = store
+        self.prefix = prefix
+
+    def take(self, key, rate, burst):
+        window = burst / rate
+        now = time.time()
+        number = int(now // window)
+        name = '{}{}:{}:{}'.format(self.prefix, key[0], key[1], number)
+        count = self.store.incr(name)
+        if count == 1:
+            self.store.expire(name, max(1, math.ceil(window)))
+        if count <= burst:
+            return True, 0
+        return False, (number + 1) * window - now
+
+
+"""
+AdmissionControl
+    admits a request when its client has a token left for the endpoint
+    (429 otherwise) and, for the routes of CONCURRENCY_LIMITS, when one of
+    the worker's slots frees up within queue_timeout_ms (503 otherwise),
+    so that a burst on an expensive route queues briefly and is then shed
+    instead of piling up on the database.  The outcomes are counted per
+    endpoint.
+"""
+class AdmissionControl:
+
+    def __init__(self, buckets, rate_limits=None, concurrency_limits=None,
+                 queue_timeout_ms=ADMISSION_QUEUE_TIMEOUT_MS,
+                 client_header=RATE_LIMIT_CLIENT_HEADER):
+        self.buckets = buckets
+        self.rate_limits = dict(RATE_LIMITS if rate_limits is None else rate_limits)
+        self.concurrency_limits = dict(
+            CONCURRENCY_LIMITS if concurrency_limits is None else concurrency_limits)
+        self.queue_timeout = queue_timeout_ms / 1000
+        self.client_header = client_header
+        self._slots = {endpoint: threading.BoundedSemaphore(limit)
+                       for endpoint, limit in self.concurrency_limits.items()}
+        self._lock = threading.Lock()
+        self.counters = Counter()
+        self.in_flight = Counter()
+
+    def client(self):
+        forwarded = self.client_header and request.headers.get(self.client_header)
+        return client_address(forwarded, request.remote_addr)
+
+    def count(self, endpoint, outcome):
+        with self._lock:
+            self.counters[(endpoint, outcome)] += 1
+
+    def throttle(self, endpoint, client):
+        """Return (429, retry_after) when client has no token left for
+        endpoint, None otherwise."""
+        limit = self.rate_limits.get(endpoint, self.rate_limits.get(None))
+        if limit is None:
+            return None
+        allowed, retry_after = self.buckets.take((client, endpoint), *limit)
+        if not allowed:
+            self.count(endpoint, 'throttled')
+            return 429, retry_after
+        return None
+
+    def admit(self, endpoint):
+        """Return None once admitted, or (status, retry_after) to refuse."""
+        refused = self.throttle(endpoint, self.client())
+        if refused is not None:
+            return refused
+
+        slots = self._slots.get(endpoint)
+        if slots is not None:
+            if not slots.acquire(blocking=False):
+                self.count(endpoint, 'queued')
+                if not slots.acquire(timeout=self.queue_timeout):
+                    self.count(endpoint, 'shed')
+                    return 503, self.queue_timeout
+            with self._lock:
+                self.in_flight[endpoint] += 1
+        self.count(endpoint, 'admitted')
+        return None
+
+    def release(self, endpoint):
+        slots = self._slots.get(endpoint)
+        if slots is not None:
+            with self._lock:
+                self.in_flight[endpoint] -= 1
+            slots.release()
+
+    def stats(self):
+        with self._lock:
+            endpoints = {}
+            for (endpoint, outcome), value in sorted(self.counters.items()):
+                endpoints.setdefault(endpoint, {})[outcome] = value
+            for endpoint, limit in self.concurrency_limits.items():
+                endpoints.setdefault(endpoint, {}).update({
+                    'in_flight': self.in_flight[endpoint],
+                    'concurrency_limit': limit})
+            return endpoints
+
+
+def create_buckets(url=RATE_LIMIT_STORE):
+    if url == 'memory':
+        return TokenBuckets()
+    return SharedTokenBuckets(connect_store(url))
+
+
+def admission_control():
+    """The AdmissionControl of the app, None when ADMISSION_CONTROL is off."""
+    return current_app.extensions.get('admission_control')
+
+
+def retry_after_headers():
+    """The Retry-After header of a refused request, in whole seconds."""
+    retry_after = g.get('retry_after')
+    if retry_after is None:
+        return {}
+    return {'Retry-After': str(max(1, math.ceil(retry_after)))}
+
+
+def init_admission(app, control=None):
+    app.config.setdefault('ADMISSION_CONTROL', ADMISSION_CONTROL)
+    if control is None and app.config['ADMISSION_CONTROL']:
+        control = AdmissionControl(create_buckets(
+            app.config.get('RATE_LIMIT_STORE', RATE_LIMIT_STORE)))
+    app.extensions['admission_control'] = control
+
+    @app.before_request
+    def admit_request():
+        control = app.extensions['admission_control']
+        if control is None or request.endpoint is None:
+            return
+        refused = control.admit(request.endpoint)
+        if refused is not None:
+            status, g.retry_after = refused
+            abort(status)
+        g.admitted_endpoint = request.endpoint
+
+    @app.teardown_request
+    def release_request(exception=None):
+        endpoint = g.pop('admitted_endpoint', None)
+        control = app.extensions['admission_control']
+        if endpoint is not None and control is not None:
+            control.release(endpoint)
@@ -0,0 +1,496 @@
+"""
+Async serving mode.
+
+An ASGI application serving the read-heavy routes of the API (/categories,
+/questions, /categories/<id>/questions, /search, /quizzes and the search
+branch of POST /questions) with the same JSON contracts as create_app,
+on top of an asyncpg connection pool, so a request waiting on PostgreSQL
+does not hold a worker thread.  Searches go through the SEARCH_ENGINE of
+the WSGI app, and requests through its rate limits and concurrency caps.
+Writes, question creation included, stay on the WSGI app, which keeps its
+caches and indexes up to date.
+
+    uvicorn flaskr.asgi:app --workers 4
+
+asyncpg (and an ASGI server such as uvicorn) are only needed for this mode.
+"""
+import asyncio
+import json
+import math
+import os
+import time
+from urllib.parse import parse_qs
+
+try:
+    import asyncpg
+except ImportError:  # asyncpg is optional, only needed for the async mode
+    asyncpg = None
+
+from models import DB_HOST, DB_USER, DB_PASSWORD, DB_NAME
+from .admission import (AdmissionControl, TokenBuckets, ADMISSION_CONTROL,
+                        client_address, create_buckets)
+from .quiz import QuizIndex, ALL_CATEGORIES, category_key
+from .search import MemorySearchEngine, SEARCH_ENGINE, like_pattern
+
+
+ASYNC_DB_DSN = os.getenv('ASYNC_DB_DSN', 'postgresql://{}:{}@{}/{}'.format(
+    DB_USER, DB_PASSWORD, DB_HOST, DB_NAME))
+ASYNC_DB_POOL_MIN = int(os.getenv('ASYNC_DB_POOL_MIN', 5))
+ASYNC_DB_POOL_MAX = int(os.getenv('ASYNC_DB_POOL_MAX', 20))
+
+# seconds the categories, counts, quiz and search indexes are kept before
+# re-reading
+ASYNC_CACHE_MAX_AGE = int(os.getenv('ASYNC_CACHE_MAX_AGE', 30))
+
+QUESTIONS_PER_PAGE = 10
+
+QUESTION_COLUMNS = 'id, question, answer, category, difficulty'
+
+ERRORS = {
+    400: 'bad request',
+    404: 'resource not found',
+    405: 'method not allowed',
+    422: 'unprocessable',
+    429: 'too many requests',
+    500: 'internal server error',
+    503: 'service unavailable',
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(status)
+        self.status = status
+        self.retry_after = retry_after
+
+
+def format_question(row):
+    return {
+        'id': row['id'],
+        'question': row['question'],
+        'answer': row['answer'],
+        'category': row['category'],
+        'difficulty': row['difficulty']
+    }
+
+
+def int_arg(args, name, default=None):
+    try:
+        return int(args[name][0])
+    except (KeyError, IndexError, ValueError):
+        return default
+
+
+"""
+TriviaASGI
+    the async application.  Categories and per-category question counts
+    are re-read at most every ASYNC_CACHE_MAX_AGE seconds, quizzes draw
+    from the same QuizIndex as the WSGI app, loaded through the pool.
+    A stale value is re-read by one query at a time, the requests arriving
+    meanwhile wait for it, and the quiz and search indexes are rebuilt in
+    a thread so the event loop keeps serving.
+
+    admission is the AdmissionControl whose rate limits and concurrency
+    caps apply to the routes, by the endpoint names of the WSGI app; by
+    default one is created when ADMISSION_CONTROL is on, False turns it
+    off.  Requests over a cap wait on an asyncio semaphore.
+"""
+class TriviaASGI:
+
+    def __init__(self, dsn=ASYNC_DB_DSN, min_size=ASYNC_DB_POOL_MIN,
+                 max_size=ASYNC_DB_POOL_MAX, max_age=ASYNC_CACHE_MAX_AGE,
+                 search_engine=SEARCH_ENGINE, admission=None):
+        if search_engine not in ('sql', 'memory'):
+            raise ValueError('unknown search engine {}'.format(search_engine))
+        if admission is None and ADMISSION_CONTROL:
+            admission = AdmissionControl(create_buckets())
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_age = max_age
+        self.search_engine = search_engine
+        self.admission = admission or None
+        self.pool = None
+        self.quiz_index = QuizIndex(max_age=float('inf'))
+        self.search_index = MemorySearchEngine(max_age=float('inf'))
+        self._slots = {}
+        self._cached = {}
+        self._loaded_at = {}
+        self._reloads = {}
+
+    async def startup(self):
+        if asyncpg is None:
+            raise RuntimeError('the async serving mode requires asyncpg')
+        self.pool = await asyncpg.create_pool(
+            self.dsn, min_size=self.min_size, max_size=self.max_size)
+
+    async def shutdown(self):
+        if self.pool is not None:
+            await self.pool.close()
+
+    def _stale(self, name):
+        loaded_at = self._loaded_at.get(name)
+        return loaded_at is None or time.monotonic() - loaded_at > self.max_age
+
+    async def cached(self, name, load):
+        """The value of await load(), re-read once older than max_age."""
+        if not self._stale(name):
+            return self._cached[name]
+        reload = self._reloads.get(name)
+        if reload is None:
+            reload = self._reloads[name] = asyncio.ensure_future(
+                self._reload(name, load))
+        # a cancelled request does not cancel the reload the others await
+        return await asyncio.shield(reload)
+
+    async def _reload(self, name, load):
+        try:
+            self._cached[name] = await load()
+            self._loaded_at[name] = time.monotonic()
+            return self._cached[name]
+        finally:
+            del self._reloads[name]
+
+    async def load_categories(self):
+        rows = await self.pool.fetch(
+            'SELECT id, type FROM categories ORDER BY id')
+        return {row['id']: row['type'] for row in rows}
+
+    async def load_counts(self):
+        rows = await self.pool.fetch(
+            'SELECT category, count(*) AS total FROM questions '
+            'WHERE deleted_at IS NULL GROUP BY category')
+        counts = {}
+        for row in rows:
+            key = category_key(row['category'])
+            counts[key] = counts.get(key, 0) + row['total']
+        return counts
+
+    async def load_quiz_index(self):
+        rows = await self.pool.fetch(
+            'SELECT id, category, difficulty FROM questions '
+            'WHERE deleted_at IS NULL')
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.quiz_index.load_rows,
+            [(row['id'], row['category'], row['difficulty']) for row in rows])
+        return self.quiz_index
+
+    async def load_search_index(self):
+        rows = await self.pool.fetch(
+            'SELECT id, question FROM questions WHERE deleted_at IS NULL')
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.search_index.load_rows,
+            [(row['id'], row['question']) for row in rows])
+        return self.search_index
+
+    async def trigram_ranked(self):
+        """Whether pg_trgm is installed, as SqlSearchEngine.ranked()."""
+        return await self.pool.fetchval(
+            "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'") is not None
+
+    async def categories(self):
+        return await self.cached('categories', self.load_categories)
+
+    async def total_questions(self, category=None):
+        counts = await self.cached('counts', self.load_counts)
+        if category is None:
+            return sum(counts.values())
+        return counts.get(category_key(category), 0)
+
+    async def draw_question(self, category, seen):
+        await self.cached('quiz_index', self.load_quiz_index)
+        while True:
+            question_id = self.quiz_index.draw(category, seen)
+            if question_id is None:
+                return None
+            row = await self.pool.fetchrow(
+                'SELECT {} FROM questions WHERE id = $1 AND deleted_at IS NULL'.format(
+                    QUESTION_COLUMNS), question_id)
+            if row is not None:
+                return row
+            seen.add(question_id)
+
+    async def paginate(self, args, where='TRUE', params=(), total=None):
+        """The keyset/offset pagination of flaskr.paginate_questions."""
+        page = int_arg(args, 'page', 1)
+        after = int_arg(args, 'after')
+        before = int_arg(args, 'before')
+        params = list(params)
+        where = 'deleted_at IS NULL AND {}'.format(where)
+        limit = QUESTIONS_PER_PAGE + 1
+
+        if total is None:
+            total = await self.pool.fetchval(
+                'SELECT count(*) FROM questions WHERE {}'.format(where),
+                *params)
+
+        select = 'SELECT {} FROM questions WHERE {}'.format(
+            QUESTION_COLUMNS, where)
+        n = len(params)
+        if after is not None:
+            rows = await self.pool.fetch(
+                '{} AND id > ${} ORDER BY id LIMIT ${}'.format(
+                    select, n + 1, n + 2), *params, after, limit)
+            has_next, has_prev = len(rows) > QUESTIONS_PER_PAGE, True
+            rows = rows[:QUESTIONS_PER_PAGE]
+        elif before is not None:
+            rows = await self.pool.fetch(
+                '{} AND id < ${} ORDER BY id DESC LIMIT ${}'.format(
+                    select, n + 1, n + 2), *params, before, limit)
+            has_next, has_prev = True, len(rows) > QUESTIONS_PER_PAGE
+            rows = rows[:QUESTIONS_PER_PAGE][::-1]
+        elif page < 1:
+            rows, has_next, has_prev = [], False, False
+        else:
+            start = (page - 1) * QUESTIONS_PER_PAGE
+            rows = await self.pool.fetch(
+                '{} ORDER BY id OFFSET ${} LIMIT ${}'.format(
+                    select, n + 1, n + 2), *params, start, limit)
+            has_next, has_prev = len(rows) > QUESTIONS_PER_PAGE, start > 0
+            rows = rows[:QUESTIONS_PER_PAGE]
+
+        return {
+            'questions': [format_question(row) for row in rows],
+            'total_questions': total,
+            'next_cursor': rows[-1]['id'] if rows and has_next else None,
+            'prev_cursor': rows[0]['id'] if rows and has_prev else None
+        }
+
+    async def search_page(self, args, search_term):
+        """The page of hits of flaskr.search_questions, in the order of the
+        configured search engine."""
+        page = int_arg(args, 'page', 1)
+        if page < 1:
+            return [], 0
+        offset = (page - 1) * QUESTIONS_PER_PAGE
+        if self.search_engine == 'memory':
+            index = await self.cached('search_index', self.load_search_index)
+            ids = await asyncio.get_running_loop().run_in_executor(
+                None, index.match, search_term)
+            page_ids = ids[offset:offset + QUESTIONS_PER_PAGE]
+            if not page_ids:
+                return [], len(ids)
+            rows = await self.pool.fetch(
+                'SELECT {} FROM questions WHERE id IN ({}) '
+                'AND deleted_at IS NULL'.format(QUESTION_COLUMNS, ', '.join(
+                    '${}'.format(n) for n in range(1, len(page_ids) + 1))),
+                *page_ids)
+            rows = {row['id']: row for row in rows}
+            return [format_question(rows[question_id]) for question_id
+                    in page_ids if question_id in rows], len(ids)
+
+        where = "question ILIKE $1 ESCAPE '\\' AND deleted_at IS NULL"
+        pattern = like_pattern(search_term)
+        total = await self.pool.fetchval(
+            'SELECT count(*) FROM questions WHERE {}'.format(where), pattern)
+        if await self.cached('trigram_ranked', self.trigram_ranked):
+            rows = await self.pool.fetch(
+                'SELECT {} FROM questions WHERE {} '
+                'ORDER BY similarity(question, $2) DESC, id '
+                'OFFSET $3 LIMIT $4'.format(QUESTION_COLUMNS, where),
+                pattern, search_term, offset, QUESTIONS_PER_PAGE)
+        else:
+            rows = await self.pool.fetch(
+                'SELECT {} FROM questions WHERE {} '
+                'ORDER BY id OFFSET $2 LIMIT $3'.format(QUESTION_COLUMNS, where),
+                pattern, offset, QUESTIONS_PER_PAGE)
+        return [format_question(row) for row in rows], total
+
+    async def get_all_categories(self, args, body):
+        categories = await self.categories()
+        if len(categories) == 0:
+            raise HTTPError(404)
+        return 200, {'categories': categories, 'success': True}
+
+    async def get_questions(self, args, body):
+        page = await self.paginate(args, total=await self.total_questions())
+        if len(page['questions']) == 0:
+            raise HTTPError(404)
+        page.update(success=True, categories=await self.categories())
+        return 200, page
+
+    async def get_questions_by_category(self, args, body, category_id):
+        categories = await self.categories()
+        if category_id not in categories:
+            raise HTTPError(404)
+        page = await self.paginate(
+            args, 'category = $1', [category_id],
+            await self.total_questions(category_id))
+        page.update(success=True, current_category=categories[category_id])
+        return 200, page
+
+    async def search(self, args, body):
+        search_term = (body or {}).get('searchTerm')
+        if search_term is None:
+            raise HTTPError(400)
+        questions, total = await self.search_page(args, search_term)
+        return 200, {'success': True, 'questions': questions,
+                     'total_questions': total}
+
+    async def create_question(self, args, body):
+        if not isinstance(body, dict):
+            raise HTTPError(400)
+        if not body.get('searchTerm'):
+            # creating a question invalidates the caches and indexes of
+            # the WSGI workers, so it is only served there
+            raise HTTPError(405)
+        return await self.search(args, body)
+
+    async def play_quiz_game(self, args, body):
+        body = body if isinstance(body, dict) else {}
+        category = body.get('quiz_category')
+        if not category:
+            return 400, {'success': False, 'error': 'Missing params.'}
+        row = await self.draw_question(
+            category.get('id', ALL_CATEGORIES),
+            set(body.get('previous_questions') or ()))
+        if row is None:
+            return 404, {'success': False, 'error': 'Question not found.'}
+        return 200, {'success': True, 'question': format_question(row)}
+
+    def route(self, method, path):
+        parts = path.strip('/').split('/')
+        routes = {
+            ('GET', 'categories'): self.get_all_categories,
+            ('GET', 'questions'): self.get_questions,
+            ('POST', 'questions'): self.create_question,
+            ('POST', 'search'): self.search,
+            ('POST', 'quizzes'): self.play_quiz_game,
+        }
+        if len(parts) == 1:
+            handler = routes.get((method, parts[0]))
+            if handler is None:
+                allowed = any(name == parts[0] for _, name in routes)
+                raise HTTPError(405 if allowed else 404)
+            return handler, ()
+        if len(parts) == 3 and parts[0] == 'categories' and \
+                parts[2] == 'questions' and parts[1].isdigit():
+            if method != 'GET':
+                raise HTTPError(405)
+            return self.get_questions_by_category, (int(parts[1]),)
+        raise HTTPError(404)
+
+    def client(self, scope):
+        forwarded = None
+        if self.admission.client_header:
+            name = self.admission.client_header.lower().encode()
+            forwarded = next((value.decode() for key, value in
+                              scope.get('headers', ()) if key == name), None)
+        return client_address(forwarded, (scope.get('client') or (None,))[0])
+
+    async def admit(self, endpoint, scope):
+        """
+        The admission.init_admission of the async app: raise 429 when the
+        client is over the rate limit of endpoint, 503 when no slot of a
+        capped endpoint frees up in time.  Returns the semaphore to
+        release once the request is served, if any.
+        """
+        control = self.admission
+        client = self.client(scope)
+        if isinstance(control.buckets, TokenBuckets):
+            refused = control.throttle(endpoint, client)
+        else:
+            # a shared store is a network round trip
+            refused = await asyncio.get_running_loop().run_in_executor(
+                None, control.throttle, endpoint, client)
+        if refused is not None:
+            raise HTTPError(*refused)
+
+        limit = control.concurrency_limits.get(endpoint)
+        slots = None
+        if limit is not None:
+            slots = self._slots.get(endpoint)
+            if slots is None:
+                slots = self._slots[endpoint] = asyncio.Semaphore(limit)
+            if slots.locked():
+                control.count(endpoint, 'queued')
+                try:
+                    await asyncio.wait_for(
+                        slots.acquire(), control.queue_timeout)
+                except asyncio.TimeoutError:
+                    control.count(endpoint, 'shed')
+                    raise HTTPError(503, control.queue_timeout)
+            else:
+                await slots.acquire()
+        control.count(endpoint, 'admitted')
+        return slots
+
+    async def read_body(self, receive):
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        data = b''.join(chunks)
+        if not data:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            raise HTTPError(400)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as error:
+                    await send({'type': 'lifespan.startup.failed',
+                                'message': str(error)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            return
+
+        slots = None
+        headers = []
+        try:
+            handler, params = self.route(scope['method'], scope['path'])
+            if self.admission is not None:
+                slots = await self.admit(handler.__name__, scope)
+            args = parse_qs(scope.get('query_string', b'').decode())
+            body = await self.read_body(receive)
+            status, payload = await handler(args, body, *params)
+        except HTTPError as error:
+            status, payload = error.status, {
+                'success': False, 'error': error.status,
+                'message': ERRORS[error.status]}
+            if error.retry_after is not None:
+                headers.append((b'retry-after', str(
+                    max(1, math.ceil(error.retry_after))).encode()))
+        except Exception:
+            status, payload = 500, {
+                'success': False, 'error': 500,
+                'message': ERRORS[500]}
+        finally:
+            if slots is not None:
+                slots.release()
+
+        data = json.dumps(payload, sort_keys=True).encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(data)).encode()),
+                (b'access-control-allow-origin', b'*'),
+                (b'access-control-allow-headers',
+                 b'Content-type, Authorization, true'),
+                (b'access-control-allow-methods',
+                 b'GET, POST, PATCH, DELETE, OPTIONS'),
+            ] + headers,
+        })
+        await send({'type': 'http.response.body', 'body': data})
+
+
+app = TriviaASGI()
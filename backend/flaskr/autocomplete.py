@@ -0,0 +1,183 @@
+import heapq
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from flask import current_app, has_app_context
+
+from models import db, Question, question_listener
+from .query_audit import index_load
+
+
+# upper bound on the distinct completions kept in memory, terms seen once
+# the index is full are not indexed until it is rebuilt
+AUTOCOMPLETE_MAX_TERMS = int(os.getenv('AUTOCOMPLETE_MAX_TERMS', 200000))
+
+# completions looked at per request, bounds the latency of short prefixes
+AUTOCOMPLETE_SCAN_LIMIT = int(os.getenv('AUTOCOMPLETE_SCAN_LIMIT', 2000))
+
+# seconds after which the index is rebuilt, so that questions written by
+# other worker processes are eventually picked up
+AUTOCOMPLETE_MAX_AGE = int(os.getenv('AUTOCOMPLETE_MAX_AGE', 300))
+
+WORD = re.compile(r'\w{2,}', re.UNICODE)
+
+
+def completion_terms(question, answer):
+    """The words of a question and its answer, plus the whole answer."""
+    terms = set(WORD.findall((question or '').lower()))
+    answer = ' '.join((answer or '').lower().split())
+    terms.update(WORD.findall(answer))
+    if answer:
+        terms.add(answer)
+    return terms
+
+
+"""
+Autocomplete
+    a sorted array of completion terms (words of the questions and answers,
+    and whole answers) with the number of questions using each of them.
+    The completions of a prefix are a contiguous run of the array found
+    with bisect; the k most used terms of that run are returned, looking at
+    no more than scan_limit of them.  Kept in sync through
+    question_listener; a reload counts and sorts the terms outside the
+    lock and swaps them in, so completions are served meanwhile.
+"""
+class Autocomplete:
+
+    def __init__(self, max_terms=AUTOCOMPLETE_MAX_TERMS,
+                 scan_limit=AUTOCOMPLETE_SCAN_LIMIT,
+                 max_age=AUTOCOMPLETE_MAX_AGE):
+        self.max_terms = max_terms
+        self.scan_limit = scan_limit
+        self.max_age = max_age
+        self.loaded_at = None
+        self.dropped_terms = 0
+        self._lock = threading.RLock()
+        self._terms = []
+        self._counts = {}
+        self._question_terms = {}
+
+    def load(self):
+        with index_load():
+            rows = db.session.query(
+                Question.id, Question.question, Question.answer).all()
+        self.load_rows(rows)
+
+    def load_rows(self, rows):
+        """Rebuild the index from (id, question, answer) rows."""
+        counts = {}
+        question_terms = {}
+        dropped_terms = 0
+        for question_id, question, answer in rows:
+            indexed, _, dropped = self._count_terms(counts, question, answer)
+            question_terms[question_id] = indexed
+            dropped_terms += dropped
+        terms = sorted(counts)
+        with self._lock:
+            self._terms = terms
+            self._counts = counts
+            self._question_terms = question_terms
+            self.dropped_terms = dropped_terms
+            self.loaded_at = time.monotonic()
+
+    def ensure_loaded(self):
+        if self.loaded_at is None or \
+                time.monotonic() - self.loaded_at > self.max_age:
+            self.load()
+
+    def reset(self):
+        with self._lock:
+            self.loaded_at = None
+
+    def clear(self):
+        with self._lock:
+            self.dropped_terms = 0
+            self._terms = []
+            self._counts = {}
+            self._question_terms = {}
+
+    def _count_terms(self, counts, question, answer):
+        """Count the terms of a question in counts; returns the terms
+        indexed, those new to counts and how many were dropped."""
+        indexed, new, dropped = set(), [], 0
+        for term in completion_terms(question, answer):
+            if term in counts:
+                counts[term] += 1
+            elif len(counts) < self.max_terms:
+                counts[term] = 1
+                new.append(term)
+            else:
+                dropped += 1
+                continue
+            indexed.add(term)
+        return indexed, new, dropped
+
+    def _add(self, question_id, question, answer):
+        self._remove(question_id)
+        indexed, new, dropped = self._count_terms(
+            self._counts, question, answer)
+        for term in new:
+            insort(self._terms, term)
+        self.dropped_terms += dropped
+        self._question_terms[question_id] = indexed
+
+    def _remove(self, question_id):
+        for term in self._question_terms.pop(question_id, ()):
+            self._counts[term] -= 1
+            if self._counts[term] == 0:
+                del self._counts[term]
+                del self._terms[bisect_left(self._terms, term)]
+
+    def add(self, question_id, question, answer):
+        """Index a question; used directly when no database is involved."""
+        with self._lock:
+            self._add(question_id, question, answer)
+
+    def remove(self, question_id):
+        with self._lock:
+            self._remove(question_id)
+
+    def complete(self, prefix, limit=10):
+        """Return up to limit terms starting with prefix, most used first."""
+        prefix = ' '.join(prefix.lower().split())
+        if not prefix:
+            return []
+        with self._lock:
+            start = bisect_left(self._terms, prefix)
+            end = min(len(self._terms), start + self.scan_limit)
+            matches = []
+            for term in self._terms[start:end]:
+                if not term.startswith(prefix):
+                    break
+                matches.append((-self._counts[term], term))
+        return [term for _, term in heapq.nsmallest(limit, matches)]
+
+    def __len__(self):
+        return len(self._terms)
+
+
+def autocomplete():
+    index = current_app.extensions['autocomplete']
+    index.ensure_loaded()
+    return index
+
+
+def init_autocomplete(app):
+    app.extensions['autocomplete'] = Autocomplete()
+
+
+@question_listener
+def sync_autocomplete(event, question):
+    if not has_app_context():
+        return
+    index = current_app.extensions.get('autocomplete')
+    if index is None or index.loaded_at is None:
+        return
+    if event == 'insert':
+        index.add(question['id'], question['question'], question['answer'])
+    elif event in ('delete', 'purge'):
+        index.remove(question['id'])
+    else:
+        index.reset()
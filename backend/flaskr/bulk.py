@@ -0,0 +1,217 @@
+import csv
+import io
+import json
+import os
+import click
+from flask import Response, stream_with_context
+
+from models import db, Question, Category, notify_question_listeners
+
+
+# rows inserted per transaction
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', 1000))
+
+# rows fetched per round trip by the export cursor
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+
+# rejected rows reported back in detail
+MAX_REPORTED_ERRORS = 100
+
+COLUMNS = ('question', 'answer', 'category', 'difficulty')
+EXPORT_COLUMNS = ('id',) + COLUMNS
+
+FORMATS = ('ndjson', 'csv')
+
+
+class BulkImportError(Exception):
+    def __init__(self, line, message):
+        super().__init__(message)
+        self.line = line
+        self.message = message
+
+
+def decoded(lines):
+    for line in lines:
+        yield line.decode('utf-8') if isinstance(line, bytes) else line
+
+
+def read_ndjson(lines):
+    for number, line in enumerate(decoded(lines), 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, BulkImportError(number, 'invalid JSON')
+            continue
+        yield number, row
+
+
+def read_csv(lines):
+    # the header is line 1
+    for number, row in enumerate(csv.DictReader(decoded(lines)), 2):
+        yield number, row
+
+
+def read_rows(lines, format):
+    if format == 'ndjson':
+        return read_ndjson(lines)
+    if format == 'csv':
+        return read_csv(lines)
+    raise ValueError('unknown format {}'.format(format))
+
+
+def validate(number, row, categories=None):
+    """Return the row as the values of a questions insert."""
+    if isinstance(row, BulkImportError):
+        raise row
+    if not isinstance(row, dict):
+        raise BulkImportError(number, 'a question must be an object')
+    values = {}
+    for field in ('question', 'answer'):
+        value = row.get(field)
+        if not isinstance(value, str) or not value.strip():
+            raise BulkImportError(number, '{} is required'.format(field))
+        values[field] = value
+    for field in ('category', 'difficulty'):
+        try:
+            values[field] = int(row.get(field))
+        except (TypeError, ValueError):
+            raise BulkImportError(
+                number, '{} must be an integer'.format(field))
+    # rejected here rather than failing the chunk on the foreign key
+    if categories is not None and values['category'] not in categories:
+        raise BulkImportError(number, 'unknown category')
+    return values
+
+
+def insert_chunk(chunk, method):
+    if method == 'copy':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for values in chunk:
+            writer.writerow([values[column] for column in COLUMNS])
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert(
+            'COPY questions ({}) FROM STDIN WITH (FORMAT csv)'.format(
+                ', '.join(COLUMNS)), buffer)
+    else:
+        db.session.execute(Question.__table__.insert(), chunk)
+    db.session.commit()
+
+
+"""
+import_questions(lines, format, chunk_size, method)
+    streams NDJSON or CSV lines into the questions table.  Rows are
+    validated as they are read and inserted chunk_size at a time, one
+    transaction per chunk, with executemany or (PostgreSQL only) COPY.
+    Invalid rows are rejected and reported, they do not stop the import.
+
+    returns {'imported': n, 'rejected': n, 'chunks': n, 'errors': [...]}
+"""
+def import_questions(lines, format='ndjson', chunk_size=BULK_CHUNK_SIZE,
+                     method='executemany'):
+    if method == 'copy' and db.engine.dialect.name != 'postgresql':
+        method = 'executemany'
+
+    summary = {'imported': 0, 'rejected': 0, 'chunks': 0, 'errors': []}
+    categories = {category_id for (category_id,) in
+                  db.session.query(Category.id)}
+    chunk = []
+    try:
+        for number, row in read_rows(lines, format):
+            try:
+                chunk.append(validate(number, row, categories))
+            except BulkImportError as error:
+                summary['rejected'] += 1
+                if len(summary['errors']) < MAX_REPORTED_ERRORS:
+                    summary['errors'].append(
+                        {'line': error.line, 'message': error.message})
+                continue
+            if len(chunk) >= chunk_size:
+                insert_chunk(chunk, method)
+                summary['imported'] += len(chunk)
+                summary['chunks'] += 1
+                chunk = []
+        if chunk:
+            insert_chunk(chunk, method)
+            summary['imported'] += len(chunk)
+            summary['chunks'] += 1
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        if summary['imported']:
+            # the in-memory indexes rebuild from the table
+            notify_question_listeners('reload', None)
+    return summary
+
+
+"""
+export_questions(format, batch_size)
+    yields the questions table as NDJSON or CSV lines, read through a
+    server-side cursor batch_size rows at a time so the table is never
+    held in memory.
+"""
+def export_questions(format='ndjson', batch_size=EXPORT_BATCH_SIZE):
+    if format not in FORMATS:
+        raise ValueError('unknown format {}'.format(format))
+    rows = db.session.query(
+        *[getattr(Question, column) for column in EXPORT_COLUMNS]
+    ).order_by(Question.id).execution_options(
+        stream_results=True).yield_per(batch_size)
+
+    buffer = io.StringIO()
+    if format == 'csv':
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        write = writer.writerow
+    else:
+        def write(row):
+            buffer.write(json.dumps(dict(zip(EXPORT_COLUMNS, row))))
+            buffer.write('\n')
+
+    for number, row in enumerate(rows, 1):
+        write(row)
+        # one chunk of output per batch of rows
+        if number % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_response(format):
+    mimetype = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(export_questions(format)),
+                    mimetype=mimetype)
+
+
+def init_bulk(app):
+
+    @app.cli.command('import-questions')
+    @click.argument('source', type=click.File('rb'))
+    @click.option('--format', 'format_', type=click.Choice(FORMATS),
+                  default=None, help='defaults to the file extension')
+    @click.option('--chunk-size', default=BULK_CHUNK_SIZE)
+    @click.option('--method', type=click.Choice(['executemany', 'copy']),
+                  default='executemany')
+    def import_questions_command(source, format_, chunk_size, method):
+        """Import questions from an NDJSON or CSV file ('-' for stdin)."""
+        if format_ is None:
+            format_ = 'csv' if source.name.endswith('.csv') else 'ndjson'
+        summary = import_questions(source, format_, chunk_size, method)
+        click.echo('imported {imported} questions in {chunks} chunks, '
+                   'rejected {rejected}'.format(**summary))
+        for error in summary['errors']:
+            click.echo('line {line}: {message}'.format(**error), err=True)
+
+    @app.cli.command('export-questions')
+    @click.argument('target', type=click.File('w'))
+    @click.option('--format', 'format_', type=click.Choice(FORMATS),
+                  default='ndjson')
+    def export_questions_command(target, format_):
+        """Export the questions as NDJSON or CSV ('-' for stdout)."""
+        for chunk in export_questions(format_):
+            target.write(chunk)
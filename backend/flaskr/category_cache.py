@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from flask import current_app, has_app_context
+
+from models import Category, category_listener
+from .query_audit import index_load
+
+
+# seconds after which the categories are read again, so that writes made
+# by other worker processes are eventually picked up
+CATEGORY_CACHE_MAX_AGE = int(os.getenv('CATEGORY_CACHE_MAX_AGE', 60))
+
+
+"""
+CategoryCache
+    the {id: type} dict of the categories table, read once and kept until
+    a category is written (or max_age passes).  Every load bumps version
+    and pre-encodes the GET /categories body once, together with its ETag,
+    so conditional requests are answered without touching the database or
+    serializing JSON.  The ETag is a hash of the body, so workers that
+    hold the same categories agree on it.
+"""
+class CategoryCache:
+
+    def __init__(self, max_age=CATEGORY_CACHE_MAX_AGE):
+        self.max_age = max_age
+        self.version = 0
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self._categories = {}
+        self._body = None
+        self._etag = None
+
+    def load(self):
+        with index_load():
+            categories = Category.query.order_by(Category.id).all()
+        categories_dict = {}
+        for category in categories:
+            categories_dict[category.id] = category.type
+
+        body = json.dumps({
+            'categories': categories_dict,
+            'success': True
+        }, sort_keys=True).encode()
+
+        with self._lock:
+            self.version += 1
+            self._categories = categories_dict
+            self._body = body
+            self._etag = hashlib.sha1(body).hexdigest()[:20]
+            self.loaded_at = time.monotonic()
+
+    def ensure_loaded(self):
+        if self.loaded_at is None or \
+                time.monotonic() - self.loaded_at > self.max_age:
+            self.load()
+
+    def invalidate(self):
+        with self._lock:
+            self.loaded_at = None
+
+    def categories(self):
+        self.ensure_loaded()
+        return self._categories
+
+    def encoded(self):
+        """Return the pre-encoded GET /categories body and its ETag."""
+        self.ensure_loaded()
+        with self._lock:
+            return self._body, self._etag
+
+
+def category_cache():
+    return current_app.extensions['category_cache']
+
+
+def init_category_cache(app):
+    app.extensions['category_cache'] = CategoryCache()
+
+
+@category_listener
+def invalidate_category_cache(event, category):
+    if not has_app_context():
+        return
+    cache = current_app.extensions.get('category_cache')
+    if cache is not None:
+        cache.invalidate()
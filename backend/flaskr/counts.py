@@ -0,0 +1,102 @@
+import os
+import threading
+import time
+from flask import current_app, has_app_context
+from sqlalchemy import func
+
+from models import db, Question, question_listener
+from .query_audit import index_load
+from .quiz import category_key
+
+
+# seconds after which the counters are reconciled with the table, so that
+# writes made by other worker processes are eventually counted
+QUESTION_COUNTS_MAX_AGE = int(os.getenv('QUESTION_COUNTS_MAX_AGE', 30))
+
+
+"""
+QuestionCounts
+    the number of questions per category and overall, read with one
+    GROUP BY and then maintained by the committed inserts and deletes
+    reported through question_listener, so that total_questions never
+    needs a COUNT over the table.  Reconciled with the table every
+    max_age seconds.
+"""
+class QuestionCounts:
+
+    def __init__(self, max_age=QUESTION_COUNTS_MAX_AGE):
+        self.max_age = max_age
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self._total = 0
+        self._categories = {}
+
+    def load(self):
+        with index_load():
+            rows = db.session.query(
+                Question.category, func.count(Question.id)
+            ).group_by(Question.category).all()
+        categories = {}
+        for category, count in rows:
+            key = category_key(category)
+            categories[key] = categories.get(key, 0) + count
+        with self._lock:
+            self._categories = categories
+            self._total = sum(categories.values())
+            self.loaded_at = time.monotonic()
+
+    def ensure_loaded(self):
+        if self.loaded_at is None or \
+                time.monotonic() - self.loaded_at > self.max_age:
+            self.load()
+
+    def reset(self):
+        with self._lock:
+            self.loaded_at = None
+
+    def _change(self, category, delta):
+        with self._lock:
+            if self.loaded_at is None:
+                return
+            key = category_key(category)
+            self._categories[key] = max(
+                0, self._categories.get(key, 0) + delta)
+            self._total = max(0, self._total + delta)
+
+    def add(self, category):
+        self._change(category, 1)
+
+    def remove(self, category):
+        self._change(category, -1)
+
+    def total(self, category=None):
+        """Number of questions of a category, or of all of them."""
+        self.ensure_loaded()
+        with self._lock:
+            if category is None:
+                return self._total
+            return self._categories.get(category_key(category), 0)
+
+
+def question_counts():
+    return current_app.extensions['question_counts']
+
+
+def init_question_counts(app):
+    app.extensions['question_counts'] = QuestionCounts()
+
+
+@question_listener
+def sync_question_counts(event, question):
+    if not has_app_context():
+        return
+    counts = current_app.extensions.get('question_counts')
+    if counts is None:
+        return
+    if event == 'insert':
+        counts.add(question['category'])
+    elif event == 'delete':
+        counts.remove(question['category'])
+    else:
+        # a 'purge' may already be counted by a reconciliation
+        counts.reset()
@@ -0,0 +1,103 @@
+import threading
+import time
+
+try:
+    import redis
+except ImportError:  # redis is optional, only needed for redis:// stores
+    redis = None
+
+
+"""
+LocalKeyValueStore
+    an in-process stand-in for the subset of the Redis client API used by
+    the backend (get, set with ex=, getrange, incr, expire, delete), so the
+    stores built on top of it run unchanged against a real Redis server
+    when several workers have to share state.
+"""
+class LocalKeyValueStore:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+        self._expires = {}
+
+    def _alive(self, name, now):
+        expires = self._expires.get(name)
+        if expires is not None and expires <= now:
+            self._data.pop(name, None)
+            self._expires.pop(name, None)
+        return name in self._data
+
+    def get(self, name):
+        with self._lock:
+            if not self._alive(name, time.monotonic()):
+                return None
+            return self._data[name]
+
+    def set(self, name, value, ex=None):
+        if isinstance(value, str):
+            value = value.encode()
+        elif isinstance(value, int):
+            value = str(value).encode()
+        with self._lock:
+            self._data[name] = value
+            if ex is None:
+                self._expires.pop(name, None)
+            else:
+                self._expires[name] = time.monotonic() + ex
+        return True
+
+    def getrange(self, name, start, end):
+        value = self.get(name)
+        if value is None:
+            return b''
+        return value[start:end + 1]
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            if self._alive(name, time.monotonic()):
+                value = int(self._data[name]) + amount
+            else:
+                value = amount
+            self._data[name] = str(value).encode()
+            return value
+
+    def expire(self, name, time_):
+        with self._lock:
+            if not self._alive(name, time.monotonic()):
+                return False
+            self._expires[name] = time.monotonic() + time_
+            return True
+
+    def delete(self, *names):
+        deleted = 0
+        with self._lock:
+            for name in names:
+                self._expires.pop(name, None)
+                if self._data.pop(name, None) is not None:
+                    deleted += 1
+        return deleted
+
+    def purge_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            for name in [name for name, expires in self._expires.items()
+                         if expires <= now]:
+                self._data.pop(name, None)
+                self._expires.pop(name, None)
+
+
+"""
+connect_store(url)
+    returns a key-value client for url: 'local' gives a LocalKeyValueStore,
+    'redis://...' a Redis client (requires the redis package).
+"""
+def connect_store(url):
+    if url == 'local':
+        return LocalKeyValueStore()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        if redis is None:
+            raise RuntimeError(
+                'the redis package is required for store {}'.format(url))
+        return redis.Redis.from_url(url)
+    raise ValueError('unknown key-value store {}'.format(url))
@@ -0,0 +1,418 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import bindparam, text
+
+from models import db, Answer, Score
+from .query_audit import index_load
+from .quiz import ALL_CATEGORIES, category_key
+
+
+# seconds between two flushes of the buffered answers, 0 to flush only
+# when Leaderboard.flush() is called (tests)
+SCORE_FLUSH_INTERVAL = float(os.getenv('SCORE_FLUSH_INTERVAL', 1))
+
+# buffered answers that wake the flusher before the interval is over
+SCORE_FLUSH_SIZE = int(os.getenv('SCORE_FLUSH_SIZE', 500))
+
+# answers kept in the buffer while the flushes fail, e.g. the database is
+# down; the oldest past it are dropped, their points taken back and logged
+SCORE_BUFFER_MAX = int(os.getenv('SCORE_BUFFER_MAX', 100000))
+
+# seconds after which the flusher reloads the boards from the scores
+# table, to pick up the points recorded by other worker processes
+LEADERBOARD_REFRESH = float(os.getenv('LEADERBOARD_REFRESH', 30))
+
+# players returned by default, and at most, by GET /leaderboard
+LEADERBOARD_SIZE = 10
+MAX_LEADERBOARD_SIZE = 100
+
+# adds the buffered deltas to the totals, whichever worker wrote them last
+UPSERT_SCORES = text(
+    'INSERT INTO scores (player, category, points, answered) '
+    'VALUES (:player, :category, :points, :answered) '
+    'ON CONFLICT (player, category) DO UPDATE SET '
+    'points = scores.points + excluded.points, '
+    'answered = scores.answered + excluded.answered')
+
+# answers written by one INSERT at most
+ANSWER_INSERT_BATCH = 500
+
+ANSWER_COLUMNS = ('session', 'player', 'question_id', 'category', 'correct',
+                  'answered_at')
+
+# the questions of a session already in the answers table
+RECORDED_QUESTIONS = text(
+    'SELECT question_id FROM answers WHERE session = :session '
+    'AND question_id IN :question_ids').bindparams(
+        bindparam('question_ids', expanding=True))
+
+logger = logging.getLogger(__name__)
+
+
+def insert_answers_statement(size):
+    """
+    One INSERT of size answers skipping those whose (session, question_id)
+    is already in the table, e.g. written by another worker, and returning
+    the answers actually written (RETURNING needs PostgreSQL, or SQLite
+    3.35).
+    """
+    rows = ', '.join('({})'.format(', '.join(
+        ':{}_{}'.format(column, number) for column in ANSWER_COLUMNS))
+        for number in range(size))
+    return text(
+        'INSERT INTO answers ({}) VALUES {} '
+        'ON CONFLICT (session, question_id) DO NOTHING '
+        'RETURNING player, category, correct'.format(
+            ', '.join(ANSWER_COLUMNS), rows))
+
+
+def score_deltas(player, results):
+    """The {(player, category): [points, answered]} of (category,
+    correct) results, overall (ALL_CATEGORIES) included."""
+    deltas = {(player, ALL_CATEGORIES): [0, 0]}
+    for category, correct in results:
+        for key in ((player, category_key(category)), (player, ALL_CATEGORIES)):
+            delta = deltas.setdefault(key, [0, 0])
+            delta[0] += bool(correct)
+            delta[1] += 1
+    return deltas
+
+
+"""
+Board
+    the players of one leaderboard, as {player: (points, answered)} plus a
+    list of (-points, player) kept sorted with bisect: the top N is a
+    slice of the list and the rank of a player one binary search, so no
+    read scans the players or the scores table.  Adding points moves one
+    entry of the list (a memmove); a board loaded from the table is sorted
+    once.
+"""
+class Board:
+
+    def __init__(self, totals=None):
+        self._totals = dict(totals or {})
+        self._order = sorted((-points, player) for player, (points, _)
+                             in self._totals.items())
+
+    def add(self, player, points, answered):
+        old_points, old_answered = self._totals.get(player, (0, 0))
+        if player in self._totals:
+            del self._order[bisect_left(self._order, (-old_points, player))]
+        self._totals[player] = (old_points + points, old_answered + answered)
+        insort(self._order, (-(old_points + points), player))
+
+    def top(self, limit):
+        players = []
+        for position, (points, player) in enumerate(self._order[:limit], 1):
+            # players with the same points share the best rank
+            tied = players and players[-1]['points'] == -points
+            players.append({
+                'rank': players[-1]['rank'] if tied else position,
+                'player': player,
+                'points': -points,
+                'answered': self._totals[player][1]})
+        return players
+
+    def player(self, player):
+        """The rank, points and answers of player, None when unknown."""
+        if player not in self._totals:
+            return None
+        points, answered = self._totals[player]
+        # players with more points rank higher, ties share a rank
+        rank = bisect_left(self._order, (-points, '')) + 1
+        return {'rank': rank, 'player': player, 'points': points,
+                'answered': answered}
+
+    def __len__(self):
+        return len(self._totals)
+
+
+"""
+Leaderboard
+    records the answers of scoring sessions and keeps a Board per category
+    and one overall (ALL_CATEGORIES).
+
+    record() only updates the boards and appends to an in-memory buffer;
+    the buffer is written by flush() in one transaction per batch: a bulk
+    INSERT of the answers and one upsert adding the points per (player,
+    category), instead of a commit per answer.  A question scores once per
+    session: record() skips those already in the buffer or the answers
+    table, and the unique (session, question_id) index drops those another
+    worker wrote meanwhile, whose points are taken back off the boards.  A daemon thread flushes
+    every flush_interval seconds, or as soon as flush_size answers are
+    waiting, and reloads the boards from the scores table every
+    refresh seconds.  A batch that fails to be written is put back in
+    front of the buffer and retried; past max_pending answers the oldest
+    are dropped, so the buffer of a worker whose database stays down does
+    not grow until it runs out of memory.
+"""
+class Leaderboard:
+
+    def __init__(self, flush_interval=SCORE_FLUSH_INTERVAL,
+                 flush_size=SCORE_FLUSH_SIZE, refresh=LEADERBOARD_REFRESH,
+                 max_pending=SCORE_BUFFER_MAX):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.refresh = refresh
+        self.max_pending = max_pending
+        self.loaded_at = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._boards = {}
+        self._answers = []
+        self._deltas = {}
+        self._recorded = set()
+        self._wake = threading.Event()
+        self._flusher = None
+        self.flushes = 0
+        self.flushed_answers = 0
+        self.flush_errors = 0
+        self.dropped_answers = 0
+        self.last_flush_ms = None
+
+    def load(self):
+        # not while a batch is on its way to the table
+        with self._flush_lock:
+            with index_load():
+                rows = db.session.query(
+                    Score.player, Score.category, Score.points,
+                    Score.answered).all()
+            totals = {}
+            for player, category, points, answered in rows:
+                totals.setdefault(category, {})[player] = (points, answered)
+            with self._lock:
+                # the answers not written yet are not in the table
+                for (player, category), (points, answered) in \
+                        self._deltas.items():
+                    old_points, old_answered = totals.setdefault(
+                        category, {}).get(player, (0, 0))
+                    totals[category][player] = (old_points + points,
+                                                old_answered + answered)
+                self._boards = {category: Board(players)
+                                for category, players in totals.items()}
+                self.loaded_at = time.monotonic()
+
+    def ensure_loaded(self):
+        if self.loaded_at is None:
+            self.load()
+
+    def reset(self):
+        with self._lock:
+            self.loaded_at = None
+
+    def record(self, session, player, results):
+        """
+        Record the (question_id, category, correct) results of player in
+        session, skipping the questions already recorded in session, and
+        return the points they scored and the results recorded.
+        """
+        self.ensure_loaded()
+        answered_at = datetime.utcnow()
+        in_table = {question_id for question_id, in db.session.execute(
+            RECORDED_QUESTIONS, {
+                'session': session,
+                'question_ids': [question_id for question_id, _, _ in results]})}
+
+        with self._lock:
+            # checked and claimed at once, so concurrent replays score once
+            results = [(question_id, category, correct)
+                       for question_id, category, correct in results
+                       if question_id not in in_table and
+                       (session, question_id) not in self._recorded]
+            self._recorded.update((session, question_id)
+                                  for question_id, _, _ in results)
+            self._answers.extend({
+                'session': session, 'player': player,
+                'question_id': question_id, 'category': category,
+                'correct': bool(correct), 'answered_at': answered_at
+            } for question_id, category, correct in results)
+            deltas = score_deltas(player, [(category, correct) for _, category,
+                                           correct in results])
+            self.add(deltas)
+            for key, (points, answered) in deltas.items():
+                delta = self._deltas.setdefault(key, [0, 0])
+                delta[0] += points
+                delta[1] += answered
+            waiting = len(self._answers)
+        if waiting >= self.flush_size:
+            self._wake.set()
+        return deltas[(player, ALL_CATEGORIES)][0], results
+
+    def add(self, deltas, sign=1):
+        """Add the points and answers of deltas to the boards; with the
+        lock held."""
+        for (player, category), (points, answered) in deltas.items():
+            if answered:
+                self._boards.setdefault(category, Board()).add(
+                    player, sign * points, sign * answered)
+
+    def _drop_oldest(self):
+        """Drop the answers past max_pending from the front of the buffer
+        and take their points back; with the lock held."""
+        excess = len(self._answers) - self.max_pending
+        if excess <= 0:
+            return
+        dropped, self._answers[:excess] = self._answers[:excess], []
+        for answer in dropped:
+            self._recorded.discard((answer['session'], answer['question_id']))
+            deltas = score_deltas(answer['player'], [
+                (answer['category'], answer['correct'])])
+            self.add(deltas, sign=-1)
+            for key, (points, answered) in deltas.items():
+                delta = self._deltas[key]
+                delta[0] -= points
+                delta[1] -= answered
+                if delta == [0, 0]:
+                    del self._deltas[key]
+        self.dropped_answers += len(dropped)
+        logger.error('score buffer full, dropped %d answers: %s', len(dropped),
+                     ', '.join('{} {} q{} {}'.format(
+                         answer['player'], answer['session'],
+                         answer['question_id'],
+                         'correct' if answer['correct'] else 'wrong')
+                         for answer in dropped))
+
+    def top(self, category=ALL_CATEGORIES, limit=LEADERBOARD_SIZE):
+        self.ensure_loaded()
+        with self._lock:
+            board = self._boards.get(category_key(category))
+            if board is None:
+                return [], 0
+            return board.top(limit), len(board)
+
+    def player(self, player, category=ALL_CATEGORIES):
+        self.ensure_loaded()
+        with self._lock:
+            board = self._boards.get(category_key(category))
+            return board.player(player) if board is not None else None
+
+    def flush(self):
+        """Write the buffered answers and points; returns the answers
+        written."""
+        with self._flush_lock:
+            with self._lock:
+                answers, self._answers = self._answers, []
+                deltas, self._deltas = self._deltas, {}
+            if not answers:
+                return 0
+            start = time.perf_counter()
+            written = []
+            try:
+                for offset in range(0, len(answers), ANSWER_INSERT_BATCH):
+                    batch = answers[offset:offset + ANSWER_INSERT_BATCH]
+                    params = {}
+                    for number, answer in enumerate(batch):
+                        for column in ANSWER_COLUMNS:
+                            params['{}_{}'.format(column, number)] = answer[column]
+                    written.extend(db.session.execute(
+                        insert_answers_statement(len(batch)), params).fetchall())
+                # the points of the answers written, in key order so that
+                # concurrent flushes lock rows alike
+                written_deltas = {}
+                for player, category, correct in written:
+                    for key, (points, answered) in score_deltas(
+                            player, [(category, correct)]).items():
+                        delta = written_deltas.setdefault(key, [0, 0])
+                        delta[0] += points
+                        delta[1] += answered
+                if written_deltas:
+                    db.session.execute(UPSERT_SCORES, [{
+                        'player': player, 'category': category,
+                        'points': points, 'answered': answered
+                    } for (player, category), (points, answered)
+                        in sorted(written_deltas.items())])
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                with self._lock:
+                    self._answers[:0] = answers
+                    for key, (points, answered) in deltas.items():
+                        delta = self._deltas.setdefault(key, [0, 0])
+                        delta[0] += points
+                        delta[1] += answered
+                    self.flush_errors += 1
+                    self._drop_oldest()
+                raise
+            with self._lock:
+                # the table holds them now
+                self._recorded.difference_update(
+                    (answer['session'], answer['question_id'])
+                    for answer in answers)
+                # answers another worker recorded first scored nothing
+                self.add({key: [points - written_deltas.get(key, [0, 0])[0],
+                                answered - written_deltas.get(key, [0, 0])[1]]
+                          for key, (points, answered) in deltas.items()},
+                         sign=-1)
+            self.flushes += 1
+            self.flushed_answers += len(written)
+            self.last_flush_ms = round((time.perf_counter() - start) * 1000, 3)
+            return len(written)
+
+    def start(self, app):
+        """Start the flusher of app once, e.g. on the first answer of a
+        worker process rather than in a parent that forks."""
+        if self.flush_interval <= 0 or self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = LeaderboardFlusher(app, self)
+        self._flusher.start()
+        atexit.register(self._flusher.flush)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'boards': {str(category): len(board)
+                           for category, board in self._boards.items()},
+                'pending_answers': len(self._answers),
+                'flushes': self.flushes,
+                'flushed_answers': self.flushed_answers,
+                'flush_errors': self.flush_errors,
+                'dropped_answers': self.dropped_answers,
+                'last_flush_ms': self.last_flush_ms,
+                'flusher': self._flusher is not None
+            }
+
+
+class LeaderboardFlusher(threading.Thread):
+
+    def __init__(self, app, leaderboard):
+        super().__init__(daemon=True)
+        self.app = app
+        self.leaderboard = leaderboard
+
+    def flush(self):
+        with self.app.app_context():
+            try:
+                self.leaderboard.flush()
+                loaded_at = self.leaderboard.loaded_at
+                if loaded_at is not None and \
+                        time.monotonic() - loaded_at > self.leaderboard.refresh:
+                    self.leaderboard.load()
+            except Exception:
+                logger.exception('leaderboard flush failed')
+            finally:
+                db.session.remove()
+
+    def run(self):
+        while True:
+            self.leaderboard._wake.wait(self.leaderboard.flush_interval)
+            self.leaderboard._wake.clear()
+            self.flush()
+
+
+def leaderboard():
+    return current_app.extensions['leaderboard']
+
+
+def init_leaderboard(app, board=None):
+    app.config.setdefault('SCORE_FLUSH_INTERVAL', SCORE_FLUSH_INTERVAL)
+    app.extensions['leaderboard'] = board or Leaderboard(
+        flush_interval=app.config['SCORE_FLUSH_INTERVAL'])
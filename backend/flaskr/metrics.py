@@ -0,0 +1,286 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+# requests sent with this header are profiled when PROFILE_DIR is set
+PROFILE_HEADER = 'X-Profile'
+# directory the folded stack profiles are written to, empty to disable
+PROFILE_DIR = os.getenv('PROFILE_DIR', '')
+# seconds between two stack samples of a profiled request
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.001))
+
+# transaction control, e.g. the savepoints of the test fixtures, is not
+# counted as a query
+TRANSACTION_CONTROL = re.compile(
+    r'\s*(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b', re.I)
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+"""
+RequestStats
+    what a single request cost: SQL statements and the time spent in them,
+    rows fetched.  Kept in g while the request runs.  When audit is
+    set the statements themselves are kept for query_audit.
+"""
+class RequestStats:
+
+    def __init__(self, audit=False):
+        self.started_at = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.rows = 0
+        # (statement, parameters, run inside index_load()) when auditing
+        self.statements = [] if audit else None
+        self.index_loads = 0
+        self.index_load_rows = 0
+
+
+def request_stats():
+    if not has_request_context():
+        return None
+    return g.get('request_stats')
+
+
+"""
+Metrics
+    per-route counters and latency histograms of one worker process,
+    rendered in the Prometheus text format by GET /metrics.
+"""
+class Metrics:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.requests = Counter()
+        self.latency_buckets = Counter()
+        self.latency_sum = Counter()
+        self.sql_count = Counter()
+        self.sql_time = Counter()
+        self.rows = Counter()
+        self.response_bytes = Counter()
+
+    def record(self, route, method, status, stats, response_bytes):
+        elapsed = time.perf_counter() - stats.started_at
+        key = (route, method)
+        with self._lock:
+            self.requests[key + (status,)] += 1
+            for bucket in self.buckets:
+                if elapsed <= bucket:
+                    self.latency_buckets[key + (bucket,)] += 1
+            self.latency_buckets[key + ('+Inf',)] += 1
+            self.latency_sum[key] += elapsed
+            self.sql_count[key] += stats.sql_count
+            self.sql_time[key] += stats.sql_time
+            self.rows[key] += stats.rows
+            self.response_bytes[key] += response_bytes
+
+    def render(self, pool=None):
+        lines = []
+
+        def family(name, kind, help_, samples):
+            lines.append('# HELP {} {}'.format(name, help_))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for labels, value in samples:
+                lines.append('{}{{{}}} {}'.format(name, ','.join(
+                    '{}="{}"'.format(label, label_value)
+                    for label, label_value in labels), value))
+
+        def route_labels(key):
+            return [('route', key[0]), ('method', key[1])]
+
+        with self._lock:
+            family('trivia_requests_total', 'counter', 'Requests served.',
+                   [(route_labels(key) + [('status', key[2])], value)
+                    for key, value in sorted(self.requests.items())])
+            family('trivia_request_duration_seconds', 'histogram',
+                   'Request latency.',
+                   [(route_labels(key) + [('le', key[2])], value)
+                    for key, value in sorted(self.latency_buckets.items(),
+                                             key=bucket_order)])
+            lines.extend(
+                'trivia_request_duration_seconds_{}{{route="{}",method="{}"}} {}'.format(
+                    suffix, key[0], key[1], value)
+                for key in sorted(self.latency_sum)
+                for suffix, value in (
+                    ('sum', round(self.latency_sum[key], 6)),
+                    ('count', self.latency_buckets[key + ('+Inf',)])))
+            for name, help_, counter in (
+                    ('trivia_sql_statements_total', 'SQL statements run.',
+                     self.sql_count),
+                    ('trivia_sql_seconds_total', 'Time spent in SQL.',
+                     self.sql_time),
+                    ('trivia_rows_fetched_total', 'Rows fetched from the database.',
+                     self.rows),
+                    ('trivia_response_bytes_total', 'Response body bytes.',
+                     self.response_bytes)):
+                family(name, 'counter', help_,
+                       [(route_labels(key), round(value, 6))
+                        for key, value in sorted(counter.items())])
+
+        if pool:
+            family('trivia_db_pool', 'gauge', 'Connection pool state.',
+                   [([('stat', name)], value) for name, value in
+                    sorted(pool.items()) if isinstance(value, (int, float))])
+        return '\n'.join(lines) + '\n'
+
+
+def bucket_order(item):
+    key = item[0]
+    return key[:2] + (float('inf') if key[2] == '+Inf' else key[2],)
+
+
+"""
+StackSampler
+    a sampling profiler for one thread: every interval seconds the stack
+    of the thread is recorded, and the samples are written in the folded
+    format read by flamegraph.pl and speedscope.
+"""
+class StackSampler(threading.Thread):
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('{}:{}'.format(
+                    os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def folded(self):
+        return ''.join('{} {}\n'.format(stack, count)
+                       for stack, count in self.samples.most_common())
+
+
+def start_request():
+    audit = current_app.config.get('QUERY_AUDIT', 'off') != 'off'
+    if current_app.config.get('METRICS_ENABLED') or audit:
+        g.request_stats = RequestStats(audit)
+    if current_app.config.get('PROFILE_DIR') and \
+            request.headers.get(PROFILE_HEADER):
+        g.profiler = StackSampler(threading.get_ident())
+        g.profiler.start()
+
+
+def finish_request(response):
+    profiler = g.get('profiler')
+    if profiler is not None:
+        profiler.stop()
+        path = os.path.join(current_app.config['PROFILE_DIR'], '{}-{}.folded'.format(
+            int(time.time() * 1000), request.endpoint or 'unknown'))
+        with open(path, 'w') as f:
+            f.write(profiler.folded())
+        response.headers['X-Profile-File'] = path
+
+    stats = g.get('request_stats')
+    if stats is not None and current_app.config.get('METRICS_ENABLED'):
+        current_app.extensions['metrics'].record(
+            request.url_rule.rule if request.url_rule else 'unmatched',
+            request.method, response.status_code, stats,
+            response.calculate_content_length() or 0)
+    return response
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement(conn, cursor, statement, parameters, context, executemany):
+    stats = request_stats()
+    if stats is not None:
+        conn.info.setdefault('statement_started_at', []).append(
+            time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def finish_statement(conn, cursor, statement, parameters, context, executemany):
+    stats = request_stats()
+    started_at = conn.info.get('statement_started_at')
+    if stats is not None and started_at:
+        elapsed = time.perf_counter() - started_at.pop()
+        if TRANSACTION_CONTROL.match(statement):
+            return
+        stats.sql_count += 1
+        stats.sql_time += elapsed
+        if stats.statements is not None:
+            stats.statements.append(
+                (statement, repr(parameters), stats.index_loads > 0))
+
+
+def count_rows(stats, rows):
+    stats.rows += rows
+    if stats.index_loads:
+        stats.index_load_rows += rows
+
+
+"""
+RowCountingCursor
+    the DBAPI cursor of a result, counting the rows fetched from it into
+    the RequestStats of the request: the rows of ORM queries and of the
+    column and text() queries alike, since the ORM 'load' event only sees
+    the mapped instances.
+"""
+class RowCountingCursor:
+
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            count_rows(self._stats, 1)
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        count_rows(self._stats, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        count_rows(self._stats, len(rows))
+        return rows
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+@event.listens_for(Engine, 'after_execute')
+def count_fetched_rows(conn, clauseelement, multiparams, params, result):
+    stats = request_stats()
+    # statements returning no rows have closed their cursor already
+    if stats is not None and getattr(result, 'cursor', None) is not None:
+        result.cursor = RowCountingCursor(result.cursor, stats)
+
+
+def init_metrics(app):
+    app.config.setdefault('METRICS_ENABLED', METRICS_ENABLED)
+    app.config.setdefault('PROFILE_DIR', PROFILE_DIR)
+    app.extensions['metrics'] = Metrics()
+    app.before_request(start_request)
+
+
+def metrics():
+    return current_app.extensions['metrics']
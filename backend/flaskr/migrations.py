@@ -0,0 +1,205 @@
+import os
+import click
+from datetime import datetime
+from sqlalchemy import (Boolean, Column, DateTime, Index, Integer, MetaData,
+                        String, Table, func, inspect, select, text)
+
+from models import db
+
+
+# run the pending migrations when the app starts; turn off when several
+# processes boot at once and `flask db-upgrade` is run by the deployment
+DB_AUTO_MIGRATE = os.getenv('DB_AUTO_MIGRATE', 'true').lower() in ('1', 'true', 'yes')
+
+# key of the PostgreSQL advisory lock serializing concurrent upgrades
+MIGRATION_LOCK_ID = 7233405
+
+metadata = MetaData()
+
+schema_version = Table(
+    'schema_version', metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String, nullable=False),
+    Column('applied_at', DateTime, nullable=False))
+
+# the tables as trivia.psql and the first db.create_all() left them
+baseline_tables = [
+    Table('categories', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('type', String)),
+    Table('questions', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('question', String),
+          Column('answer', String),
+          Column('category', String),
+          Column('difficulty', Integer)),
+]
+
+
+def baseline(conn):
+    for table in baseline_tables:
+        table.create(conn, checkfirst=True)
+
+
+def category_foreign_key(conn):
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text(
+            'ALTER TABLE questions ALTER COLUMN category TYPE integer '
+            'USING category::integer'))
+        # db.create_all() may already have added it under the same name
+        conn.execute(text(
+            'ALTER TABLE questions DROP CONSTRAINT IF EXISTS '
+            'questions_category_fkey'))
+        conn.execute(text(
+            'ALTER TABLE questions ADD CONSTRAINT questions_category_fkey '
+            'FOREIGN KEY (category) REFERENCES categories (id)'))
+        return
+    # SQLite cannot alter a column: rebuild the table
+    conn.execute(text(
+        'CREATE TABLE questions_new ('
+        'id INTEGER NOT NULL PRIMARY KEY, question VARCHAR, answer VARCHAR, '
+        'category INTEGER REFERENCES categories (id), difficulty INTEGER)'))
+    conn.execute(text(
+        'INSERT INTO questions_new (id, question, answer, category, difficulty) '
+        'SELECT id, question, answer, CAST(category AS INTEGER), difficulty '
+        'FROM questions'))
+    conn.execute(text('DROP TABLE questions'))
+    conn.execute(text('ALTER TABLE questions_new RENAME TO questions'))
+
+
+def question_indexes(conn):
+    # category listings: WHERE category = ? ORDER BY id LIMIT ?
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_questions_category_id '
+        'ON questions (category, id)'))
+    # quiz draws by category and difficulty
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_questions_category_difficulty '
+        'ON questions (category, difficulty)'))
+
+
+# the leaderboard's tables, see models.Score and models.Answer
+score_tables = [
+    Table('scores', metadata,
+          Column('player', String, primary_key=True),
+          Column('category', Integer, primary_key=True),
+          Column('points', Integer, nullable=False),
+          Column('answered', Integer, nullable=False)),
+    Table('answers', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('session', String, nullable=False),
+          Column('player', String, nullable=False),
+          Column('question_id', Integer, nullable=False),
+          Column('category', Integer),
+          Column('correct', Boolean, nullable=False),
+          Column('answered_at', DateTime, nullable=False),
+          Index('ix_answers_session', 'session')),
+]
+
+
+def scores(conn):
+    for table in score_tables:
+        table.create(conn, checkfirst=True)
+
+
+def question_tombstones(conn):
+    # db.create_all() may already have added it
+    columns = {column['name'] for column in inspect(conn).get_columns('questions')}
+    if 'deleted_at' not in columns:
+        conn.execute(text('ALTER TABLE questions ADD COLUMN deleted_at TIMESTAMP'))
+    # only the tombstones, which the purge looks up
+    conn.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_questions_deleted_at '
+        'ON questions (deleted_at) WHERE deleted_at IS NOT NULL'))
+
+
+def unique_answers(conn):
+    # a question scores once per session: keep the first of any duplicate
+    conn.execute(text(
+        'DELETE FROM answers WHERE id NOT IN '
+        '(SELECT MIN(id) FROM answers GROUP BY session, question_id)'))
+    conn.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_answers_session_question '
+        'ON answers (session, question_id)'))
+
+
+"""
+MIGRATIONS
+    the (version, name, function) steps of the schema, applied in order.
+    Never edit a released step: append a new one, and mirror its end state
+    in models.py so that db.create_all() (tests, benchmarks) builds the
+    same schema.
+"""
+MIGRATIONS = [
+    (1, 'baseline tables', baseline),
+    (2, 'integer category foreign key', category_foreign_key),
+    (3, 'question indexes', question_indexes),
+    (4, 'scores and answers', scores),
+    (5, 'question tombstones', question_tombstones),
+    (6, 'unique answers per session', unique_answers),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    if not conn.dialect.has_table(conn, 'schema_version'):
+        return 0
+    return conn.execute(
+        select([func.max(schema_version.c.version)])).scalar() or 0
+
+
+"""
+upgrade(engine, target=LATEST_VERSION)
+    applies the migrations above the version recorded in schema_version,
+    up to target, in one transaction, and returns their names.  On
+    PostgreSQL an advisory lock makes concurrent upgrades wait for each
+    other instead of applying the same steps twice.
+"""
+def upgrade(engine, target=LATEST_VERSION):
+    applied = []
+    with engine.begin() as conn:
+        if conn.dialect.name == 'postgresql':
+            conn.execute(text('SELECT pg_advisory_xact_lock(:id)'),
+                         id=MIGRATION_LOCK_ID)
+        schema_version.create(conn, checkfirst=True)
+        version = current_version(conn)
+        for number, name, migrate in MIGRATIONS:
+            if version < number <= target:
+                migrate(conn)
+                conn.execute(schema_version.insert().values(
+                    version=number, name=name, applied_at=datetime.utcnow()))
+                applied.append('{:04d} {}'.format(number, name))
+    return applied
+
+
+def ensure_schema(engine):
+    """Upgrade when behind; a single catalog query and SELECT otherwise."""
+    with engine.connect() as conn:
+        if current_version(conn) >= LATEST_VERSION:
+            return []
+    return upgrade(engine)
+
+
+def init_migrations(app):
+    app.config.setdefault('DB_AUTO_MIGRATE', DB_AUTO_MIGRATE)
+    if app.config['DB_AUTO_MIGRATE']:
+        with app.app_context():
+            ensure_schema(db.engine)
+
+    @app.cli.command('db-upgrade')
+    @click.option('--target', type=int, default=LATEST_VERSION,
+                  help='version to upgrade to')
+    def db_upgrade_command(target):
+        """Apply the pending schema migrations."""
+        for name in upgrade(db.engine, target):
+            click.echo('applied {}'.format(name))
+        with db.engine.connect() as conn:
+            click.echo('schema at version {}'.format(current_version(conn)))
+
+    @app.cli.command('db-version')
+    def db_version_command():
+        """Print the schema version of the database."""
+        with db.engine.connect() as conn:
+            click.echo('{} (latest {})'.format(
+                current_version(conn), LATEST_VERSION))
@@ -0,0 +1,189 @@
+import heapq
+import os
+import click
+from functools import lru_cache
+from itertools import islice
+from flask import current_app
+from sqlalchemy import text
+
+from models import db, Question, category_listener
+from .quiz import ALL_CATEGORIES, category_key
+from .serialization import QUESTION_COLUMNS
+
+
+# 'category' pages the whole question list as a merge of the per-category
+# partitions; 'off' reads it from the table in id order.  The category
+# listings and quizzes are routed to their partition either way.
+QUESTION_PARTITIONING = os.getenv('QUESTION_PARTITIONING', 'off')
+
+PARTITIONING_MODES = ('off', 'category')
+
+# PostgreSQL: the list-partitioned question table and its partitions
+PARTITION_NAME = 'questions_category_{}'
+DEFAULT_PARTITION = 'questions_default'
+
+IS_PARTITIONED = text(
+    "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+    "WHERE partrelid = 'questions'::regclass)")
+
+
+def partition_key(category):
+    """The partition of a category id, None for all the categories."""
+    key = category_key(category)
+    return None if key in (None, ALL_CATEGORIES) else key
+
+
+def partition_query(category=None):
+    """
+    The Question query of one category, whose condition on the partition
+    key lets PostgreSQL prune the other partitions (and walks one range of
+    the (category, id) index on an unpartitioned table); all the
+    questions when category is None or ALL_CATEGORIES.
+    """
+    key = partition_key(category)
+    if key is None:
+        return Question.query
+    return Question.query.filter(Question.category == key)
+
+
+def get_question(question_id, category=None):
+    """The question question_id, looked up in the partition of category
+    when the caller knows it."""
+    if partition_key(category) is None:
+        return Question.query.get(question_id)
+    return partition_query(category).filter(Question.id == question_id).first()
+
+
+@lru_cache(maxsize=64)
+def merged_statement(partitions, descending):
+    """One UNION ALL of the keyset pages of partitions partitions, each
+    branch bound to its category as :category_<n>."""
+    branch = (
+        'SELECT * FROM (SELECT {columns} FROM questions '
+        'WHERE category = :category_{{n}} AND deleted_at IS NULL '
+        'AND id {operator} :bound ORDER BY id {order} LIMIT :limit) '
+        'AS partition_{{n}}').format(
+            columns=', '.join(QUESTION_COLUMNS),
+            operator='<' if descending else '>',
+            order='DESC' if descending else 'ASC')
+    return text(' UNION ALL '.join(
+        branch.format(n=n) for n in range(partitions)))
+
+
+"""
+merged_rows(categories, after=None, before=None, limit)
+    the first limit question rows after (or before) an id across the
+    partitions of categories: each partition returns its own first limit
+    rows by keyset, all of them in one UNION ALL statement, and the
+    sorted runs are k-way merged with heapq.merge.  A page costs limit
+    rows per partition read from the (category, id) index, whatever the
+    size of the partitions or of the bank.
+"""
+def merged_rows(categories, after=None, before=None, limit=10):
+    categories = [partition_key(category) for category in categories]
+    if not categories:
+        return []
+    descending = after is None and before is not None
+    params = {'category_{}'.format(n): category
+              for n, category in enumerate(categories)}
+    params['bound'] = before if descending else (after or 0)
+    params['limit'] = limit
+
+    runs = {}
+    for row in db.session.execute(
+            merged_statement(len(categories), descending), params).fetchall():
+        runs.setdefault(row.category, []).append(row)
+    # the order of the rows of a UNION ALL is not guaranteed
+    runs = [sorted(run, key=row_id, reverse=descending)
+            for run in runs.values()]
+    return list(islice(heapq.merge(*runs, key=row_id, reverse=descending),
+                       limit))
+
+
+def row_id(row):
+    return row.id
+
+
+def partitioning():
+    return current_app.config.get('QUESTION_PARTITIONING', 'off') != 'off'
+
+
+def is_partitioned():
+    return db.engine.dialect.name == 'postgresql' and \
+        db.session.execute(IS_PARTITIONED).scalar()
+
+
+def create_partition(category):
+    db.session.execute(text(
+        'CREATE TABLE IF NOT EXISTS {} PARTITION OF questions '
+        'FOR VALUES IN ({:d})'.format(PARTITION_NAME.format(category), category)))
+
+
+"""
+partition_questions(categories)
+    turns the questions table of PostgreSQL into a table partitioned by
+    LIST (category), with a partition per category and a default one,
+    in a single transaction: the rows are copied over, the indexes of
+    models.Question are created on every partition and the id sequence
+    keeps its value.  Unique keys of a partitioned table must include the
+    partition key, so the primary key becomes (category, id).
+"""
+def partition_questions(categories):
+    statements = [
+        'LOCK TABLE questions IN ACCESS EXCLUSIVE MODE',
+        'ALTER SEQUENCE questions_id_seq OWNED BY NONE',
+        'ALTER TABLE questions RENAME TO questions_unpartitioned',
+        'CREATE TABLE questions (LIKE questions_unpartitioned INCLUDING DEFAULTS) '
+        'PARTITION BY LIST (category)',
+        'CREATE TABLE {} PARTITION OF questions DEFAULT'.format(DEFAULT_PARTITION),
+    ] + [
+        'CREATE TABLE {} PARTITION OF questions FOR VALUES IN ({:d})'.format(
+            PARTITION_NAME.format(category), category)
+        for category in categories
+    ] + [
+        'INSERT INTO questions SELECT * FROM questions_unpartitioned',
+        'DROP TABLE questions_unpartitioned',
+        'ALTER SEQUENCE questions_id_seq OWNED BY questions.id',
+        'ALTER TABLE questions ALTER COLUMN category SET NOT NULL',
+        'ALTER TABLE questions ADD PRIMARY KEY (category, id)',
+        'ALTER TABLE questions ADD FOREIGN KEY (category) REFERENCES categories (id)',
+        'CREATE INDEX ix_questions_id ON questions (id)',
+        'CREATE INDEX ix_questions_category_id ON questions (category, id)',
+        'CREATE INDEX ix_questions_category_difficulty ON questions (category, difficulty)',
+        'CREATE INDEX ix_questions_deleted_at ON questions (deleted_at) '
+        'WHERE deleted_at IS NOT NULL',
+    ]
+    for statement in statements:
+        db.session.execute(text(statement))
+    db.session.commit()
+
+
+@category_listener
+def add_category_partition(event, category):
+    """A new category gets its own partition, before any question."""
+    if event == 'insert' and is_partitioned():
+        create_partition(category['id'])
+        db.session.commit()
+
+
+def init_partitions(app):
+    app.config.setdefault('QUESTION_PARTITIONING', QUESTION_PARTITIONING)
+    if app.config['QUESTION_PARTITIONING'] not in PARTITIONING_MODES:
+        raise ValueError('QUESTION_PARTITIONING must be one of {}'.format(
+            ', '.join(PARTITIONING_MODES)))
+
+    @app.cli.command('partition-questions')
+    def partition_questions_command():
+        """Partition the questions table of PostgreSQL by category."""
+        if db.engine.dialect.name != 'postgresql':
+            click.echo('partitioning needs PostgreSQL, not {}'.format(
+                db.engine.dialect.name))
+            return
+        if is_partitioned():
+            click.echo('questions already partitioned')
+            return
+        categories = [category for category, in db.session.execute(
+            text('SELECT id FROM categories ORDER BY id'))]
+        partition_questions(categories)
+        click.echo('questions partitioned into {} categories'.format(
+            len(categories)))
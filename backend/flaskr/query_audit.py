@@ -0,0 +1,127 @@
+import os
+import re
+from contextlib import contextmanager
+from flask import current_app, request
+
+from .metrics import request_stats
+
+
+# 'off', 'warn' to log the problems of a request, 'raise' to fail it
+# (meant for development and CI)
+QUERY_AUDIT = os.getenv('QUERY_AUDIT', 'off').lower()
+
+# budgets of the endpoints missing from QUERY_BUDGETS
+DEFAULT_QUERY_BUDGET = int(os.getenv('DEFAULT_QUERY_BUDGET', 5))
+DEFAULT_ROW_BUDGET = int(os.getenv('DEFAULT_ROW_BUDGET', 50))
+
+# endpoint: (SQL statements, rows fetched) allowed per request; the loads of
+# the in-memory indexes and caches are run inside index_load() and not
+# counted
+QUERY_BUDGETS = {
+    'get_all_categories': (0, 0),
+    'get_questions': (1, 11),
+    'delete_question': (1, 1),
+    # a batch of DELETE_BATCH_SIZE per statement, a row per question
+    'bulk_delete_questions': (20, 20000),
+    'create_question': (2, 11),
+    'search': (2, 11),
+    'autocomplete_search': (0, 0),
+    'get_questions_by_category': (1, 11),
+    'play_quiz_game': (1, 20),
+    'start_quiz_session': (0, 0),
+    'next_quiz_session_question': (1, 1),
+    'start_adaptive_quiz': (1, 1),
+    'answer_adaptive_quiz': (1, 1),
+    'verify_quiz_answers': (1, 20),
+    'record_scores': (2, 40),
+    'get_leaderboard': (0, 0),
+    'get_player_score': (0, 0),
+}
+
+UNBOUNDED_SELECT = re.compile(r'^\s*SELECT\b.*\bFROM questions\b', re.I | re.S)
+BOUNDED_SELECT = re.compile(
+    r'\bLIMIT\b|\bcount\(|\bquestions\.id\s*(=|IN\b)', re.I)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+@contextmanager
+def index_load():
+    """
+    Exempt the statements run inside from the budgets and the unbounded
+    SELECT check: the loads of the in-memory indexes and caches read
+    whole tables, once per max_age rather than once per request.
+    """
+    stats = request_stats()
+    if stats is not None:
+        stats.index_loads += 1
+    try:
+        yield
+    finally:
+        if stats is not None:
+            stats.index_loads -= 1
+
+
+def cost(stats):
+    """(statements, rows fetched) of a request, index loads excluded."""
+    statements = len([s for s in stats.statements if not s[2]])
+    return statements, stats.rows - stats.index_load_rows
+
+
+"""
+audit(stats, budget)
+    the problems of one request: statements run more than once with the
+    same parameters, SELECTs of the questions table without a LIMIT or
+    primary key, and a (statements, rows) budget exceeded.
+"""
+def audit(stats, budget):
+    problems = []
+    seen = set()
+    for statement, parameters, exempt in stats.statements:
+        if (statement, parameters) in seen:
+            problems.append('duplicate statement: {}'.format(
+                ' '.join(statement.split())))
+        seen.add((statement, parameters))
+        if not exempt and UNBOUNDED_SELECT.search(statement) and \
+                not BOUNDED_SELECT.search(statement):
+            problems.append('unbounded SELECT: {}'.format(
+                ' '.join(statement.split())))
+
+    statements, rows = cost(stats)
+    max_statements, max_rows = budget
+    if statements > max_statements:
+        problems.append('{} statements, budget {}'.format(
+            statements, max_statements))
+    if rows > max_rows:
+        problems.append('{} rows, budget {}'.format(rows, max_rows))
+    return problems
+
+
+def audit_request(response):
+    mode = current_app.config.get('QUERY_AUDIT', 'off')
+    stats = request_stats()
+    if mode == 'off' or stats is None or stats.statements is None:
+        return response
+
+    statements, rows = cost(stats)
+    response.headers['X-Query-Count'] = str(statements)
+    response.headers['X-Row-Count'] = str(rows)
+
+    budgets = current_app.config.get('QUERY_BUDGETS', QUERY_BUDGETS)
+    budget = budgets.get(
+        request.endpoint, (DEFAULT_QUERY_BUDGET, DEFAULT_ROW_BUDGET))
+    problems = audit(stats, budget)
+    if problems:
+        message = '{} {}: {}'.format(
+            request.method, request.path, '; '.join(problems))
+        if mode == 'raise':
+            raise QueryBudgetExceeded(message)
+        current_app.logger.warning(message)
+    return response
+
+
+def init_query_audit(app):
+    app.config.setdefault('QUERY_AUDIT', QUERY_AUDIT)
+    app.config.setdefault('QUERY_BUDGETS', dict(QUERY_BUDGETS))
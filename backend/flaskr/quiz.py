@@ -0,0 +1,206 @@
+import os
+import random
+import threading
+import time
+from flask import current_app, has_app_context
+
+from models import db, Question, question_listener
+from .query_audit import index_load
+
+
+# category id the frontend sends for "ALL"
+ALL_CATEGORIES = 0
+
+# how many random picks are tried before falling back to a filtered draw
+MAX_DRAW_ATTEMPTS = 16
+
+# seconds after which the index is rebuilt, so that questions written by
+# other worker processes are eventually picked up
+QUIZ_INDEX_MAX_AGE = int(os.getenv('QUIZ_INDEX_MAX_AGE', 300))
+
+
+def category_key(category):
+    """Normalize a category id ('3', 3) to the key used by the index."""
+    try:
+        return int(category)
+    except (TypeError, ValueError):
+        return category
+
+
+def bucket_key(category, difficulty=None):
+    """The index key of a category, or of a (category, difficulty) bucket."""
+    if difficulty is None:
+        return category_key(category)
+    return (category_key(category), category_key(difficulty))
+
+
+"""
+QuizIndex
+    the ids of all questions grouped by category, kept in memory so that
+    play_quiz_game can draw a random unseen question without a
+    NOT IN (previous_questions) query.
+
+    each category, and each (category, difficulty) pair of the adaptive
+    quiz, holds a list of ids plus an {id: position} map, so adding and
+    removing a question are O(1) (removal swaps the last id into the freed
+    slot) and a uniform random pick is a single index.
+"""
+class QuizIndex:
+
+    def __init__(self, max_age=QUIZ_INDEX_MAX_AGE):
+        self.max_age = max_age
+        self.loaded_at = None
+        self._lock = threading.RLock()
+        self._ids = {}
+        self._positions = {}
+
+    def load(self):
+        with index_load():
+            rows = db.session.query(
+                Question.id, Question.category, Question.difficulty).all()
+        self.load_rows(rows)
+
+    def load_rows(self, rows):
+        """
+        Rebuild the index from (id, category, difficulty) rows.  The new
+        index is built outside the lock and swapped in, so draws keep
+        being served from the current one meanwhile.
+        """
+        built = QuizIndex(self.max_age)
+        built._ids = {ALL_CATEGORIES: []}
+        built._positions = {ALL_CATEGORIES: {}}
+        for question_id, category, difficulty in rows:
+            built._add(question_id, category, difficulty)
+        with self._lock:
+            self._ids, self._positions = built._ids, built._positions
+            self.loaded_at = time.monotonic()
+
+    def ensure_loaded(self):
+        if self.loaded_at is None or \
+                time.monotonic() - self.loaded_at > self.max_age:
+            self.load()
+
+    def reset(self):
+        with self._lock:
+            self.loaded_at = None
+
+    @staticmethod
+    def _keys(category, difficulty):
+        category = category_key(category)
+        keys = [ALL_CATEGORIES, category]
+        if difficulty is not None:
+            keys += [bucket_key(ALL_CATEGORIES, difficulty),
+                     bucket_key(category, difficulty)]
+        return keys
+
+    def _add(self, question_id, category, difficulty=None):
+        for key in self._keys(category, difficulty):
+            positions = self._positions.setdefault(key, {})
+            if question_id in positions:
+                continue
+            ids = self._ids.setdefault(key, [])
+            positions[question_id] = len(ids)
+            ids.append(question_id)
+
+    def _remove(self, question_id, category, difficulty=None):
+        for key in self._keys(category, difficulty):
+            positions = self._positions.get(key, {})
+            position = positions.pop(question_id, None)
+            if position is None:
+                continue
+            ids = self._ids[key]
+            last = ids.pop()
+            if last != question_id:
+                ids[position] = last
+                positions[last] = position
+
+    def add(self, question_id, category, difficulty=None):
+        with self._lock:
+            if self.loaded_at is not None:
+                self._add(question_id, category, difficulty)
+
+    def remove(self, question_id, category, difficulty=None):
+        with self._lock:
+            if self.loaded_at is not None:
+                self._remove(question_id, category, difficulty)
+
+    def ids(self, category=ALL_CATEGORIES, difficulty=None):
+        """Return a copy of the question ids of a category."""
+        self.ensure_loaded()
+        with self._lock:
+            return list(self._ids.get(bucket_key(category, difficulty), ()))
+
+    def count(self, category=ALL_CATEGORIES, difficulty=None):
+        self.ensure_loaded()
+        with self._lock:
+            return len(self._ids.get(bucket_key(category, difficulty), ()))
+
+    def sample(self, category=ALL_CATEGORIES, count=1, difficulty=None):
+        """
+        Return up to count distinct question ids of the category in random
+        order; O(count) for a category larger than count, which is not
+        copied.
+        """
+        self.ensure_loaded()
+        with self._lock:
+            ids = self._ids.get(bucket_key(category, difficulty), ())
+            return random.sample(ids, min(count, len(ids)))
+
+    def draw(self, category=ALL_CATEGORIES, seen=(), difficulty=None):
+        """
+        Return a uniformly random question id of the category (of that
+        difficulty, when given) that is not in seen (a set), or None when
+        every such question has been seen.
+
+        while fewer than half of the category has been seen the expected
+        number of picks is below two whatever the size of seen; past
+        MAX_DRAW_ATTEMPTS misses the remaining ids are filtered instead.
+        """
+        self.ensure_loaded()
+        with self._lock:
+            ids = self._ids.get(bucket_key(category, difficulty), ())
+            if not ids:
+                return None
+            for _ in range(MAX_DRAW_ATTEMPTS):
+                question_id = ids[random.randrange(len(ids))]
+                if question_id not in seen:
+                    return question_id
+            unseen = [question_id for question_id in ids
+                      if question_id not in seen]
+        return random.choice(unseen) if unseen else None
+
+    def draw_many(self, category=ALL_CATEGORIES, seen=(), count=1,
+                  difficulty=None):
+        """Return up to count distinct random unseen question ids."""
+        seen = set(seen)
+        drawn = []
+        while len(drawn) < count:
+            question_id = self.draw(category, seen, difficulty)
+            if question_id is None:
+                break
+            drawn.append(question_id)
+            seen.add(question_id)
+        return drawn
+
+
+def quiz_index():
+    return current_app.extensions['quiz_index']
+
+
+def init_quiz(app):
+    app.extensions['quiz_index'] = QuizIndex()
+
+
+@question_listener
+def sync_quiz_index(event, question):
+    if not has_app_context():
+        return
+    index = current_app.extensions.get('quiz_index')
+    if index is None:
+        return
+    if event == 'insert':
+        index.add(question['id'], question['category'], question['difficulty'])
+    elif event in ('delete', 'purge'):
+        index.remove(question['id'], question['category'], question['difficulty'])
+    else:
+        index.reset()
@@ -0,0 +1,150 @@
+import os
+import secrets
+import struct
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from flask import current_app
+
+from .kvstore import connect_store
+
+
+# 'memory' keeps sessions in this process, 'local' or 'redis://...' keeps
+# them in a key-value store (see kvstore.connect_store)
+QUIZ_SESSION_STORE = os.getenv('QUIZ_SESSION_STORE', 'memory')
+
+# seconds a quiz session lives after its last request
+QUIZ_SESSION_TTL = int(os.getenv('QUIZ_SESSION_TTL', 3600))
+
+# upper bound on the sessions kept by the in-process store
+QUIZ_SESSION_MAX = int(os.getenv('QUIZ_SESSION_MAX', 100000))
+
+# questions a session serves at most: its order is a random sample of the
+# category this long, so starting and keeping a session cost the same
+# whatever the size of the category
+QUIZ_SESSION_QUESTIONS = int(os.getenv('QUIZ_SESSION_QUESTIONS', 100))
+
+ID_FORMAT = '<i'
+ID_SIZE = struct.calcsize(ID_FORMAT)
+
+
+def new_token():
+    return secrets.token_urlsafe(16)
+
+
+"""
+MemoryQuizSessionStore
+    quiz sessions held in this process.  A session is the random order of
+    up to QUIZ_SESSION_QUESTIONS question ids of its category, as an array
+    of ints, plus a cursor:
+    everything before the cursor has been seen, so no seen-set has to be
+    stored or searched.  Sessions are kept in last-used order, expired ones
+    are evicted from the front on every call.
+"""
+class MemoryQuizSessionStore:
+
+    def __init__(self, ttl=QUIZ_SESSION_TTL, max_sessions=QUIZ_SESSION_MAX):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+
+    def _evict(self, now):
+        while self._sessions:
+            token, session = next(iter(self._sessions.items()))
+            if session[2] > now and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+
+    def create(self, question_ids):
+        token = new_token()
+        now = time.monotonic()
+        with self._lock:
+            # [order, cursor, expires at]
+            self._sessions[token] = [array('i', question_ids), 0,
+                                     now + self.ttl]
+            self._evict(now)
+        return token
+
+    def next_id(self, token):
+        """Return the next question id, None once the order is exhausted.
+        Raises KeyError for unknown or expired tokens."""
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now)
+            session = self._sessions[token]
+            self._sessions.move_to_end(token)
+            session[2] = now + self.ttl
+            order, cursor = session[0], session[1]
+            if cursor >= len(order):
+                return None
+            session[1] = cursor + 1
+            return order[cursor]
+
+    def delete(self, token):
+        with self._lock:
+            self._sessions.pop(token, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+"""
+KeyValueQuizSessionStore
+    quiz sessions kept in a Redis-compatible store so that every worker
+    sees them.  The order is packed as 4-byte ints under quiz:<token>:order
+    and the cursor is a counter under quiz:<token>:cursor: serving a
+    question is one INCR and one 4-byte GETRANGE whatever the game length.
+"""
+class KeyValueQuizSessionStore:
+
+    def __init__(self, client, ttl=QUIZ_SESSION_TTL):
+        self.client = client
+        self.ttl = ttl
+
+    @staticmethod
+    def _keys(token):
+        return 'quiz:{}:order'.format(token), 'quiz:{}:cursor'.format(token)
+
+    def create(self, question_ids):
+        token = new_token()
+        order_key, cursor_key = self._keys(token)
+        order = struct.pack('<{}i'.format(len(question_ids)), *question_ids)
+        # an empty value would read like a missing session
+        self.client.set(order_key, order or b'\0', ex=self.ttl)
+        self.client.set(cursor_key, 0, ex=self.ttl)
+        return token
+
+    def next_id(self, token):
+        order_key, cursor_key = self._keys(token)
+        cursor = self.client.incr(cursor_key) - 1
+        start = cursor * ID_SIZE
+        data = self.client.getrange(order_key, start, start + ID_SIZE - 1)
+        if len(data) == ID_SIZE:
+            self.client.expire(order_key, self.ttl)
+            self.client.expire(cursor_key, self.ttl)
+            return struct.unpack(ID_FORMAT, data)[0]
+        if self.client.get(order_key) is None:
+            # the INCR above created the counter of an unknown session
+            self.client.delete(cursor_key)
+            raise KeyError(token)
+        return None
+
+    def delete(self, token):
+        self.client.delete(*self._keys(token))
+
+
+def create_session_store(url=QUIZ_SESSION_STORE):
+    if url == 'memory':
+        return MemoryQuizSessionStore()
+    return KeyValueQuizSessionStore(connect_store(url))
+
+
+def quiz_sessions():
+    return current_app.extensions['quiz_sessions']
+
+
+def init_quiz_sessions(app, store=None):
+    app.config.setdefault('QUIZ_SESSION_QUESTIONS', QUIZ_SESSION_QUESTIONS)
+    app.extensions['quiz_sessions'] = store or create_session_store()
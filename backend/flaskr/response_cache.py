@@ -0,0 +1,228 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+from flask import Response, current_app, has_app_context, request
+
+from models import category_listener, question_listener
+from .kvstore import connect_store
+from .serialization import response_mimetype
+
+
+# 'memory' caches responses in this process, 'local' or 'redis://...' in a
+# key-value store shared by the workers (see kvstore.connect_store), 'off'
+# disables the cache
+RESPONSE_CACHE = os.getenv('RESPONSE_CACHE', 'memory')
+
+# seconds a cached response is served, which bounds how long writes made
+# by other worker processes go unnoticed by the in-process cache
+RESPONSE_CACHE_MAX_AGE = int(os.getenv('RESPONSE_CACHE_MAX_AGE', 30))
+
+# bytes of response bodies kept by the in-process cache before the least
+# recently used ones are evicted
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+
+# Cache-Control of the cached routes: browsers and CDNs keep the response
+# and revalidate it with its ETag
+RESPONSE_CACHE_CONTROL = os.getenv('RESPONSE_CACHE_CONTROL', 'public, no-cache')
+
+GENERATION_KEY = 'responses:generation'
+
+
+CachedResponse = namedtuple('CachedResponse', 'body mimetype etag')
+
+
+def cache_entry(response):
+    body = response.get_data()
+    return CachedResponse(
+        body, response.mimetype, hashlib.sha1(body).hexdigest()[:20])
+
+
+"""
+MemoryResponseCache
+    response bodies of this process in an LRU ordered dict capped at
+    max_bytes.  Keys embed the generation, which every write bumps, so the
+    entries of older generations are never read again and age out of the
+    LRU instead of being searched for and deleted.
+"""
+class MemoryResponseCache:
+
+    name = 'memory'
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES,
+                 max_age=RESPONSE_CACHE_MAX_AGE):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def generation(self):
+        return self._generation
+
+    def bump(self):
+        with self._lock:
+            self._generation += 1
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None or item[0] <= now:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, entry):
+        if len(entry.body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous[1].body)
+            self._entries[key] = (time.monotonic() + self.max_age, entry)
+            self._bytes += len(entry.body)
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.body)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': self.name,
+                'generation': self._generation,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes
+            }
+
+
+"""
+KeyValueResponseCache
+    response bodies in a key-value store shared by all the workers, with
+    the generation kept under responses:generation so that a write made
+    by any worker invalidates the responses cached by every other one.
+    Entries expire after max_age; size the store's memory and eviction
+    policy (maxmemory, allkeys-lru on Redis) to cap it.
+"""
+class KeyValueResponseCache:
+
+    name = 'kv'
+
+    def __init__(self, store, max_age=RESPONSE_CACHE_MAX_AGE):
+        self.store = store
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+    def generation(self):
+        return int(self.store.get(GENERATION_KEY) or 0)
+
+    def bump(self):
+        self.store.incr(GENERATION_KEY)
+
+    def get(self, key):
+        value = self.store.get('responses:' + key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        mimetype, etag, body = value.split(b'\n', 2)
+        return CachedResponse(body, mimetype.decode(), etag.decode())
+
+    def set(self, key, entry):
+        value = b'\n'.join(
+            (entry.mimetype.encode(), entry.etag.encode(), entry.body))
+        self.store.set('responses:' + key, value, ex=self.max_age)
+
+    def stats(self):
+        return {
+            'backend': self.name,
+            'generation': self.generation(),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+def create_response_cache(url=RESPONSE_CACHE):
+    if url == 'off':
+        return None
+    if url == 'memory':
+        return MemoryResponseCache()
+    return KeyValueResponseCache(connect_store(url))
+
+
+def response_cache():
+    return current_app.extensions.get('response_cache')
+
+
+def init_response_cache(app, cache=None):
+    app.extensions['response_cache'] = cache or create_response_cache()
+
+
+def cache_key(generation):
+    """Path, query args and negotiated format, under a generation."""
+    args = '&'.join('{}={}'.format(name, value) for name, value in
+                    sorted(request.args.items(multi=True)))
+    return '{}:{}:{}?{}'.format(
+        generation, response_mimetype(), request.path, args)
+
+
+def cacheable(response):
+    response.headers['Cache-Control'] = RESPONSE_CACHE_CONTROL
+    response.vary.add('Accept')
+    return response.make_conditional(request)
+
+
+"""
+cached_response
+    view decorator serving the GET responses of a route from the response
+    cache until the next write.  Only 200 responses are stored; misses,
+    hits and their ETag revalidations are told apart by X-Cache.
+"""
+def cached_response(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        cache = response_cache()
+        if cache is None:
+            return view(*args, **kwargs)
+
+        key = cache_key(cache.generation())
+        entry = cache.get(key)
+        if entry is not None:
+            response = Response(entry.body, mimetype=entry.mimetype)
+            response.headers['X-Cache'] = 'HIT'
+        else:
+            response = current_app.make_response(view(*args, **kwargs))
+            response.headers['X-Cache'] = 'MISS'
+            if response.status_code != 200:
+                return response
+            entry = cache_entry(response)
+            cache.set(key, entry)
+        response.set_etag(entry.etag)
+        return cacheable(response)
+    return wrapper
+
+
+def bump_generation(event, row):
+    if not has_app_context():
+        return
+    cache = current_app.extensions.get('response_cache')
+    if cache is not None:
+        cache.bump()
+
+
+question_listener(bump_generation)
+category_listener(bump_generation)
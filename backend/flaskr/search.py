@@ -0,0 +1,238 @@
+import os
+import threading
+import time
+import click
+from flask import current_app, has_app_context
+from sqlalchemy import func, text
+
+from models import db, Question, question_listener
+from .query_audit import index_load
+from .serialization import question_rows, format_rows, load_questions
+
+
+# 'sql' searches in the database (trigram indexed on PostgreSQL),
+# 'memory' keeps an inverted trigram index of the questions in memory
+SEARCH_ENGINE = os.getenv('SEARCH_ENGINE', 'sql')
+
+# seconds after which the in-memory index is rebuilt, so that questions
+# written by other worker processes are eventually picked up
+SEARCH_INDEX_MAX_AGE = int(os.getenv('SEARCH_INDEX_MAX_AGE', 300))
+
+TRIGRAM_INDEX_DDL = (
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS ix_questions_question_trgm '
+    'ON questions USING gin (question gin_trgm_ops)',
+)
+
+
+def like_pattern(term):
+    """The LIKE pattern matching term as a literal substring."""
+    for char in ('\\', '%', '_'):
+        term = term.replace(char, '\\' + char)
+    return '%{}%'.format(term)
+
+
+def trigrams(value):
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+"""
+SqlSearchEngine
+    case-insensitive substring search run by the database, with the
+    pagination and the total number of hits computed in SQL.  The % and _
+    of the term are escaped, so that they match themselves as they do in
+    MemorySearchEngine.
+
+    on PostgreSQL `flask search-index` installs pg_trgm and a GIN trigram
+    index on questions.question, which ILIKE '%term%' uses instead of a
+    sequential scan; results are then ranked by trigram similarity.
+    Other databases get the same results ordered by id.
+"""
+class SqlSearchEngine:
+
+    name = 'sql'
+
+    def __init__(self):
+        self._ranked = None
+
+    def install(self):
+        if db.engine.dialect.name != 'postgresql':
+            return False
+        for statement in TRIGRAM_INDEX_DDL:
+            db.session.execute(text(statement))
+        db.session.commit()
+        self._ranked = None
+        return True
+
+    def ranked(self):
+        if self._ranked is None:
+            self._ranked = db.engine.dialect.name == 'postgresql' and \
+                db.session.execute(text(
+                    "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+                )).first() is not None
+        return self._ranked
+
+    def search(self, term, offset, limit):
+        selection = Question.query.filter(
+            Question.question.ilike(like_pattern(term), escape='\\'))
+        total = selection.with_entities(
+            func.count(Question.id)).order_by(None).scalar()
+        if self.ranked():
+            selection = selection.order_by(
+                func.similarity(Question.question, term).desc(), Question.id)
+        else:
+            selection = selection.order_by(Question.id)
+        rows = question_rows(selection).offset(offset).limit(limit).all()
+        return format_rows(rows), total
+
+
+"""
+MemorySearchEngine
+    an inverted index from every trigram of the lower-cased question text
+    to the ids of the questions containing it.  A term of three characters
+    or more only has to be checked against the questions holding all of
+    its trigrams (smallest posting set first), which keeps the substring
+    semantics of ILIKE without scanning every question.
+
+    hits are ranked matches at the start of a word first, then by how
+    early the term appears; only the requested page is loaded from the
+    database.  Kept in sync through question_listener.
+"""
+class MemorySearchEngine:
+
+    name = 'memory'
+
+    def __init__(self, max_age=SEARCH_INDEX_MAX_AGE):
+        self.max_age = max_age
+        self.loaded_at = None
+        self._lock = threading.RLock()
+        self._texts = {}
+        self._postings = {}
+
+    def install(self):
+        self.load()
+        return True
+
+    def load(self):
+        with index_load():
+            rows = db.session.query(Question.id, Question.question).all()
+        self.load_rows(rows)
+
+    def load_rows(self, rows):
+        """Rebuild the index from (id, question) rows, swapped in at once."""
+        built = MemorySearchEngine(self.max_age)
+        for question_id, question in rows:
+            built._add(question_id, question)
+        with self._lock:
+            self._texts, self._postings = built._texts, built._postings
+            self.loaded_at = time.monotonic()
+
+    def ensure_loaded(self):
+        if self.loaded_at is None or \
+                time.monotonic() - self.loaded_at > self.max_age:
+            self.load()
+
+    def reset(self):
+        with self._lock:
+            self.loaded_at = None
+
+    def _add(self, question_id, question):
+        value = (question or '').lower()
+        self._texts[question_id] = value
+        for trigram in trigrams(value):
+            self._postings.setdefault(trigram, set()).add(question_id)
+
+    def _remove(self, question_id):
+        value = self._texts.pop(question_id, None)
+        if value is None:
+            return
+        for trigram in trigrams(value):
+            postings = self._postings.get(trigram)
+            if postings is not None:
+                postings.discard(question_id)
+                if not postings:
+                    del self._postings[trigram]
+
+    def add(self, question_id, question):
+        with self._lock:
+            if self.loaded_at is not None:
+                self._remove(question_id)
+                self._add(question_id, question)
+
+    def remove(self, question_id):
+        with self._lock:
+            if self.loaded_at is not None:
+                self._remove(question_id)
+
+    def match(self, term):
+        """Return the ranked ids of the questions containing term."""
+        self.ensure_loaded()
+        term = term.lower()
+        with self._lock:
+            if len(term) < 3:
+                candidates = self._texts.keys()
+            else:
+                postings = sorted(
+                    (self._postings.get(trigram, ()) for trigram in
+                     trigrams(term)), key=len)
+                candidates = set(postings[0]).intersection(*postings[1:])
+            hits = []
+            for question_id in candidates:
+                value = self._texts[question_id]
+                position = value.find(term)
+                if position < 0:
+                    continue
+                word_start = position == 0 or not value[position - 1].isalnum()
+                hits.append((not word_start, position, question_id))
+        hits.sort()
+        return [question_id for _, _, question_id in hits]
+
+    def search(self, term, offset, limit):
+        ids = self.match(term)
+        return load_questions(ids[offset:offset + limit]), len(ids)
+
+
+SEARCH_ENGINES = {
+    'sql': SqlSearchEngine,
+    'memory': MemorySearchEngine,
+}
+
+
+def create_search_engine(name=SEARCH_ENGINE):
+    try:
+        return SEARCH_ENGINES[name]()
+    except KeyError:
+        raise ValueError('unknown search engine {}'.format(name))
+
+
+def search_engine():
+    return current_app.extensions['search_engine']
+
+
+def init_search(app, engine=None):
+    app.extensions['search_engine'] = engine or create_search_engine()
+
+    @app.cli.command('search-index')
+    def build_search_index():
+        """Install the index used by the configured search engine."""
+        engine = search_engine()
+        if engine.install():
+            click.echo('search index ready ({})'.format(engine.name))
+        else:
+            click.echo('no index to install for {} on {}'.format(
+                engine.name, db.engine.dialect.name))
+
+
+@question_listener
+def sync_search_index(event, question):
+    if not has_app_context():
+        return
+    engine = current_app.extensions.get('search_engine')
+    if not isinstance(engine, MemorySearchEngine):
+        return
+    if event == 'insert':
+        engine.add(question['id'], question['question'])
+    elif event in ('delete', 'purge'):
+        engine.remove(question['id'])
+    else:
+        engine.reset()
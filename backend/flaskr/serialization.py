@@ -0,0 +1,84 @@
+import json
+from flask import Response, request
+
+from models import Question
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, json is used without it
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional, only needed for msgpack output
+    msgpack = None
+
+
+# the keys of a formatted question, in the order of Question.format()
+QUESTION_COLUMNS = ('id', 'question', 'answer', 'category', 'difficulty')
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
+
+def question_columns():
+    return [getattr(Question, column) for column in QUESTION_COLUMNS]
+
+
+def question_rows(selection):
+    """
+    Turn a Question query into a query of plain (id, question, answer,
+    category, difficulty) rows, which skips building ORM instances and
+    registering them in the session's identity map.
+    """
+    return selection.with_entities(*question_columns())
+
+
+def format_rows(rows):
+    """The Question.format() dicts of rows read through question_rows()."""
+    return [dict(zip(QUESTION_COLUMNS, row)) for row in rows]
+
+
+def load_questions(ids, selection=None):
+    """Return the formatted questions of ids, in the order of ids, looked
+    up in selection (e.g. a category partition) or the whole table."""
+    if not ids:
+        return []
+    if selection is None:
+        selection = Question.query
+    questions = {question['id']: question for question in format_rows(
+        question_rows(selection.filter(Question.id.in_(ids))).all())}
+    return [questions[question_id] for question_id in ids
+            if question_id in questions]
+
+
+def dumps(payload):
+    """Encode payload as compact JSON bytes, with orjson when installed."""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, separators=(',', ':')).encode()
+
+
+def response_mimetype():
+    """The best of JSON and MessagePack for the Accept header, JSON first."""
+    offered = (JSON_MIMETYPE,)
+    if msgpack is not None:
+        offered += MSGPACK_MIMETYPES
+    return request.accept_mimetypes.best_match(offered) or JSON_MIMETYPE
+
+
+"""
+api_response(payload, status=200)
+    the replacement of jsonify for the question listings: the payload is
+    encoded once, by orjson when available, or as MessagePack when the
+    client asks for application/msgpack and msgpack is installed.
+"""
+def api_response(payload, status=200):
+    mimetype = response_mimetype()
+    if mimetype in MSGPACK_MIMETYPES:
+        body = msgpack.packb(payload, use_bin_type=True)
+    else:
+        body = dumps(payload)
+    response = Response(body, status=status, mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
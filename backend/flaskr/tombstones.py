@@ -0,0 +1,262 @@
+import click
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context
+from sqlalchemy import DateTime, Integer, bindparam, text
+
+from models import db, notify_question_listeners, question_listener
+
+
+# questions deleted per transaction by the bulk deletes
+DELETE_BATCH_SIZE = int(os.getenv('DELETE_BATCH_SIZE', 1000))
+
+# seconds a deleted question is kept before its row is purged
+QUESTION_PURGE_AFTER = int(os.getenv('QUESTION_PURGE_AFTER', 3600))
+
+# seconds between two purges of each worker, 0 to purge only with
+# `flask purge-questions`
+QUESTION_PURGE_INTERVAL = float(os.getenv('QUESTION_PURGE_INTERVAL', 60))
+
+# rows deleted per purge transaction
+QUESTION_PURGE_BATCH = int(os.getenv('QUESTION_PURGE_BATCH', 1000))
+
+# seconds of tombstones read again by each purge, so that the deletes of a
+# worker whose clock is behind are not missed
+TOMBSTONE_SYNC_OVERLAP = 60
+
+# RETURNING needs PostgreSQL, or SQLite 3.35
+TOMBSTONE_IDS = text(
+    'UPDATE questions SET deleted_at = :now '
+    'WHERE id IN :ids AND deleted_at IS NULL '
+    'RETURNING id, category, difficulty').bindparams(
+        bindparam('now', type_=DateTime), bindparam('ids', expanding=True))
+
+# keyset batches over the (category, id) index
+TOMBSTONE_CATEGORY = text(
+    'UPDATE questions SET deleted_at = :now WHERE id IN ('
+    'SELECT id FROM questions WHERE category = :category AND id > :after '
+    'AND deleted_at IS NULL ORDER BY id LIMIT :limit) '
+    'RETURNING id, category, difficulty').bindparams(
+        bindparam('now', type_=DateTime))
+
+# keyset batches over the partial index on deleted_at
+TOMBSTONES_SINCE = text(
+    'SELECT id, category, difficulty, deleted_at FROM questions '
+    'WHERE deleted_at >= :since AND (deleted_at > :since OR id > :after) '
+    'ORDER BY deleted_at, id LIMIT :limit').bindparams(
+        bindparam('since', type_=DateTime)).columns(
+            id=Integer, category=Integer, difficulty=Integer,
+            deleted_at=DateTime)
+
+PURGE = text(
+    'DELETE FROM questions WHERE id IN ('
+    'SELECT id FROM questions WHERE deleted_at IS NOT NULL '
+    'AND deleted_at < :before ORDER BY deleted_at LIMIT :limit)').bindparams(
+        bindparam('before', type_=DateTime))
+
+logger = logging.getLogger(__name__)
+
+
+def tombstone(statement, params):
+    """Run a tombstoning UPDATE and report the questions it deleted."""
+    questions = [dict(row) for row in
+                 db.session.execute(statement, params).fetchall()]
+    db.session.commit()
+    for question in questions:
+        notify_question_listeners('delete', question)
+    return questions
+
+
+"""
+delete_questions(ids=None, category=None, batch_size=DELETE_BATCH_SIZE)
+    soft-deletes the questions of ids, or of a category: deleted_at is set
+    by one UPDATE per batch_size questions, each batch in its own short
+    transaction, so a mass cleanup never holds many row locks at once.
+    The in-memory indexes and caches drop the questions through
+    question_listener right away; their rows are removed later by the
+    purge.  Returns the (id, category, difficulty) dicts of the questions
+    deleted, ids already deleted or unknown being skipped.
+"""
+def delete_questions(ids=None, category=None, batch_size=DELETE_BATCH_SIZE):
+    now = datetime.utcnow()
+    deleted = []
+    if ids is not None:
+        ids = sorted(set(ids))
+        for start in range(0, len(ids), batch_size):
+            deleted.extend(tombstone(TOMBSTONE_IDS, {
+                'now': now, 'ids': ids[start:start + batch_size]}))
+        return deleted
+
+    after = 0
+    while True:
+        batch = tombstone(TOMBSTONE_CATEGORY, {
+            'now': now, 'category': category, 'after': after,
+            'limit': batch_size})
+        deleted.extend(batch)
+        if len(batch) < batch_size:
+            return deleted
+        after = max(question['id'] for question in batch)
+
+
+"""
+QuestionPurger
+    removes the rows of the questions deleted more than purge_after
+    seconds ago, batch_size rows per transaction, every interval seconds
+    from a daemon thread of each worker (started by its first request).
+    The tombstones are found through the partial index on deleted_at.
+
+    each run first reads the tombstones written since the last one and
+    reports those another worker deleted to question_listener as 'purge'
+    events, so that the indexes and caches of this worker drop them too;
+    the questions it deleted itself were dropped at once.
+"""
+class QuestionPurger:
+
+    def __init__(self, interval=QUESTION_PURGE_INTERVAL,
+                 purge_after=QUESTION_PURGE_AFTER,
+                 batch_size=QUESTION_PURGE_BATCH):
+        self.interval = interval
+        self.purge_after = purge_after
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._thread = None
+        self.runs = 0
+        self.purged = 0
+        self.dropped = 0
+        self.last_purge_ms = None
+        # the tombstones dropped from the indexes: {id: deleted_at}, and
+        # the latest deleted_at read
+        self._dropped = {}
+        self._synced = None
+
+    def deleted(self, question_id):
+        """Record a question this worker deleted and dropped already."""
+        with self._lock:
+            self._dropped[question_id] = datetime.utcnow()
+
+    def drop_tombstones(self):
+        """Report the questions other workers deleted since the last call
+        as 'purge' events; returns how many there were."""
+        with self._lock:
+            synced = self._synced
+        since = datetime.min if synced is None else \
+            synced - timedelta(seconds=TOMBSTONE_SYNC_OVERLAP)
+        rows = []
+        batch_since, after = since, 0
+        while True:
+            batch = db.session.execute(TOMBSTONES_SINCE, {
+                'since': batch_since, 'after': after,
+                'limit': self.batch_size}).fetchall()
+            rows.extend(batch)
+            if len(batch) < self.batch_size:
+                break
+            batch_since, after = batch[-1].deleted_at, batch[-1].id
+        db.session.commit()
+
+        questions = []
+        with self._lock:
+            for row in rows:
+                if row.id not in self._dropped:
+                    questions.append({'id': row.id, 'category': row.category,
+                                      'difficulty': row.difficulty})
+                self._dropped[row.id] = row.deleted_at
+            if rows:
+                self._synced = max(synced or rows[-1].deleted_at,
+                                   rows[-1].deleted_at)
+            # what the next run cannot read again
+            for question_id, deleted_at in list(self._dropped.items()):
+                if deleted_at < since:
+                    del self._dropped[question_id]
+            self.dropped += len(questions)
+        for question in questions:
+            notify_question_listeners('purge', question)
+        return len(questions)
+
+    def purge(self, purge_after=None):
+        """Drop the new tombstones from the indexes and purge the old
+        ones; returns the rows removed."""
+        if purge_after is None:
+            purge_after = self.purge_after
+        before = datetime.utcnow() - timedelta(seconds=purge_after)
+        start = time.perf_counter()
+        self.drop_tombstones()
+        purged = 0
+        while True:
+            count = db.session.execute(PURGE, {
+                'before': before, 'limit': self.batch_size}).rowcount
+            db.session.commit()
+            purged += count
+            if count < self.batch_size:
+                break
+        with self._lock:
+            self.runs += 1
+            self.purged += purged
+            self.last_purge_ms = round((time.perf_counter() - start) * 1000, 3)
+        return purged
+
+    def start(self, app):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, args=(app,), daemon=True)
+        self._thread.start()
+
+    def _run(self, app):
+        while True:
+            time.sleep(self.interval)
+            with app.app_context():
+                try:
+                    self.purge()
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('question purge failed')
+                finally:
+                    db.session.remove()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'runs': self.runs,
+                'purged': self.purged,
+                'dropped': self.dropped,
+                'last_purge_ms': self.last_purge_ms,
+                'purge_after': self.purge_after,
+                'running': self._thread is not None
+            }
+
+
+def question_purger():
+    return current_app.extensions['question_purger']
+
+
+def init_tombstones(app, purger=None):
+    app.config.setdefault('QUESTION_PURGE_INTERVAL', QUESTION_PURGE_INTERVAL)
+    app.extensions['question_purger'] = purger or QuestionPurger(
+        interval=app.config['QUESTION_PURGE_INTERVAL'])
+
+    @app.before_request
+    def start_question_purger():
+        app.extensions['question_purger'].start(app)
+
+    @app.cli.command('purge-questions')
+    @click.option('--after', type=int, default=None,
+                  help='seconds since the deletion, QUESTION_PURGE_AFTER by default')
+    def purge_questions_command(after):
+        """Remove the rows of the deleted questions."""
+        click.echo('purged {} questions'.format(
+            app.extensions['question_purger'].purge(after)))
+
+
+@question_listener
+def record_deleted_question(event, question):
+    if event != 'delete' or not has_app_context():
+        return
+    purger = current_app.extensions.get('question_purger')
+    if purger is not None:
+        purger.deleted(question['id'])
@@ -0,0 +1,155 @@
+import os
+import threading
+import time
+from flask import current_app
+from sqlalchemy import text
+
+from models import db, notify_question_listeners
+
+
+# group the question inserts of concurrent requests into one transaction
+QUESTION_WRITE_BEHIND = os.getenv(
+    'QUESTION_WRITE_BEHIND', 'false').lower() in ('1', 'true', 'yes')
+
+# milliseconds the first insert of a group waits for others to join it
+QUESTION_WRITE_WINDOW_MS = float(os.getenv('QUESTION_WRITE_WINDOW_MS', 2))
+
+# questions written by one INSERT at most
+QUESTION_WRITE_BATCH = int(os.getenv('QUESTION_WRITE_BATCH', 200))
+
+COLUMNS = ('question', 'answer', 'category', 'difficulty')
+
+
+def insert_statement(size):
+    """One INSERT of size rows returning their ids (RETURNING needs
+    PostgreSQL, or SQLite 3.35)."""
+    rows = ', '.join('({})'.format(', '.join(
+        ':{}_{}'.format(column, number) for column in COLUMNS))
+        for number in range(size))
+    return text('INSERT INTO questions ({}) VALUES {} RETURNING id'.format(
+        ', '.join(COLUMNS), rows))
+
+
+class PendingInsert:
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.question = None
+        self.error = None
+        self.done = threading.Event()
+
+
+"""
+QuestionWriter
+    coalesces the question inserts of concurrent requests: the first
+    request to arrive becomes the leader, waits window_ms for others to
+    queue their questions, then writes up to batch_size of them with one
+    multi-row INSERT and a single commit, and hands every request back
+    its row and id.  Once its own row is written the leader steps down
+    and a waiting request takes over the rest of the queue.  A batch that
+    fails is written again one row at a time, so that a bad row raises its
+    error in its own request only.
+
+    The ids of one VALUES list are allocated in the order of its rows, so
+    the returned ids are sorted and matched to the rows in that order.
+"""
+class QuestionWriter:
+
+    def __init__(self, window_ms=QUESTION_WRITE_WINDOW_MS,
+                 batch_size=QUESTION_WRITE_BATCH):
+        self.window = window_ms / 1000
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._pending = []
+        self._leading = False
+        self.batches = 0
+        self.written = 0
+        self.largest_batch = 0
+
+    def insert(self, question, answer, category, difficulty):
+        """Queue a question and return its row once committed."""
+        pending = PendingInsert({'question': question, 'answer': answer,
+                                 'category': category,
+                                 'difficulty': difficulty})
+        with self._lock:
+            self._pending.append(pending)
+        while not pending.done.is_set():
+            with self._lock:
+                lead = not self._leading
+                self._leading = True
+            if lead:
+                try:
+                    self._lead(pending)
+                finally:
+                    with self._lock:
+                        self._leading = False
+            else:
+                # take over when the leader is done with its own row
+                pending.done.wait(self.window or 0.001)
+        if pending.error is not None:
+            raise pending.error
+        return pending.question
+
+    def _lead(self, own):
+        if self.window > 0:
+            time.sleep(self.window)
+        while not own.done.is_set():
+            with self._lock:
+                batch = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+            self._write(batch)
+
+    def _write(self, batch):
+        params = {}
+        for number, pending in enumerate(batch):
+            for column in COLUMNS:
+                params['{}_{}'.format(column, number)] = pending.fields[column]
+        try:
+            ids = sorted(row[0] for row in db.session.execute(
+                insert_statement(len(batch)), params).fetchall())
+            db.session.commit()
+        except Exception as error:
+            db.session.rollback()
+            if len(batch) > 1:
+                # one bad row, e.g. of an unknown category, fails the whole
+                # INSERT: write the rows one by one so that only it fails
+                for pending in batch:
+                    self._write([pending])
+                return
+            batch[0].error = error
+            batch[0].done.set()
+            return
+
+        with self._lock:
+            self.batches += 1
+            self.written += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+        for question_id, pending in zip(ids, batch):
+            pending.question = dict(pending.fields, id=question_id)
+            try:
+                notify_question_listeners('insert', pending.question)
+            except Exception as error:
+                # committed, but failing like Question.insert() would
+                pending.error = error
+            pending.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'written': self.written,
+                'largest_batch': self.largest_batch,
+                'pending': len(self._pending)
+            }
+
+
+def question_writer():
+    """The QuestionWriter of the app, None unless QUESTION_WRITE_BEHIND."""
+    return current_app.extensions.get('question_writer')
+
+
+def init_write_behind(app, writer=None):
+    app.config.setdefault('QUESTION_WRITE_BEHIND', QUESTION_WRITE_BEHIND)
+    if writer is None and app.config['QUESTION_WRITE_BEHIND']:
+        writer = QuestionWriter()
+    app.extensions['question_writer'] = writer
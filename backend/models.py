@@ -1,6 +1,15 @@
 import os
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+import random
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from functools import wraps
+from flask import g, has_request_context, request
+from sqlalchemy import Column, String, Integer, Boolean, DateTime, ForeignKey, Index, create_engine, event, text
+from sqlalchemy.orm import Query, sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
 import json
 
 
@@ -9,33 +18,393 @@ DB_USER = os.getenv('DB_USER', 'postgres')
 DB_PASSWORD = os.getenv('DB_PASSWORD', 'postgres')
 DB_NAME = os.getenv('DB_NAME', 'trivia')
 DB_PATH = 'postgresql+psycopg2://{}:{}@{}/{}'.format(DB_USER, DB_PASSWORD, DB_HOST, DB_NAME)
-db = SQLAlchemy()
+
+# database of create_app({'DATABASE_PATH': MEMORY_DATABASE_PATH}): an
+# in-memory SQLite database, shared by every app of the process
+MEMORY_DATABASE_PATH = 'sqlite://'
+
+# connection pool of each worker process, size it so that
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) stays under max_connections
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+# seconds to wait for a free connection before failing the request
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
+# seconds after which a connection is replaced
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+# milliseconds after which PostgreSQL cancels a statement, 0 to disable
+DB_STATEMENT_TIMEOUT = int(os.getenv('DB_STATEMENT_TIMEOUT', 30000))
+
+# comma separated URIs of read replicas of DB_PATH, empty for none
+DB_REPLICA_PATHS = [path for path in os.getenv('DB_REPLICA_PATHS', '').split(',') if path]
+# seconds during which a client that wrote reads from the primary
+DB_REPLICA_STICKY_SECONDS = float(os.getenv('DB_REPLICA_STICKY_SECONDS', 5))
+# seconds between two health checks of a replica
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 10))
+# cookie telling until when a client reads from the primary
+PRIMARY_UNTIL_COOKIE = 'db_primary_until'
+
+
+"""
+RoutingSession
+    the Flask-SQLAlchemy session, sending the queries of routes marked
+    @read_replica to a healthy replica, and everything else (writes,
+    flushes, reads of a transaction that wrote, other routes, clients
+    that wrote recently) to the primary.
+"""
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None):
+        router = self.app.extensions.get('db_router')
+        if router is not None and not self._flushing and \
+                not (self.new or self.dirty or self.deleted) and \
+                not self.info.get('wrote') and router.reads_from_replica():
+            engine = router.replica()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def pin_to_primary(session, flush_context):
+    # the rest of the transaction reads its own writes, on the primary
+    session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_transaction_end')
+def unpin_from_primary(session, transaction):
+    if transaction.parent is None:
+        session.info.pop('wrote', None)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+
+"""
+read_replica
+    marks a view whose queries may be served by a read replica.
+"""
+def read_replica(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_replica = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class Replica:
+
+    def __init__(self, path):
+        self.path = path
+        self.engine = create_engine(path, **engine_options(path))
+        self.healthy = True
+        self.checked_at = None
+
+    def check(self):
+        try:
+            with self.engine.connect() as connection:
+                connection.execute(text('SELECT 1'))
+            self.healthy = True
+        except Exception:
+            self.healthy = False
+        self.checked_at = time.monotonic()
+        return self.healthy
+
+
+"""
+ReplicaRouter
+    the read replicas of an app and their health.  A replica is checked
+    with SELECT 1 every check_interval seconds when it is about to be
+    used, and marked down at once when one of its connections drops;
+    reads fail over to the other replicas, then to the primary.
+"""
+class ReplicaRouter:
+
+    def __init__(self, paths, sticky_seconds=DB_REPLICA_STICKY_SECONDS,
+                 check_interval=DB_REPLICA_CHECK_INTERVAL):
+        self.sticky_seconds = sticky_seconds
+        self.check_interval = check_interval
+        self.replicas = [Replica(path) for path in paths]
+        self._lock = threading.Lock()
+        for replica in self.replicas:
+            event.listen(replica.engine, 'handle_error',
+                         self._on_error(replica))
+
+    @staticmethod
+    def _on_error(replica):
+        def mark_down(context):
+            if context.is_disconnect:
+                replica.healthy = False
+                replica.checked_at = time.monotonic()
+        return mark_down
+
+    def reads_from_replica(self):
+        if not has_request_context() or not g.get('read_replica'):
+            return False
+        try:
+            primary_until = float(request.cookies.get(PRIMARY_UNTIL_COOKIE, 0))
+        except ValueError:
+            primary_until = 0
+        return time.time() >= primary_until
+
+    def replica(self):
+        """A healthy replica engine, or None to use the primary."""
+        now = time.monotonic()
+        candidates = []
+        for replica in self.replicas:
+            if replica.checked_at is None or \
+                    now - replica.checked_at > self.check_interval:
+                with self._lock:
+                    if replica.checked_at is None or \
+                            now - replica.checked_at > self.check_interval:
+                        replica.check()
+            if replica.healthy:
+                candidates.append(replica)
+        if not candidates:
+            return None
+        return random.choice(candidates).engine
+
+    def status(self):
+        return [{
+            'replica': replica.engine.url.__to_string__(hide_password=True),
+            'healthy': replica.healthy,
+            'pool': pool_status(replica.engine)
+        } for replica in self.replicas]
+
+
+"""
+TimedQueuePool
+    a QueuePool recording, in its stats, how long checkouts wait for a
+    connection, so the pool can be sized from measurements.
+"""
+class TimedQueuePool(QueuePool):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            self.stats.record(time.perf_counter() - start, failed=True)
+            raise
+        self.stats.record(time.perf_counter() - start)
+        return connection
+
+
+class PoolStats:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.failures = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, wait, failed=False):
+        with self._lock:
+            if failed:
+                self.failures += 1
+            else:
+                self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+
+"""
+memory_connection()
+    the single connection to the in-memory database.  The database lives
+    as long as its connection, so every engine of MEMORY_DATABASE_PATH
+    reuses this one (StaticPool): the schema is created once per process
+    and the apps built afterwards, e.g. one per test, find it ready.
+    pysqlite's own transaction handling is turned off, the engines emit
+    BEGIN themselves (see setup_db) so that SAVEPOINTs work.
+"""
+_memory_connection = None
+_memory_lock = threading.Lock()
+
+
+def memory_connection():
+    global _memory_connection
+    with _memory_lock:
+        if _memory_connection is None:
+            _memory_connection = sqlite3.connect(
+                ':memory:', check_same_thread=False, isolation_level=None)
+        return _memory_connection
+
+
+def begin_memory_transaction(conn):
+    # on the DBAPI connection, so that it is not counted as a query
+    conn.connection.execute('BEGIN')
+
+
+def engine_options(database_path):
+    if database_path == MEMORY_DATABASE_PATH:
+        return {'poolclass': StaticPool, 'creator': memory_connection}
+    if database_path.startswith('sqlite'):
+        return {}
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
+    if database_path.startswith('postgresql') and DB_STATEMENT_TIMEOUT:
+        options['connect_args'] = {
+            'options': '-c statement_timeout={}'.format(DB_STATEMENT_TIMEOUT)}
+    return options
+
+
+"""
+pool_status(engine)
+    the state of an engine's connection pool: configured size, connections
+    in use and idle, overflow, and how long checkouts waited.
+"""
+def pool_status(engine):
+    pool = engine.pool
+    status = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': pool.overflow(),
+        })
+    stats = getattr(pool, 'stats', None)
+    if stats is not None:
+        with stats._lock:
+            attempts = stats.checkouts + stats.failures
+            status.update({
+                'checkouts': stats.checkouts,
+                'checkout_failures': stats.failures,
+                'wait_ms_avg': round(stats.wait_total / attempts * 1000, 3) if attempts else 0,
+                'wait_ms_max': round(stats.wait_max * 1000, 3),
+            })
+    return status
+
 
 """
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+
+    the schema is created and upgraded by flaskr.migrations, not here.
+
+    the session is scoped to the request: it is rolled back when the
+    request raised and removed (its connection returned to the pool) at
+    the end of every request.
 """
-def setup_db(app, database_path=DB_PATH):
+def setup_db(app, database_path=DB_PATH, replica_paths=DB_REPLICA_PATHS):
     
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     db.app = app
     db.init_app(app)
-    db.create_all()
+    if database_path == MEMORY_DATABASE_PATH:
+        event.listen(db.get_engine(app), 'begin', begin_memory_transaction)
+
+    if replica_paths:
+        app.extensions['db_router'] = ReplicaRouter(replica_paths)
+    else:
+        app.extensions.pop('db_router', None)
+
+    @app.teardown_request
+    def shutdown_session(exception=None):
+        if exception is not None:
+            db.session.rollback()
+        db.session.remove()
+
+    @app.after_request
+    def stick_to_primary(response):
+        # read-your-writes: a client that sent a write reads from the
+        # primary for a while, whichever worker serves it
+        router = app.extensions.get('db_router')
+        if router is not None and request.method != 'GET' and \
+                not g.get('read_replica'):
+            response.set_cookie(
+                PRIMARY_UNTIL_COOKIE, str(time.time() + router.sticky_seconds),
+                max_age=int(router.sticky_seconds) + 1, httponly=True)
+        return response
     
 
+"""
+question_listener(fn)
+    registers fn(event, question) to be called once a change to the
+    questions table is committed, event being 'insert' or 'delete' and
+    question the formatted row.  In-memory indexes built from the
+    questions table use it to stay in sync with Question.insert/delete.
+    'purge' reports a question another worker deleted, which may already
+    have been dropped (see flaskr.tombstones.QuestionPurger).
+"""
+question_listeners = []
+
+
+def question_listener(fn):
+    question_listeners.append(fn)
+    return fn
+
+
+def notify_question_listeners(event, question):
+    for listener in question_listeners:
+        listener(event, question)
+
+
+"""
+category_listener(fn)
+    registers fn(event, category) to be called once a change to the
+    categories table is committed, like question_listener.
+"""
+category_listeners = []
+
+
+def category_listener(fn):
+    category_listeners.append(fn)
+    return fn
+
+
+def notify_category_listeners(event, category):
+    for listener in category_listeners:
+        listener(event, category)
+
+
 """
 Question
 
 """
 class Question(db.Model):
     __tablename__ = 'questions'
+    # mirrors flaskr.migrations: category listings and quiz draws, and
+    # the tombstones waiting to be purged
+    __table_args__ = (
+        Index('ix_questions_category_id', 'category', 'id'),
+        Index('ix_questions_category_difficulty', 'category', 'difficulty'),
+        Index('ix_questions_deleted_at', 'deleted_at',
+              postgresql_where=text('deleted_at IS NOT NULL'),
+              sqlite_where=text('deleted_at IS NOT NULL')),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
+    category = Column(Integer, ForeignKey('categories.id'))
     difficulty = Column(Integer)
+    # set when the question is deleted, the row is purged later
+    deleted_at = Column(DateTime)
 
     def __init__(self, question, answer, category, difficulty):
         self.question = question
@@ -45,14 +414,20 @@ class Question(db.Model):
 
     def insert(self):
         db.session.add(self)
+        db.session.flush()
+        question = self.format()
         db.session.commit()
+        notify_question_listeners('insert', question)
+        return question
 
     def update(self):
         db.session.commit()
 
     def delete(self):
-        db.session.delete(self)
+        question = self.format()
+        self.deleted_at = datetime.utcnow()
         db.session.commit()
+        notify_question_listeners('delete', question)
 
     def format(self):
         return {
@@ -64,6 +439,25 @@ class Question(db.Model):
             }
         
 
+"""
+hide_deleted_questions
+    adds deleted_at IS NULL to every ORM query reading Question, whole
+    entities and single columns alike, so that no read path serves a
+    deleted question.  Queries that must see them, e.g. to check the
+    answer of a question deleted during a game, opt out with
+    .execution_options(include_deleted=True).
+"""
+@event.listens_for(Query, 'before_compile', retval=True)
+def hide_deleted_questions(query):
+    if query._execution_options.get('include_deleted'):
+        return query
+    for description in query.column_descriptions:
+        if description['entity'] is Question:
+            return query.enable_assertions(False).filter(
+                Question.deleted_at.is_(None))
+    return query
+
+
 """
 Category
 
@@ -77,7 +471,81 @@ class Category(db.Model):
     def __init__(self, type):
         self.type = type
 
+    def insert(self):
+        db.session.add(self)
+        db.session.flush()
+        category = self.format()
+        db.session.commit()
+        notify_category_listeners('insert', category)
+        return category
+
+    def update(self):
+        db.session.flush()
+        category = self.format()
+        db.session.commit()
+        notify_category_listeners('update', category)
+
+    def delete(self):
+        category = self.format()
+        db.session.delete(self)
+        db.session.commit()
+        notify_category_listeners('delete', category)
+
     def format(self):
         return {
             'id': self.id,
-            'type': self.type}
\ No newline at end of file
+            'type': self.type}
+
+
+"""
+Score
+    the points of a player in a category, ALL_CATEGORIES (0) holding the
+    overall ones.  Written in batches by flaskr.leaderboard, which adds
+    its buffered deltas with an upsert rather than committing each answer.
+"""
+class Score(db.Model):
+    __tablename__ = 'scores'
+
+    player = Column(String, primary_key=True)
+    category = Column(Integer, primary_key=True)
+    points = Column(Integer, nullable=False, default=0)
+    answered = Column(Integer, nullable=False, default=0)
+
+    def format(self):
+        return {
+            'player': self.player,
+            'category': self.category,
+            'points': self.points,
+            'answered': self.answered}
+
+
+"""
+Answer
+    one answer given in a scoring session, bulk inserted with the other
+    buffered answers by flaskr.leaderboard.
+"""
+class Answer(db.Model):
+    __tablename__ = 'answers'
+    # mirrors flaskr.migrations: the answers of a session, one per question
+    __table_args__ = (
+        Index('ix_answers_session', 'session'),
+        Index('ux_answers_session_question', 'session', 'question_id',
+              unique=True),
+    )
+
+    id = Column(Integer, primary_key=True)
+    session = Column(String, nullable=False)
+    player = Column(String, nullable=False)
+    question_id = Column(Integer, nullable=False)
+    category = Column(Integer)
+    correct = Column(Boolean, nullable=False)
+    answered_at = Column(DateTime, nullable=False)
+
+    def format(self):
+        return {
+            'id': self.id,
+            'session': self.session,
+            'player': self.player,
+            'question_id': self.question_id,
+            'category': self.category,
+            'correct': self.correct}
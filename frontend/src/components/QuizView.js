@@ -9,6 +9,7 @@ class QuizView extends Component {
     super();
     this.state = {
       quizCategory: null,
+      questionQueue: [],
       previousQuestions: [],
       showAnswer: false,
       categories: {},
@@ -16,6 +17,9 @@ class QuizView extends Component {
       currentQuestion: {},
       guess: '',
       forceEnd: false,
+      player: '',
+      answers: [],
+      score: null,
     };
   }
 
@@ -35,7 +39,37 @@ class QuizView extends Component {
   }
 
   selectCategory = ({ type, id = 0 }) => {
-    this.setState({ quizCategory: { type, id } }, this.getNextQuestion);
+    // every question of the game is fetched in a single request
+    $.ajax({
+      url: '/quizzes', //TODO: update request URL
+      type: 'POST',
+      dataType: 'json',
+      contentType: 'application/json',
+      data: JSON.stringify({
+        previous_questions: [],
+        quiz_category: { type, id },
+        batch_size: questionsPerPlay,
+      }),
+      xhrFields: {
+        withCredentials: true,
+      },
+      crossDomain: true,
+      success: (result) => {
+        this.setState(
+          { quizCategory: { type, id }, questionQueue: result.questions },
+          this.getNextQuestion
+        );
+        return;
+      },
+      error: (error) => {
+        if (error.status === 404) {
+          this.setState({ quizCategory: { type, id }, forceEnd: true });
+          return;
+        }
+        alert('Unable to start the quiz. Please try your request again');
+        return;
+      },
+    });
   };
 
   handleChange = (event) => {
@@ -48,31 +82,45 @@ class QuizView extends Component {
       previousQuestions.push(this.state.currentQuestion.id);
     }
 
+    // the next question comes from the batch fetched at the start
+    const [nextQuestion, ...questionQueue] = this.state.questionQueue;
+    this.setState({
+      showAnswer: false,
+      previousQuestions: previousQuestions,
+      questionQueue: questionQueue,
+      currentQuestion: nextQuestion || {},
+      guess: '',
+      forceEnd: nextQuestion ? false : true,
+    });
+    if (!nextQuestion || previousQuestions.length === questionsPerPlay) {
+      this.submitScore();
+    }
+  };
+
+  // the answers of the game are scored and ranked in one request
+  submitScore = () => {
+    if (!this.state.player.trim() || !this.state.answers.length) {
+      return;
+    }
     $.ajax({
-      url: '/quizzes', //TODO: update request URL
+      url: '/scores', //TODO: update request URL
       type: 'POST',
       dataType: 'json',
       contentType: 'application/json',
       data: JSON.stringify({
-        previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory,
+        player: this.state.player,
+        answers: this.state.answers,
       }),
       xhrFields: {
         withCredentials: true,
       },
       crossDomain: true,
       success: (result) => {
-        this.setState({
-          showAnswer: false,
-          previousQuestions: previousQuestions,
-          currentQuestion: result.question,
-          guess: '',
-          forceEnd: result.question ? false : true,
-        });
+        this.setState({ score: result.score });
         return;
       },
       error: (error) => {
-        alert('Unable to load question. Please try your request again');
+        alert('Unable to record your score. Please try your request again');
         return;
       },
     });
@@ -84,24 +132,38 @@ class QuizView extends Component {
     this.setState({
       numCorrect: !evaluate ? this.state.numCorrect : this.state.numCorrect + 1,
       showAnswer: true,
+      answers: [
+        ...this.state.answers,
+        { id: this.state.currentQuestion.id, answer: this.state.guess },
+      ],
     });
   };
 
   restartGame = () => {
     this.setState({
       quizCategory: null,
+      questionQueue: [],
       previousQuestions: [],
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
       guess: '',
       forceEnd: false,
+      answers: [],
+      score: null,
     });
   };
 
   renderPrePlay() {
     return (
       <div className='quiz-play-holder'>
+        <input
+          type='text'
+          name='player'
+          placeholder='Your name, to enter the leaderboard'
+          value={this.state.player}
+          onChange={this.handleChange}
+        />
         <div className='choose-header'>Choose Category</div>
         <div className='category-holder'>
           <div className='play-category' onClick={this.selectCategory}>
@@ -132,6 +194,12 @@ class QuizView extends Component {
         <div className='final-header'>
           Your Final Score is {this.state.numCorrect}
         </div>
+        {this.state.score ? (
+          <div className='final-header'>
+            Leaderboard rank #{this.state.score.rank} with{' '}
+            {this.state.score.points} points
+          </div>
+        ) : null}
         <div className='play-again button' onClick={this.restartGame}>
           Play Again?
         </div>